@@ -0,0 +1,449 @@
+'''
+Benchmarks the read, process, and write stages on a synthetic domain_hourly_blocks dataset.
+Runs fully offline: the dataset is generated locally and served through a fake `hdfs` command.
+
+Execution:
+python benchmark.py -s small
+python benchmark.py -s small medium --save-baseline
+python benchmark.py -s large -b benchmark_baseline.json -t 0.5
+python benchmark.py -s medium -c gzip
+'''
+
+import argparse, gzip, json, os, shutil, subprocess, sys, tempfile, timeit
+import pandas as pd
+import numpy as np
+
+
+HEADERS = ['dv_block_reason', 'site_domain', 'Imps_blocked', 'Imps', 'MediaCost', 'Clicks', 'Convs']
+LOCATION = '/dv/domain_hourly_blocks/'
+DAYS_AGO = 2
+
+# rows, distinct domains, part files
+SCALES = {
+    'tiny':   {'rows': 2000,    'domains': 200,    'parts': 2},
+    'small':  {'rows': 20000,   'domains': 2000,   'parts': 4},
+    'medium': {'rows': 200000,  'domains': 20000,  'parts': 8},
+    'large':  {'rows': 2000000, 'domains': 200000, 'parts': 16},
+}
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINE_FILE = os.path.join(REPO_DIR, 'benchmark_baseline.json')
+
+
+def benchmark_feed(days_ago=DAYS_AGO):
+    ''' the double_verify_test feed from config.json, writing to a local csv and stdout '''
+    return {
+        "name":"benchmark",
+        "sources": [
+            {
+                "type":"hdfs",
+                "location":LOCATION,
+                "columns":HEADERS,
+                "filter":{
+                    "days_ago":days_ago
+                }
+            }
+        ],
+        "destinations": [
+            {
+                "type":"CSV",
+                "filename":"benchmark_output.csv"
+            },
+            {
+                "type":"stdout"
+            }
+        ],
+        "operators": [
+            {
+                "column_name_1":"Imps_blocked",
+                "column_name_2":"Imps",
+                "column_name_new":"Fraud",
+                "operation":"/"
+            }
+        ],
+        "selectors": [
+            {
+                "column_name":"dv_block_reason",
+                "comparator":"==",
+                "value":1
+            },
+            {
+                "column_name":"Imps",
+                "comparator":">",
+                "value":5000
+            },
+            {
+                "column_name":"Convs",
+                "comparator":"==",
+                "value":0
+            }
+        ]
+    }
+
+
+def offline_feed(**sections):
+    ''' benchmark_feed read from a csv file and written nowhere, for tests that run its plan on
+    frames in memory. sections are added to the feed, or replace its own
+    '''
+    config = benchmark_feed()
+    config['sources'] = [{"type":"CSV", "filename":"unused.csv"}]
+    config['destinations'] = []
+    config.update(sections)
+    return config
+
+
+##### synthetic data #####
+
+def generate_blocks(rows, domains, skew=1.1, seed=0):
+    ''' Generate a domain_hourly_blocks shaped dataframe.
+    Domains are drawn from a Zipf-like distribution, so a few domains carry most of the rows,
+    and impressions scale with the popularity of the domain.
+    '''
+    rs = np.random.RandomState(seed)
+
+    weights = 1.0 / np.arange(1, domains + 1) ** skew
+    weights /= weights.sum()
+    domain_ids = rs.choice(domains, size=rows, p=weights)
+    site_domain = np.array(['site%d.example.com' % i for i in xrange(domains)], dtype=object)[domain_ids]
+
+    # popular domains get more traffic
+    popularity = (weights / weights[0])[domain_ids]
+    imps = rs.poisson(200 + 20000 * popularity).astype(np.int64)
+    block_rate = rs.beta(1, 8, size=rows)
+    imps_blocked = rs.binomial(imps, block_rate).astype(np.int64)
+    clicks = rs.binomial(imps, 0.002).astype(np.int64)
+    convs = rs.binomial(clicks, 0.05).astype(np.int64)
+    media_cost = np.round(imps * rs.uniform(0.0005, 0.003, size=rows), 4)
+    dv_block_reason = rs.randint(0, 6, size=rows)
+
+    return pd.DataFrame({
+        'dv_block_reason': dv_block_reason,
+        'site_domain': site_domain,
+        'Imps_blocked': imps_blocked,
+        'Imps': imps,
+        'MediaCost': media_cost,
+        'Clicks': clicks,
+        'Convs': convs,
+    }, columns=HEADERS)
+
+
+def day_path(root, location, days_ago):
+    ''' local directory that backs the hdfs partition for n days ago '''
+    import datetime
+    d = datetime.datetime.utcnow() - datetime.timedelta(days=days_ago)
+    return os.path.join(root, location.strip('/'), d.strftime("%Y/%m/%d"))
+
+
+def write_partition(df, root, location=LOCATION, days_ago=DAYS_AGO, parts=4, codec='text'):
+    ''' Lay out a dataframe like a pig output directory: a .pig_header plus headerless part files.
+    With the 'text' codec the parts are uncompressed text, read with `hdfs dfs -text` like any
+    part that cannot be decompressed in process. With 'gzip' they are real .gz parts, read in process by hadoop_codecs.py.
+    '''
+    path = day_path(root, location, days_ago)
+    if not os.path.exists(path):
+        os.makedirs(path)
+
+    with open(os.path.join(path, '.pig_header'), 'w') as h:
+        h.write(','.join(df.columns) + '\n')
+
+    bounds = np.linspace(0, len(df), parts + 1).astype(int)
+    for i in range(parts):
+        part = df.iloc[bounds[i]:bounds[i + 1]]
+        if codec == 'gzip':
+            with gzip.open(os.path.join(path, 'part-r-%05d.gz' % i), 'wb') as f:
+                f.write(part.to_csv(None, header=False, index=False))
+        else:
+            part.to_csv(os.path.join(path, 'part-r-%05d' % i), header=False, index=False)
+    return path
+
+
+##### offline shims #####
+
+FAKE_HDFS = '''#!%(python)s
+# fake hdfs command, serves `hdfs dfs` requests from a local directory
+import glob, gzip, os, shutil, sys, time
+
+root = os.environ['FAKE_HDFS_ROOT']
+
+def local(path):
+    return os.path.join(root, path.lstrip('/'))
+
+def hdfs(path):
+    return '/' + os.path.relpath(path, root)
+
+if len(sys.argv) < 4 or sys.argv[1] != 'dfs':
+    sys.stderr.write('usage: hdfs dfs -ls|-text|-cat|-get <path> [dst]\\n')
+    sys.exit(1)
+
+cmd, path = sys.argv[2], sys.argv[3]
+if cmd == '-ls':
+    names = sorted(os.listdir(local(path)))
+    print 'Found %%d items' %% len(names)
+    for name in names:
+        f = os.path.join(local(path), name)
+        stamp = time.strftime('%%Y-%%m-%%d %%H:%%M', time.localtime(os.path.getmtime(f)))
+        print '-rw-r--r--   3 hadoop supergroup %%10d %%s %%s' %% (os.path.getsize(f), stamp, hdfs(f))
+elif cmd == '-text' and path.endswith('.gz'):
+    with gzip.open(local(path), 'rb') as f:
+        shutil.copyfileobj(f, sys.stdout)
+elif cmd in ('-text', '-cat'):
+    with open(local(path), 'rb') as f:
+        shutil.copyfileobj(f, sys.stdout)
+elif cmd == '-get':
+    dst = sys.argv[4]
+    for f in glob.glob(local(path)) + glob.glob(os.path.join(os.path.dirname(local(path)), '.pig_header')):
+        shutil.copy(f, dst)
+else:
+    sys.stderr.write('unsupported command: ' + cmd + '\\n')
+    sys.exit(1)
+'''
+
+class OfflineEnvironment:
+    ''' Temporary working directory with a fake `hdfs` on the PATH. Use as a context manager. '''
+
+    def __init__(self, root=None):
+        self.root = root
+        self.own_root = root is None
+
+    def __enter__(self):
+        if self.own_root:
+            self.root = tempfile.mkdtemp(prefix='rpw_bench_')
+        self.data = os.path.join(self.root, 'hdfs')
+        self.work = os.path.join(self.root, 'work')
+        self.bin = os.path.join(self.root, 'bin')
+        for d in [self.data, self.work, self.bin]:
+            if not os.path.exists(d):
+                os.makedirs(d)
+
+        hdfs = os.path.join(self.bin, 'hdfs')
+        with open(hdfs, 'w') as f:
+            f.write(FAKE_HDFS % {'python': sys.executable})
+        os.chmod(hdfs, 0755)
+
+        self.saved = (os.getcwd(), os.environ.get('PATH', ''), os.environ.get('PYTHONPATH'))
+        os.environ['FAKE_HDFS_ROOT'] = self.data
+        os.environ['PATH'] = self.bin + os.pathsep + self.saved[1]
+        os.environ['PYTHONPATH'] = os.pathsep.join([REPO_DIR] + ([self.saved[2]] if self.saved[2] else []))
+        os.chdir(self.work)
+        return self
+
+    def __exit__(self, *exc):
+        cwd, path, pythonpath = self.saved
+        os.chdir(cwd)
+        os.environ['PATH'] = path
+        if pythonpath is None:
+            os.environ.pop('PYTHONPATH', None)
+        else:
+            os.environ['PYTHONPATH'] = pythonpath
+        os.environ.pop('FAKE_HDFS_ROOT', None)
+        if self.own_root:
+            shutil.rmtree(self.root, ignore_errors=True)
+        return False
+
+
+class quiet:
+    ''' silence stdout while a stage runs '''
+
+    def __enter__(self):
+        self.stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+
+    def __exit__(self, *exc):
+        sys.stdout.close()
+        sys.stdout = self.stdout
+        return False
+
+
+##### timing #####
+
+def best_of(func, repeat):
+    ''' run func `repeat` times, return (fastest wall time, last result) '''
+    times = []
+    result = None
+    for i in range(repeat):
+        start = timeit.default_timer()
+        with quiet():
+            result = func()
+        times.append(timeit.default_timer() - start)
+    return min(times), result
+
+
+def run_scale(env, scale, repeat=3, seed=0, cold=True, memory_budget=None, codec='text', workers=None):
+    ''' Generate a dataset for one scale and time each stage on it.
+    With a memory budget (MB), an aggregating feed also runs out of core and is checked
+    against the in-memory result. With workers, the operators and selectors also run on
+    that many processes and are checked against the serial result.
+    '''
+    from registry import createReader, createWriter
+    from processor import DataProcessor
+    from spill import process_out_of_core
+    import feed_driver
+
+    spec = SCALES[scale]
+    feed = benchmark_feed()
+    result = {'rows': spec['rows'], 'domains': spec['domains'], 'parts': spec['parts']}
+
+    start = timeit.default_timer()
+    blocks = generate_blocks(spec['rows'], spec['domains'], seed=seed)
+    shutil.rmtree(env.data, ignore_errors=True)
+    write_partition(blocks, env.data, parts=spec['parts'], codec=codec)
+    result['generate'] = timeit.default_timer() - start
+    del blocks
+
+    timings = {}
+    timings['read'], df = best_of(lambda: createReader(feed['sources'][0]).read(), repeat)
+    processor = DataProcessor(feed)
+    timings['operate'], operated = best_of(lambda: processor.operate(df.copy()), repeat)
+    timings['select'], selected = best_of(lambda: processor.select(operated.copy()), repeat)
+    for dest in feed['destinations']:
+        w = createWriter(dest)
+        timings['write_' + dest['type']], _ = best_of(lambda: w.write(selected), repeat)
+    timings['end_to_end'], _ = best_of(lambda: feed_driver.run_feed(feed), repeat)
+
+    if cold:
+        config = os.path.join(env.work, 'benchmark_config.json')
+        with open(config, 'w') as f:
+            json.dump({'feeds': [feed]}, f)
+        driver = os.path.join(REPO_DIR, 'feed_driver.py')
+
+        def cold_run():
+            with open(os.devnull, 'w') as devnull:
+                subprocess.check_call([sys.executable, driver, '-c', config], stdout=devnull)
+        timings['feed_driver'], _ = best_of(cold_run, repeat)
+
+    if memory_budget:
+        # an aggregating feed, once in memory and once spilled within the budget
+        aggregated = benchmark_feed()
+        aggregated['aggregate'] = {"group_by":["site_domain", "dv_block_reason"], "function":"sum"}
+        in_memory, expected = best_of(lambda: feed_driver.process(aggregated, feed_driver.read_sources(aggregated)), repeat)
+        aggregated['memory_budget_mb'] = memory_budget
+        plan = feed_driver.compile_feed(aggregated)
+        timings['out_of_core'], spilled = best_of(
+                lambda: process_out_of_core(plan, feed_driver.read_chunks(aggregated)), repeat)
+        timings['in_memory'] = in_memory
+
+        key = ['site_domain', 'dv_block_reason']
+        same = expected.sort_values(key).reset_index(drop=True).equals(spilled.sort_values(key).reset_index(drop=True))
+        result['out_of_core_matches'] = bool(same)
+        result['rows_out_of_core'] = len(spilled)
+
+    if workers:
+        # operators and selectors once serially and once on row blocks, see parallel.py
+        parallel = benchmark_feed()
+        parallel['parallel'] = {"workers":workers}
+        plan = feed_driver.compile_feed(parallel)
+        timings['process_serial'], expected = best_of(lambda: feed_driver.process(feed, df.copy()), repeat)
+        timings['process_parallel'], blocks = best_of(lambda: plan.process(df.copy()), repeat)
+        result['parallel_matches'] = bool(expected.equals(blocks))
+
+    result['timings'] = timings
+    result['rows_read'] = len(df)
+    result['rows_selected'] = len(selected)
+    return result
+
+
+##### baseline #####
+
+# seconds a stage must slow down by, on top of the tolerance, to be a regression
+MIN_SLOWDOWN = 0.05
+
+def compare(results, baseline, tolerance, min_seconds=MIN_SLOWDOWN):
+    ''' Compare timings against the baseline, returns a list of regression messages.
+    A stage regresses when it is more than `tolerance` (fraction) and more than `min_seconds`
+    slower than its baseline, so timer noise on millisecond stages is not reported.
+    Differing row counts mean the pipeline output changed, which is always reported.
+    '''
+    regressions = []
+    for scale, result in sorted(results.items()):
+        if scale not in baseline:
+            print '%s: no baseline' % scale
+            continue
+        base = baseline[scale]
+
+        for key in ['rows_read', 'rows_selected']:
+            if key in base and base[key] != result[key]:
+                regressions.append('%s %s: %d rows, baseline %d' % (scale, key, result[key], base[key]))
+        if result.get('out_of_core_matches') is False:
+            regressions.append('%s out_of_core: result differs from the in-memory run' % scale)
+        if result.get('parallel_matches') is False:
+            regressions.append('%s process_parallel: result differs from the serial run' % scale)
+
+        print
+        print '%-8s %-16s %10s %10s %8s' % (scale, 'stage', 'seconds', 'baseline', 'ratio')
+        for stage, seconds in sorted(result['timings'].items()):
+            if stage not in base['timings']:
+                print '%-8s %-16s %10.4f %10s' % ('', stage, seconds, '-')
+                continue
+            ratio = seconds / max(base['timings'][stage], 1e-9)
+            flag = ''
+            if ratio > 1 + tolerance and seconds - base['timings'][stage] > min_seconds:
+                flag = '  REGRESSION'
+                regressions.append('%s %s: %.4fs, baseline %.4fs (x%.2f)' % (
+                    scale, stage, seconds, base['timings'][stage], ratio))
+            print '%-8s %-16s %10.4f %10.4f %8.2f%s' % ('', stage, seconds, base['timings'][stage], ratio, flag)
+
+    return regressions
+
+
+if __name__ == "__main__":
+
+    helpdesc = '''
+    Benchmarks the FeedReader, DataProcessor, and FeedWriter stages and the feed_driver end to end
+    on synthetic domain_hourly_blocks data, and compares the timings against a stored baseline.
+    '''
+    parser = argparse.ArgumentParser(description=helpdesc)
+    parser._optionals.title = "For help"
+    optional_group = parser.add_argument_group("OPTIONAL")
+    optional_group.add_argument('-s', dest='scales', type=str, nargs='+', default=['small'], choices=sorted(SCALES), help='Dataset scales to run')
+    optional_group.add_argument('-r', dest='repeat', type=int, default=3, help='Repetitions per stage, the fastest is kept')
+    optional_group.add_argument('-b', dest='baseline', type=str, default=BASELINE_FILE, help='Baseline file, in JSON')
+    optional_group.add_argument('-t', dest='tolerance', type=float, default=0.25, help='Allowed slowdown before a stage is a regression')
+    optional_group.add_argument('--min-seconds', dest='min_seconds', type=float, default=MIN_SLOWDOWN, help='Smallest slowdown, in seconds, that is a regression')
+    optional_group.add_argument('-o', dest='output', type=str, default=None, help='Write the results to this file, in JSON')
+    optional_group.add_argument('--seed', dest='seed', type=int, default=0, help='Random seed for the dataset')
+    optional_group.add_argument('-m', dest='memory_budget', type=float, default=None, help='Also run out of core with this memory budget, in MB')
+    optional_group.add_argument('-w', dest='workers', type=int, default=None, help='Also run the operators and selectors on this many processes')
+    optional_group.add_argument('-c', dest='codec', type=str, default='text', choices=['text', 'gzip'], help='Part file format of the dataset')
+    optional_group.add_argument('--no-cold', dest='cold', action='store_false', help='Skip the feed_driver subprocess run')
+    optional_group.add_argument('--save-baseline', dest='save', action='store_true', help='Store the results as the new baseline')
+
+    args = parser.parse_args()
+    baseline_file = os.path.abspath(args.baseline)
+    output_file = os.path.abspath(args.output) if args.output else None
+
+    results = {}
+    with OfflineEnvironment() as env:
+        for scale in args.scales:
+            print 'Running scale: ' + scale + ' ....'
+            results[scale] = run_scale(env, scale, repeat=args.repeat, seed=args.seed, cold=args.cold,
+                    memory_budget=args.memory_budget, codec=args.codec, workers=args.workers)
+
+    if output_file:
+        with open(output_file, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.save:
+        baseline = {}
+        if os.path.exists(baseline_file):
+            with open(baseline_file) as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(baseline_file, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print 'Baseline saved: ' + baseline_file
+        sys.exit(0)
+
+    if not os.path.exists(baseline_file):
+        print 'No baseline found: ' + baseline_file
+        sys.exit(0)
+
+    with open(baseline_file) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.tolerance, args.min_seconds)
+    print
+    if regressions:
+        print 'Regressions:'
+        for r in regressions:
+            print '  ' + r
+        sys.exit(1)
+    print 'No regressions'
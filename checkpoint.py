@@ -0,0 +1,113 @@
+'''
+Checkpoints between the stages of a feed, so a feed that fails while writing can be retried
+without downloading and processing its sources again.
+The frame is saved after the read, after the operators and after the selectors, and every
+destination records when it has been written. `--resume` starts from the last saved frame,
+and skips the destinations that were already written.
+
+Execution:
+python feed_driver.py -c config.json --resume
+
+example config::
+{
+    "name":"double_verify",
+    "checkpoint":{
+        "directory":"checkpoints",
+        "keep":false
+    },
+    ...
+}
+Checkpoints are keyed by the feed config and the partitions its sources read, so a changed feed
+or the next day starts over: an hdfs source reads the day of its days_ago, the other sources
+count as the day of the run. Destinations are recorded by their own config, a failed destination
+can be fixed before resuming. Checkpoints are removed once every destination is written, unless
+"keep" is set.
+'''
+
+import cPickle, datetime, glob, hashlib, json, os, shutil, time
+from joiner import mb
+from compiler import source_partition
+
+
+def config_key(config):
+    return hashlib.md5(json.dumps(config, sort_keys=True)).hexdigest()
+
+
+def checkpoint_key(feed, now=None):
+    ''' the destinations are left out, a destination can be fixed and the feed resumed '''
+    frames = dict((key, value) for key, value in feed.items() if key != 'destinations')
+    return config_key({'feed': frames, 'partitions': [source_partition(source, now) for source in feed['sources']]})
+
+
+class Checkpoint:
+    ''' The saved frames and written destinations of one run of a feed.
+    Implement:
+    checkpoint = Checkpoint(feed, plan, resume)
+    (done, df) = checkpoint.restore()
+    checkpoint.after(n, df)
+    now is the time of the run, the current time by default.
+    '''
+
+    def __init__(self, feed, plan, resume=False, now=None):
+        config = feed['checkpoint']
+        self.keep = config.get('keep', False)
+        self.directory = os.path.join(config.get('directory', 'checkpoints'), feed['name'] + '-' + checkpoint_key(feed, now))
+
+        # frames are saved after the last operator, the last selector and the last stage,
+        # by the number of plan stages they have been through, 0 is the frame as read
+        self.positions = {0: 'read'}
+        for n, stage in enumerate(plan.stages, 1):
+            if stage.kind in ['operate', 'select']:
+                # only the last stage of each kind
+                self.positions = dict((m, name) for m, name in self.positions.items() if name != stage.kind)
+                self.positions[n] = stage.kind
+        self.positions.setdefault(len(plan.stages), 'processed')
+
+        if not resume and os.path.exists(self.directory):
+            shutil.rmtree(self.directory)
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+
+    def path(self, n, name):
+        return os.path.join(self.directory, '%03d-%s.pkl' % (n, name))
+
+    def after(self, n, df):
+        ''' save the frame after n plan stages, if that is a checkpoint '''
+        if n in self.positions:
+            self.save(n, df)
+
+    def save(self, n, df):
+        start = time.time()
+        path = self.path(n, self.positions.get(n, 'stage'))
+        temp = path + '.tmp'
+        with open(temp, 'wb') as f:
+            cPickle.dump(df, f, cPickle.HIGHEST_PROTOCOL)
+        os.rename(temp, path)
+        print 'Checkpoint %s: %d rows, %s (%.1fs)' % (path, len(df) if df is not None else 0,
+                mb(os.path.getsize(path)), time.time() - start)
+
+    def restore(self):
+        ''' returns (stages done, frame) of the last checkpoint, or (None, None) '''
+        saved = sorted(glob.glob(os.path.join(self.directory, '[0-9][0-9][0-9]-*.pkl')))
+        if not saved:
+            return (None, None)
+        path = saved[-1]
+        with open(path, 'rb') as f:
+            df = cPickle.load(f)
+        print 'Resuming from checkpoint ' + path
+        return (int(os.path.basename(path)[:3]), df)
+
+    def marker(self, dest):
+        return os.path.join(self.directory, 'destination-%s.done' % config_key(dest))
+
+    def written(self, dest):
+        return os.path.exists(self.marker(dest))
+
+    def mark_written(self, dest):
+        with open(self.marker(dest), 'w') as f:
+            f.write(datetime.datetime.utcnow().isoformat() + '\n')
+
+    def finish(self):
+        ''' every destination is written '''
+        if not self.keep:
+            shutil.rmtree(self.directory, ignore_errors=True)
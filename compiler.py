@@ -0,0 +1,647 @@
+'''
+Validates a feed configuration and compiles it into an execution plan before any data is read.
+
+Implement:
+plan = compile_feed(feed)
+print plan.explain()
+df = plan.process(df)
+
+Sources may declare their schema and size, which enables column checks and row estimates::
+{
+    "type":"hdfs",
+    "location":"/dv/domain_hourly_blocks/",
+    "columns":["dv_block_reason","site_domain","Imps_blocked","Imps","MediaCost","Clicks","Convs"],
+    "estimated_rows":20000000,
+    "filter":{
+        "days_ago":1
+    }
+}
+'''
+
+import datetime, json, hashlib
+from processor import DataProcessor
+from joiner import JOIN_TYPES
+from compression import CODECS, missing_module
+from downsample import METHODS as DOWNSAMPLE_METHODS
+from sketch import SUMMARY_COLUMNS
+from parallel import process_blocks, ROW_STAGES
+from expression import compile_expression, ExpressionError
+from registry import readers, writers
+
+
+class ConfigError(Exception):
+    ''' A feed configuration that cannot be executed '''
+    pass
+
+
+# operation -> number of input columns
+OPERATIONS = {
+    '+': 2,
+    '-': 2,
+    '*': 2,
+    '/': 2,
+    '(-)': 1,
+    'str': 1,
+    'int': 1,
+    'expression': None,
+}
+
+# comparator -> estimated fraction of rows kept
+COMPARATORS = {
+    '==': 0.1,
+    '!=': 0.9,
+    '>': 1.0 / 3,
+    '<': 1.0 / 3,
+    '>=': 1.0 / 3,
+    '<=': 1.0 / 3,
+    'null': 0.05,
+    'not null': 0.95,
+    'expression': 1.0 / 3,
+    'in': 0.5,
+    'not in': 0.5,
+}
+ORDERED_COMPARATORS = ['>', '<', '>=', '<=']
+
+def describe_backend(config):
+    desc = config['type']
+    for key in ['location', 'filename', 'service', 'db', 'table']:
+        if key in config:
+            desc += ' ' + str(config[key])
+    return desc
+
+
+def source_partition(source, now=None):
+    ''' what a source reads on a run at now (utc): hdfs sources the day of their days_ago, the
+    others the day of the run. Checkpoints and sketch files use it to tell one day from the next
+    '''
+    if now is None:
+        now = datetime.datetime.utcnow()
+    days_ago = source['filter'].get('days_ago', 1) if source['type'] == 'hdfs' else 0
+    day = now - datetime.timedelta(days=days_ago)
+    return describe_backend(source) + ' ' + day.strftime("%Y/%m/%d")
+
+
+def feed_partition(feed, now=None):
+    ''' what a run of the feed reads, every source with its day '''
+    return ', '.join(source_partition(source, now) for source in feed['sources'])
+
+
+class Stage:
+    ''' One step of a feed plan '''
+
+    def __init__(self, kind, rule=None, columns=None, rows=None, pushdown=False):
+        self.kind = kind
+        self.rule = rule
+        self.columns = columns
+        self.rows = rows
+        self.pushdown = pushdown
+
+    def describe(self):
+        if self.kind in ['read', 'write']:
+            desc = describe_backend(self.rule)
+            backend = (readers if self.kind == 'read' else writers).get(self.rule['type'])
+            if 'downcast' in self.rule:
+                desc += ' (downcast)'
+            flags = sorted(c for c, on in backend.capabilities.items() if on)
+            if flags:
+                desc += '  [' + ', '.join(flags) + ']'
+            return desc
+        elif self.kind == 'operate':
+            if self.rule['operation'] == 'expression':
+                expr = self.rule['expression']
+            elif OPERATIONS[self.rule['operation']] == 1:
+                expr = self.rule['operation'] + ' ' + self.rule['column_name_1']
+            else:
+                expr = self.rule['column_name_1'] + ' ' + self.rule['operation'] + ' ' + self.rule['column_name_2']
+            return self.rule['column_name_new'] + ' = ' + expr
+        elif self.kind == 'join':
+            if 'on' in self.rule:
+                keys = json.dumps(self.rule['on'])
+            else:
+                keys = json.dumps(self.rule['left_on']) + ' = ' + json.dumps(self.rule['right_on'])
+            return self.rule.get('how', 'inner') + ' on ' + keys
+        elif self.kind == 'aggregate':
+            return self.rule.get('function', 'sum') + ' by ' + ', '.join(as_list(self.rule['group_by']))
+        elif self.kind == 'top_n':
+            desc = ('bottom ' if self.rule.get('ascending') else 'top ') + str(self.rule['n'])
+            desc += ' by ' + self.rule['column_name']
+            if self.rule.get('group_by'):
+                desc += ' per ' + ', '.join(as_list(self.rule['group_by']))
+            if self.rule.get('sorted'):
+                desc += ', sorted'
+            return desc
+        elif self.kind == 'sketch':
+            descs = []
+            for rule in self.rule:
+                desc = rule['name'] + ': ' + rule['type'] + ' ' + rule['column_name']
+                if 'weight' in rule:
+                    desc += ' by ' + rule['weight']
+                descs.append(desc)
+            return ', '.join(descs)
+        elif self.kind == 'select':
+            if self.rule['comparator'] == 'expression':
+                return self.rule['expression']
+            desc = self.rule['column_name'] + ' ' + self.rule['comparator']
+            if 'value' in self.rule:
+                desc += ' ' + json.dumps(self.rule['value'])
+            elif 'value_file' in self.rule:
+                desc += ' file ' + self.rule['value_file']
+            elif 'value_source' in self.rule:
+                desc += ' source ' + describe_backend(self.rule['value_source'])
+            if 'bloom' in self.rule:
+                desc += ' (bloom' + ('' if self.rule['bloom'].get('exact', True) else ' only') + ')'
+            return desc
+        return self.kind
+
+
+class FeedPlan:
+    ''' A validated feed: the stages to run in order, with estimated row counts '''
+
+    def __init__(self, feed, sources, stages, destinations):
+        self.feed = feed
+        self.name = feed['name']
+        self.sources = sources
+        self.stages = stages
+        self.destinations = destinations
+
+    def process(self, df, processor=None, start=0, checkpoint=None):
+        ''' run the aggregate, operate, select, top_n and sketch stages on a dataframe,
+        from stage number start, with checkpoint.after(n, df) called after every stage
+        '''
+        if df is None:
+            return df
+        if processor is None:
+            processor = DataProcessor(self.feed)
+
+        filtered = False
+        n = start
+        while n < len(self.stages):
+            stage = self.stages[n]
+            end = self.parallel_end(n, checkpoint)
+            if end is not None:
+                # operators and selectors on row blocks in worker processes, see parallel.py
+                df = process_blocks(df, self.stages[n:end], processor, self.feed['parallel'], filtered)
+                filtered = self.stages[end - 1].kind == 'select'
+                n = end
+                if checkpoint is not None:
+                    checkpoint.after(n, df)
+                continue
+
+            n += 1
+            if stage.kind == 'operate':
+                if filtered:
+                    # operators add columns, give them a frame of their own instead of a slice
+                    df = df.copy()
+                    filtered = False
+                df = processor.operate_single(df, stage.rule)
+            elif stage.kind == 'select':
+                df = processor.select_single(df, stage.rule)
+                filtered = True
+            elif stage.kind == 'top_n':
+                df = processor.top_single(df, stage.rule)
+            elif stage.kind == 'aggregate':
+                df = processor.aggregate_single(df, stage.rule)
+                filtered = False
+            elif stage.kind == 'sketch':
+                df = processor.sketch_single(df, stage.rule)
+            if checkpoint is not None:
+                checkpoint.after(n, df)
+        return df
+
+    def parallel_end(self, n, checkpoint=None):
+        ''' with a "parallel" section, the end of the run of operate and select stages from
+        stage n, which stops at the next checkpoint. None if stage n does not run in parallel
+        '''
+        if 'parallel' not in self.feed or self.stages[n].kind not in ROW_STAGES:
+            return None
+        end = n + 1
+        while end < len(self.stages) and self.stages[end].kind in ROW_STAGES and \
+                (checkpoint is None or end not in checkpoint.positions):
+            end += 1
+        return end
+
+    def explain(self):
+        def rows(n):
+            if n is None:
+                return '?'
+            return str(int(round(n)))
+
+        lines = ['Feed: ' + self.name]
+        if 'memory_budget_mb' in self.feed:
+            mode = 'out of core within %s MB' % self.feed['memory_budget_mb']
+            if 'aggregate' in self.feed:
+                mode += ', spilled by ' + ', '.join(as_list(self.feed['aggregate']['group_by']))
+            lines.append('  ' + mode)
+        if 'checkpoint' in self.feed:
+            lines.append('  checkpoints in ' + self.feed['checkpoint'].get('directory', 'checkpoints'))
+        if 'parallel' in self.feed:
+            parallel = self.feed['parallel']
+            if 'workers' in parallel:
+                mode = 'operators and selectors on %d worker processes' % parallel['workers']
+            else:
+                mode = 'operators and selectors on a worker process per core'
+            if 'block_rows' in parallel:
+                mode += ' in blocks of %d rows' % parallel['block_rows']
+            lines.append('  ' + mode)
+        lines.append('  %-9s %-10s %s' % ('stage', 'est. rows', 'detail'))
+        for stage in self.sources:
+            lines.append('  %-9s %-10s %s' % (stage.kind, rows(stage.rows), stage.describe()))
+        for stage in self.stages:
+            detail = stage.describe()
+            if stage.pushdown:
+                detail += '  [pushed down]'
+            lines.append('  %-9s %-10s %s' % (stage.kind, rows(stage.rows), detail))
+        for stage in self.destinations:
+            lines.append('  %-9s %-10s %s' % (stage.kind, rows(stage.rows), stage.describe()))
+        return '\n'.join(lines)
+
+
+##### validation #####
+
+def require(config, keys, where):
+    missing = [key for key in keys if key not in config]
+    if missing:
+        raise ConfigError(where + ': missing ' + ', '.join(missing))
+
+
+def check_column(column, columns, where):
+    ''' columns is None when the source schema is not declared, column may be a list '''
+    if columns is None:
+        return
+    for name in as_list(column):
+        if name not in columns:
+            raise ConfigError(where + ": unknown column '" + str(name) + "'")
+
+
+def as_list(value):
+    if isinstance(value, basestring):
+        return [value]
+    return list(value)
+
+
+def compile_join(join, left_columns, right_columns, where):
+    ''' returns the left and right key columns '''
+    if 'on' in join:
+        left_on = right_on = as_list(join['on'])
+    else:
+        require(join, ['left_on', 'right_on'], where)
+        left_on = as_list(join['left_on'])
+        right_on = as_list(join['right_on'])
+    if not left_on or len(left_on) != len(right_on):
+        raise ConfigError(where + ': join keys do not pair up')
+    if join.get('how', 'inner') not in JOIN_TYPES:
+        raise ConfigError(where + ": unknown join type '" + join['how'] + "'")
+
+    for column in left_on:
+        check_column(column, left_columns, where)
+    for column in right_on:
+        check_column(column, right_columns, where)
+    return left_on, right_on
+
+
+def join_rows(how, left, right):
+    ''' rough output size of a join '''
+    if left is None or right is None:
+        return None
+    if how == 'left':
+        return left
+    elif how == 'right':
+        return right
+    elif how == 'outer':
+        return max(left, right)
+    return min(left, right)
+
+
+def positive_number(value):
+    return isinstance(value, (int, long, float)) and not isinstance(value, bool) and value > 0
+
+
+def compile_schedule(schedule, where):
+    require(schedule, ['every_minutes'], where)
+    if not positive_number(schedule['every_minutes']):
+        raise ConfigError(where + ': every_minutes must be a positive number')
+
+
+def compile_sources(feed):
+    ''' returns the read and join stages, the combined source schema (None if any source
+    does not declare one) and the estimated row count
+    '''
+    if not feed.get('sources'):
+        raise ConfigError(feed['name'] + ': no sources')
+
+    stages = []
+    columns = []
+    rows = 0
+    for i, source in enumerate(feed['sources']):
+        where = feed['name'] + ' source ' + str(i)
+        require(source, ['type'], where)
+        if not readers.has(source['type']):
+            raise ConfigError(where + ": unknown source type '" + source['type'] + "'")
+        require(source, readers.required(source['type']), where)
+        if 'cache_minutes' in source and not positive_number(source['cache_minutes']):
+            raise ConfigError(where + ': cache_minutes must be a positive number')
+        if 'downcast' in source:
+            compile_downcast(source['downcast'], source.get('columns'), where + ' downcast')
+        stages.append(Stage('read', source, source.get('columns'), source.get('estimated_rows')))
+
+        if 'join' in source:
+            if i == 0:
+                raise ConfigError(where + ': the first source has nothing to join onto')
+            compile_join(source['join'], columns, source.get('columns'), where)
+            rows = join_rows(source['join'].get('how', 'inner'), rows, source.get('estimated_rows'))
+            stages.append(Stage('join', source['join'], rows=rows))
+        elif rows is not None and 'estimated_rows' in source:
+            rows += source['estimated_rows']
+        else:
+            rows = None
+
+        if columns is not None and 'columns' in source:
+            suffixes = source.get('join', {}).get('suffixes', ['', '_right'])
+            shared = [key for key in as_list(source.get('join', {}).get('on', []))]
+            for column in source['columns']:
+                if column not in columns:
+                    columns.append(column)
+                elif 'join' in source and column not in shared:
+                    # overlapping columns of a join are renamed
+                    columns.append(column + suffixes[1])
+        else:
+            columns = None
+
+    return stages, columns, rows
+
+
+DOWNCAST_KEYS = ['float32', 'exclude']
+
+def compile_downcast(config, columns, where):
+    if config == 'auto':
+        return
+    if not isinstance(config, dict):
+        raise ConfigError(where + ': must be "auto" or an object')
+    unknown = [key for key in config if key not in DOWNCAST_KEYS]
+    if unknown:
+        raise ConfigError(where + ': unknown keys ' + ', '.join(unknown))
+    if not isinstance(config.get('float32', []), bool):
+        check_column(config['float32'], columns, where)
+    check_column(config.get('exclude', []), columns, where)
+
+
+def compile_expression_rule(rule, columns, where):
+    ''' parse the expression of a rule, returns the columns it reads '''
+    require(rule, ['expression'], where)
+    try:
+        inputs = compile_expression(rule['expression']).columns
+    except ExpressionError, e:
+        raise ConfigError(where + ': ' + str(e))
+    for column in inputs:
+        check_column(column, columns, where)
+    return inputs
+
+
+def compile_operator(operator, columns, where):
+    require(operator, ['operation', 'column_name_new'], where)
+    if operator['operation'] not in OPERATIONS:
+        raise ConfigError(where + ": unknown operation '" + operator['operation'] + "'")
+    if operator['operation'] == 'expression':
+        return compile_expression_rule(operator, columns, where)
+
+    require(operator, ['column_name_1'], where)
+    inputs = [operator['column_name_1']]
+    if OPERATIONS[operator['operation']] == 2:
+        require(operator, ['column_name_2'], where)
+        inputs.append(operator['column_name_2'])
+    for column in inputs:
+        check_column(column, columns, where)
+    return inputs
+
+
+def compile_selector(selector, columns, where):
+    require(selector, ['comparator'], where)
+    if selector['comparator'] not in COMPARATORS:
+        raise ConfigError(where + ": unknown comparator '" + selector['comparator'] + "'")
+    if selector['comparator'] == 'expression':
+        return compile_expression_rule(selector, columns, where)
+
+    require(selector, ['column_name'], where)
+    if selector['comparator'] in ['in', 'not in']:
+        compile_value_set(selector, where)
+    elif selector['comparator'] not in ['null', 'not null']:
+        require(selector, ['value'], where)
+        value = selector['value']
+        if isinstance(value, (list, dict)) or value is None:
+            raise ConfigError(where + ': value must be a number or a string')
+        if selector['comparator'] in ORDERED_COMPARATORS and isinstance(value, bool):
+            raise ConfigError(where + ': ordered comparator on a boolean value')
+    check_column(selector['column_name'], columns, where)
+    return [selector['column_name']]
+
+
+VALUE_SETS = ['value', 'value_file', 'value_source']
+
+def compile_value_set(selector, where):
+    given = [key for key in VALUE_SETS if key in selector]
+    if len(given) != 1:
+        raise ConfigError(where + ': needs one of ' + ', '.join(VALUE_SETS))
+    if 'value' in selector and not isinstance(selector['value'], list):
+        raise ConfigError(where + ': value must be a list')
+    if 'value_source' in selector:
+        source = selector['value_source']
+        at = where + ' value_source'
+        require(source, ['type'], at)
+        if not readers.has(source['type']):
+            raise ConfigError(at + ": unknown source type '" + source['type'] + "'")
+        require(source, readers.required(source['type']), at)
+    if 'bloom' in selector:
+        bloom = selector['bloom']
+        if not isinstance(bloom, dict) or not 0 < bloom.get('error_rate', 0.001) < 1:
+            raise ConfigError(where + ': bloom error_rate must be between 0 and 1')
+
+
+def compile_top_n(rule, columns, where):
+    require(rule, ['column_name', 'n'], where)
+    if isinstance(rule['n'], bool) or not isinstance(rule['n'], (int, long)) or rule['n'] < 1:
+        raise ConfigError(where + ': n must be a positive integer')
+    inputs = [rule['column_name']] + as_list(rule.get('group_by', []))
+    for column in inputs:
+        check_column(column, columns, where)
+    return inputs
+
+
+SKETCHES = ['distinct', 'heavy_hitters']
+
+def positive_integer(value):
+    return isinstance(value, (int, long)) and not isinstance(value, bool) and value > 0
+
+
+def compile_sketches(rules, columns, where):
+    ''' returns the input columns '''
+    if not isinstance(rules, list) or not rules:
+        raise ConfigError(where + ': must be a list of sketches')
+    names = set()
+    inputs = []
+    for i, rule in enumerate(rules):
+        at = where + ' ' + str(i)
+        require(rule, ['name', 'type', 'column_name'], at)
+        if rule['name'] in names:
+            raise ConfigError(at + ": duplicate name '" + rule['name'] + "'")
+        names.add(rule['name'])
+        if rule['type'] not in SKETCHES:
+            raise ConfigError(at + ": unknown sketch type '" + str(rule['type']) + "'")
+        for key in ['k', 'width', 'depth']:
+            if key in rule and not positive_integer(rule[key]):
+                raise ConfigError(at + ': ' + key + ' must be a positive integer')
+        if 'precision' in rule and not (positive_integer(rule['precision']) and 4 <= rule['precision'] <= 18):
+            raise ConfigError(at + ': precision must be an integer from 4 to 18')
+        for key in ['column_name', 'weight']:
+            if key in rule:
+                check_column(rule[key], columns, at)
+                inputs.append(rule[key])
+    return inputs
+
+
+AGGREGATES = ['sum', 'mean', 'min', 'max', 'count']
+
+def compile_aggregate(rule, columns, where):
+    ''' returns the group keys '''
+    require(rule, ['group_by'], where)
+    keys = as_list(rule['group_by'])
+    if not keys:
+        raise ConfigError(where + ': group_by is empty')
+    if rule.get('function', 'sum') not in AGGREGATES:
+        raise ConfigError(where + ": unknown function '" + rule['function'] + "'")
+    for column in keys:
+        check_column(column, columns, where)
+    return keys
+
+
+def compile_parallel(config, where):
+    if not isinstance(config, dict):
+        raise ConfigError(where + ': must be an object')
+    for key in ['workers', 'block_rows']:
+        if key in config and not positive_integer(config[key]):
+            raise ConfigError(where + ': ' + key + ' must be a positive integer')
+
+
+def compile_memory_budget(feed, where):
+    if not positive_number(feed['memory_budget_mb']):
+        raise ConfigError(where + ': must be a positive number')
+    if [source for source in feed['sources'] if 'join' in source]:
+        raise ConfigError(where + ': joins are not supported out of core')
+
+
+def compile_destinations(feed, columns, rows):
+    stages = []
+    for i, dest in enumerate(feed.get('destinations', [])):
+        where = feed['name'] + ' destination ' + str(i)
+        require(dest, ['type'], where)
+        if not writers.has(dest['type']):
+            raise ConfigError(where + ": unknown destination type '" + dest['type'] + "'")
+        require(dest, writers.required(dest['type']), where)
+        for key in ['column_name', 'x_column_name', 'y_column_name']:
+            if key in dest:
+                check_column(dest[key], columns, where)
+        for key in ['timeout_seconds', 'max_part_bytes']:
+            if key in dest and not positive_number(dest[key]):
+                raise ConfigError(where + ': ' + key + ' must be a positive number')
+        for key in ['chunk_rows', 'max_points']:
+            if key in dest and not positive_integer(dest[key]):
+                raise ConfigError(where + ': ' + key + ' must be a positive integer')
+        if 'compression' in dest:
+            if dest['compression'] not in CODECS:
+                raise ConfigError(where + ": unknown compression '" + str(dest['compression']) + "'")
+            if missing_module(dest['compression']):
+                raise ConfigError(where + ': ' + dest['compression'] + ' compression needs the ' +
+                        missing_module(dest['compression']) + ' package')
+        for key in ['append', 'merge']:
+            if dest.get(key) and not writers.get(dest['type']).supports('append'):
+                raise ConfigError(where + ": '" + dest['type'] + "' destinations cannot " + key)
+        if dest.get('append') and ('compression' in dest or 'max_part_bytes' in dest):
+            raise ConfigError(where + ': append writes a plain csv, without compression or max_part_bytes')
+        if 'downsample' in dest and dest['downsample'] not in DOWNSAMPLE_METHODS:
+            raise ConfigError(where + ": unknown downsample method '" + str(dest['downsample']) + "'")
+        stages.append(Stage('write', dest, rows=rows))
+    return stages
+
+
+def build_plan(feed):
+    if 'name' not in feed:
+        raise ConfigError('feed without a name')
+
+    if 'schedule' in feed:
+        compile_schedule(feed['schedule'], feed['name'] + ' schedule')
+    sources, columns, rows = compile_sources(feed)
+    created = [operator.get('column_name_new') for operator in feed.get('operators', [])]
+
+    aggregate = []
+    keys = None
+    if 'aggregate' in feed:
+        keys = compile_aggregate(feed['aggregate'], columns, feed['name'] + ' aggregate')
+        aggregate.append(Stage('aggregate', feed['aggregate'], keys))
+    if 'memory_budget_mb' in feed:
+        compile_memory_budget(feed, feed['name'] + ' memory_budget_mb')
+    if 'checkpoint' in feed and not isinstance(feed['checkpoint'], dict):
+        raise ConfigError(feed['name'] + ' checkpoint: must be an object')
+    if 'parallel' in feed:
+        compile_parallel(feed['parallel'], feed['name'] + ' parallel')
+
+    operators = []
+    for i, operator in enumerate(feed.get('operators', [])):
+        where = feed['name'] + ' operator ' + str(i)
+        inputs = compile_operator(operator, columns, where)
+        operators.append(Stage('operate', operator, inputs))
+        if columns is not None and operator['column_name_new'] not in columns:
+            columns = columns + [operator['column_name_new']]
+
+    # selectors that only read source columns run before the operators,
+    # so the operators only touch rows that survive the filters.
+    # Selectors on the group keys also run before the aggregate.
+    before_aggregate = []
+    pushed = []
+    selectors = []
+    for i, selector in enumerate(feed.get('selectors', [])):
+        where = feed['name'] + ' selector ' + str(i)
+        inputs = compile_selector(selector, columns, where)
+        stage = Stage('select', selector, inputs)
+        if [column for column in inputs if column in created]:
+            selectors.append(stage)
+        elif keys is not None and [column for column in inputs if column not in keys]:
+            stage.pushdown = bool(operators)
+            pushed.append(stage)
+        else:
+            stage.pushdown = bool(operators) or keys is not None
+            before_aggregate.append(stage)
+
+    stages = before_aggregate + aggregate + pushed + operators + selectors
+    if 'top_n' in feed:
+        inputs = compile_top_n(feed['top_n'], columns, feed['name'] + ' top_n')
+        stages.append(Stage('top_n', feed['top_n'], inputs))
+    if 'sketches' in feed:
+        if 'top_n' in feed:
+            raise ConfigError(feed['name'] + ' sketches: cannot be combined with top_n')
+        inputs = compile_sketches(feed['sketches'], columns, feed['name'] + ' sketch')
+        stages.append(Stage('sketch', feed['sketches'], inputs))
+        # the feed outputs the summary of the sketches
+        columns = SUMMARY_COLUMNS
+
+    for stage in stages:
+        if stage.kind == 'select' and rows is not None:
+            rows = rows * COMPARATORS[stage.rule['comparator']]
+        elif stage.kind == 'top_n' and rows is not None and not stage.rule.get('group_by'):
+            rows = min(rows, stage.rule['n'])
+        elif stage.kind == 'sketch':
+            rows = sum(rule.get('k', 100) if rule['type'] == 'heavy_hitters' else 1 for rule in stage.rule)
+        stage.rows = rows
+
+    destinations = compile_destinations(feed, columns, rows)
+    return FeedPlan(feed, sources, stages, destinations)
+
+
+_plans = {}
+
+def compile_feed(feed):
+    ''' Compile a feed into a FeedPlan, raises ConfigError on an invalid feed.
+    Plans are cached by the content of the feed config.
+    '''
+    key = hashlib.md5(json.dumps(feed, sort_keys=True)).hexdigest()
+    if key not in _plans:
+        _plans[key] = build_plan(feed)
+    return _plans[key]
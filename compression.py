@@ -0,0 +1,221 @@
+'''
+Streaming, compressed csv output for the CSV and mail writers.
+The dataframe is encoded to csv in chunks of rows, a background thread compresses each chunk and
+appends it to a temp file, which is renamed into place once it is complete. Only a few chunks are
+held in memory at a time, however large the dataframe is.
+
+example config::
+{
+    "type":"mail",
+    "filename":"domains.csv",
+    "compression":"gzip",
+    "chunk_rows":100000,
+    "max_part_bytes":10000000,
+    ...
+}
+Each chunk is compressed as its own gzip member (or zstd frame), so the output is a normal .gz file,
+and with "max_part_bytes" it is split into parts of at most that many bytes, each one a complete csv
+with its own header: domains-00000.csv.gz, domains-00001.csv.gz, ... A csv that fits in one part
+keeps the plain name, and parts left by an earlier run that are not written again are removed.
+'''
+
+import os, re, tempfile, threading, time, zlib, Queue
+from joiner import mb
+
+
+def gzip_member(data, level):
+    c = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return c.compress(data) + c.flush()
+
+
+def zstd_frame(data, level):
+    try:
+        import zstandard
+    except ImportError:
+        raise Exception('zstd compression needs the zstandard package')
+    return zstandard.ZstdCompressor(level=level).compress(data)
+
+
+def identity(data, level):
+    return data
+
+
+# compression -> (file extension, compress one chunk into a self contained member, default level)
+CODECS = {
+    'gzip': ('.gz', gzip_member, 6),
+    'zstd': ('.zst', zstd_frame, 3),
+    None: ('', identity, None),
+}
+
+# compression -> the python package it needs
+MODULES = {
+    'zstd': 'zstandard',
+}
+
+
+def missing_module(compression):
+    ''' the package a compression needs when it cannot be imported, otherwise None '''
+    name = MODULES.get(compression)
+    if name is None:
+        return None
+    try:
+        __import__(name)
+        return None
+    except ImportError:
+        return name
+
+
+def part_names(filename, compression, parts):
+    ''' the final file names of a csv split into parts '''
+    ext = CODECS[compression][0]
+    if parts is None or parts == 1:
+        return [filename + ext]
+    (root, csv_ext) = os.path.splitext(filename)
+    return ['%s-%05d%s%s' % (root, i, csv_ext, ext) for i in range(parts)]
+
+
+def stale_parts(filename, compression, paths):
+    ''' the files an earlier run wrote for filename, whole or in parts, that paths do not replace '''
+    ext = CODECS[compression][0]
+    (root, csv_ext) = os.path.splitext(os.path.basename(filename))
+    pattern = re.compile(re.escape(root) + r'-\d{5}' + re.escape(csv_ext + ext) + '$')
+    directory = os.path.dirname(os.path.abspath(filename))
+    keep = set(os.path.abspath(path) for path in paths)
+    stale = []
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if (pattern.match(name) or name == os.path.basename(filename) + ext) and path not in keep:
+            stale.append(path)
+    return stale
+
+
+class CompressedFile:
+    ''' Compress chunks of bytes on a background thread into one or more temp files.
+    Implement:
+    f = CompressedFile('domains.csv', 'gzip', header)
+    f.write(chunk)
+    paths = f.close()
+    '''
+
+    def __init__(self, filename, compression='gzip', header='', max_part_bytes=None, level=None, queue_chunks=2):
+        if compression not in CODECS:
+            raise Exception('Unknown compression: ' + str(compression))
+        self.filename = filename
+        self.compression = compression
+        (self.ext, self.compress, default_level) = CODECS[compression]
+        self.level = default_level if level is None else level
+        self.max_part_bytes = max_part_bytes
+        self.directory = os.path.dirname(os.path.abspath(filename))
+        self.header = self.compress(header, self.level) if header else ''
+
+        self.temps = []
+        self.part = None
+        self.part_bytes = 0
+        self.raw_bytes = 0
+        self.written = 0
+        self.error = None
+        self.queue = Queue.Queue(maxsize=queue_chunks)
+        self.thread = threading.Thread(target=self.run, name='compress-' + os.path.basename(filename))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def new_part(self):
+        if self.part is not None:
+            self.part.close()
+        (fd, path) = tempfile.mkstemp(prefix='.' + os.path.basename(self.filename), suffix='.tmp', dir=self.directory)
+        self.temps.append(path)
+        self.part = os.fdopen(fd, 'wb')
+        self.part.write(self.header)
+        self.part_bytes = len(self.header)
+
+    def append(self, member):
+        if self.part is None:
+            self.new_part()
+        elif self.max_part_bytes and self.part_bytes > len(self.header) \
+                and self.part_bytes + len(member) > self.max_part_bytes:
+            self.new_part()
+        if self.max_part_bytes and len(self.header) + len(member) > self.max_part_bytes:
+            print 'A chunk of %s is over max_part_bytes, lower chunk_rows' % mb(len(member))
+        self.part.write(member)
+        self.part_bytes += len(member)
+        self.written += len(member)
+
+    def run(self):
+        while True:
+            chunk = self.queue.get()
+            if chunk is None:
+                break
+            if self.error is not None:
+                continue
+            try:
+                self.append(self.compress(chunk, self.level))
+            except Exception, e:
+                self.error = e
+
+    def write(self, chunk):
+        ''' queue a chunk of bytes, blocks while the background thread is behind '''
+        if self.error is not None:
+            raise self.error
+        if isinstance(chunk, unicode):
+            chunk = chunk.encode('utf-8')
+        if chunk:
+            self.raw_bytes += len(chunk)
+            self.queue.put(chunk)
+
+    def abort(self):
+        self.queue.put(None)
+        self.thread.join()
+        if self.part is not None:
+            self.part.close()
+        for path in self.temps:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def close(self):
+        ''' finish the temp files and rename them into place, returns the final paths '''
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            self.abort()
+            raise self.error
+        if self.part is None:
+            self.new_part()
+        self.part.close()
+
+        paths = part_names(self.filename, self.compression, len(self.temps) if self.max_part_bytes else None)
+        for path in stale_parts(self.filename, self.compression, paths):
+            os.remove(path)
+        umask = os.umask(0)
+        os.umask(umask)
+        for (temp, path) in zip(self.temps, paths):
+            # mkstemp files are private, give them the permissions of a normally created file
+            os.chmod(temp, 0666 & ~umask)
+            os.rename(temp, path)
+        return paths
+
+
+def write_csv(data, filename, compression='gzip', chunk_rows=100000, max_part_bytes=None, level=None, **kwargs):
+    ''' Write a dataframe or series as compressed csv, kwargs are passed on to to_csv.
+    Returns the paths that were written.
+    '''
+    start = time.time()
+    header = ''
+    if kwargs.get('header', True) is not False and hasattr(data, 'columns'):
+        # the header line alone, repeated at the top of every part
+        header = data.iloc[:0].to_csv(None, **kwargs)
+        if isinstance(header, unicode):
+            header = header.encode('utf-8')
+    kwargs['header'] = False
+
+    f = CompressedFile(filename, compression, header, max_part_bytes, level)
+    try:
+        for i in xrange(0, len(data), chunk_rows):
+            f.write(data.iloc[i:i + chunk_rows].to_csv(None, **kwargs))
+    except:
+        f.abort()
+        raise
+    paths = f.close()
+
+    print 'Wrote %s in %d file(s): %s of csv as %s (%.1fs)' % (filename, len(paths), mb(f.raw_bytes + len(header)),
+            mb(f.written + len(f.header) * len(paths)), time.time() - start)
+    return paths
@@ -0,0 +1,66 @@
+'''
+API consoles and database connections shared by the readers and writers.
+A long running process (feed_driver.py --daemon) logs in once per worker thread and keeps
+the connections warm across feed runs, instead of connecting for every reader and writer.
+
+Implement:
+(base, console) = api_console('dw-prod')
+db = database('vertica')
+'''
+
+import threading
+
+
+# environment name -> api base
+ENVIRONMENTS = {
+    'prod': 'dw-prod',
+    'dw-prod': 'dw-prod',
+    'sand': 'dw-sand',
+    'dw-sand': 'dw-sand',
+    'ctest': 'dw-ctest',
+    'dw-ctest': 'dw-ctest',
+    'api-prod': 'api-prod',
+    'api-sand': 'api-sand',
+    'api-ctest': 'api-ctest',
+}
+
+# connections are not shared between threads
+_local = threading.local()
+
+
+def cache():
+    if not hasattr(_local, 'consoles'):
+        _local.consoles = {}
+        _local.databases = {}
+    return _local
+
+
+def api_console(environment):
+    ''' returns (base, console), the console is None for the api-* environments '''
+    if environment not in ENVIRONMENTS:
+        raise Exception('Environment not found')
+    base = ENVIRONMENTS[environment]
+    if base.startswith('api'):
+        return (base, None)
+
+    consoles = cache().consoles
+    if base not in consoles:
+        from AnxPy import Console
+        from AnxPy.environ import DW_PROD, DW_CTEST, DW_SAND
+        consoles[base] = Console({'dw-prod': DW_PROD, 'dw-sand': DW_SAND, 'dw-ctest': DW_CTEST}[base])
+    return (base, consoles[base])
+
+
+def database(name):
+    ''' a Link database connection, by its name in the Link config '''
+    databases = cache().databases
+    if name not in databases:
+        from link import lnk
+        databases[name] = getattr(lnk.dbs, name)
+    return databases[name]
+
+
+def reset():
+    ''' forget the connections of this thread, after a failure they may be broken '''
+    _local.consoles = {}
+    _local.databases = {}
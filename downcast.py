@@ -0,0 +1,185 @@
+'''
+Shrinks the frame of a source right after it is read. Readers produce int64, float64 and object
+columns, most of which fit in far less: counters fit in int32 or smaller, and the hdfs readers
+give numbers as text. Every column's memory before and after is printed.
+
+example config::
+{
+    "type":"hdfs",
+    "location":"/dv/domain_hourly_blocks/",
+    "downcast":"auto"
+}
+{
+    "type":"hdfs",
+    "location":"/dv/domain_hourly_blocks/",
+    "downcast":{
+        "float32":["MediaCost"],
+        "exclude":["site_id"]
+    }
+}
+"auto" only makes changes that keep every value as it was read:
+- text or object columns where every value is a number become numeric columns, text with a
+  leading zero (ids, zip codes) is kept as text
+- integers become the smallest of int8, int16 and int32 that holds their observed range
+- floats become float32 when every value is exactly a float32
+"float32" also rounds the listed float columns (or every float column with true) to float32,
+and "exclude" leaves columns as they were read.
+
+Operators, expressions and aggregates compute on the 64 bit values, so the results are the
+same as without downcasting.
+
+Implement:
+df = downcast(reader.read(), "auto", "hdfs /dv/domain_hourly_blocks/")
+'''
+
+import sys
+import pandas as pd
+import numpy as np
+from joiner import mb
+
+
+INTEGERS = [np.int8, np.int16, np.int32]
+NUMBER_TYPES = ['integer', 'floating', 'mixed-integer-float', 'decimal']
+TEXT_TYPES = ['string', 'unicode', 'bytes']
+SAMPLE_ROWS = 1000
+
+# bytes of '.', 'e' and 'E', text with them stays float
+FLOAT_BYTES = [46, 101, 69]
+
+
+def column_bytes(column):
+    ''' memory of a column, the objects of an object column are estimated from a sample '''
+    n = len(column)
+    if column.dtype != object or not n:
+        return int(column.values.nbytes)
+    sample = column.values[np.linspace(0, n - 1, min(n, SAMPLE_ROWS)).astype(np.int64)]
+    return int(n * (8 + np.mean([sys.getsizeof(value) for value in sample])))
+
+
+def parse_text(values):
+    ''' numbers of an array of numeric strings, None if any string is not a number or has a leading zero '''
+    try:
+        text = values.astype('S')
+    except (UnicodeError, ValueError, TypeError):
+        return None
+    width = text.dtype.itemsize
+    chars = text.view(np.uint8).reshape(-1, width)
+    if width > 1 and ((chars[:, 0] == 48) & (chars[:, 1] >= 48) & (chars[:, 1] <= 57)).any():
+        return None
+
+    try:
+        numbers = text.astype(np.float64)
+    except ValueError:
+        # missing values, or text that numpy does not parse
+        try:
+            return pd.to_numeric(values)
+        except (ValueError, TypeError):
+            return None
+    if np.isin(chars, FLOAT_BYTES).any() or not np.isfinite(numbers).all():
+        return numbers
+    if len(numbers) and np.abs(numbers).max() >= 2 ** 53:
+        # beyond the integers a double holds exactly
+        return text.astype(np.int64)
+    return numbers.astype(np.int64)
+
+
+def parse_numbers(values):
+    ''' numbers of an object array, None if it holds anything else '''
+    sample = values[:SAMPLE_ROWS]
+    present = sample[pd.notnull(sample)]
+    kind = pd.api.types.infer_dtype(present, skipna=True) if len(present) else None
+    if kind in TEXT_TYPES:
+        return parse_text(values)
+    if kind in NUMBER_TYPES:
+        try:
+            return pd.to_numeric(values)
+        except (ValueError, TypeError):
+            return None
+    return None
+
+
+def smallest_integer(values):
+    if not len(values):
+        return values
+    low = values.min()
+    high = values.max()
+    for dtype in INTEGERS:
+        if np.dtype(dtype).itemsize >= values.dtype.itemsize:
+            break
+        info = np.iinfo(dtype)
+        if info.min <= low and high <= info.max:
+            return values.astype(dtype)
+    return values
+
+
+def shrink(values, float32=False):
+    ''' the values in the smallest dtype that holds them '''
+    if values.dtype == object:
+        numbers = parse_numbers(values)
+        if numbers is None:
+            return values
+        values = numbers
+
+    if values.dtype == np.uint64 and len(values) and values.max() <= np.iinfo(np.int64).max:
+        values = values.astype(np.int64)
+    if values.dtype.kind == 'i':
+        return smallest_integer(values)
+    if values.dtype.kind == 'f' and values.dtype.itemsize > 4:
+        narrow = values.astype(np.float32)
+        if float32 or ((narrow == values) | np.isnan(values)).all():
+            return narrow
+    return values
+
+
+def downcast(df, config='auto', name=None):
+    ''' a frame with every column in the smallest dtype that holds its values, see above '''
+    if df is None or not len(df.columns):
+        return df
+    if config == 'auto':
+        config = {}
+    exclude = config.get('exclude', [])
+    float32 = config.get('float32', [])
+    if isinstance(exclude, basestring):
+        exclude = [exclude]
+    if isinstance(float32, basestring):
+        float32 = [float32]
+
+    columns = []
+    report = []
+    for i, column in enumerate(df.columns):
+        before = df.iloc[:, i]
+        if column in exclude:
+            columns.append(before.values)
+            continue
+        values = shrink(before.values, float32 is True or column in float32)
+        after = pd.Series(values)
+        report.append((column, before.dtype, values.dtype, column_bytes(before), column_bytes(after)))
+        columns.append(values)
+
+    result = pd.DataFrame(dict(zip(range(len(columns)), columns)), index=df.index, columns=range(len(columns)))
+    result.columns = df.columns
+
+    total_before = sum(r[3] for r in report)
+    total_after = sum(r[4] for r in report)
+    print 'Downcast %s: %d rows, %s -> %s' % (name or 'source', len(df), mb(total_before), mb(total_after))
+    for (column, dtype_before, dtype_after, bytes_before, bytes_after) in report:
+        print '  %-24s %-8s -> %-8s %10s -> %s' % (column, dtype_before, dtype_after, mb(bytes_before), mb(bytes_after))
+    return result
+
+
+def wide(value):
+    ''' a scalar of a downcast column, as the 64 bit scalar it was read as '''
+    if isinstance(value, np.signedinteger):
+        return np.int64(value)
+    if isinstance(value, np.floating):
+        return np.float64(value)
+    return value
+
+
+def widen(values):
+    ''' the values of a downcast column as 64 bit numbers, so arithmetic cannot overflow '''
+    if values.dtype.kind in 'iu' and values.dtype.itemsize < 8:
+        return values.astype(np.int64)
+    if values.dtype.kind == 'f' and values.dtype.itemsize < 8:
+        return values.astype(np.float64)
+    return values
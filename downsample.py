@@ -0,0 +1,113 @@
+'''
+Reduces a series to a bounded number of points before it is charted, so a chart of millions of rows
+renders as fast as one of a few thousand and keeps the shape of the data.
+
+lttb        Largest-Triangle-Three-Buckets, keeps the points that shape the line the most
+minmax      the lowest and highest point of each bucket, keeps every spike
+mean, sum, min, max, count
+            equal width buckets along x with the y values aggregated, for time series
+
+example config::
+{
+    "type":"chart",
+    "filename":"chart.png",
+    "x_column_name":"hour",
+    "y_column_name":"Imps_blocked",
+    "max_points":2000,
+    "downsample":"lttb"
+}
+
+Implement:
+(x, y) = downsample(x, y, 2000, 'lttb')
+'''
+
+import pandas as pd
+import numpy as np
+
+
+AGGREGATES = ['mean', 'sum', 'min', 'max', 'count']
+METHODS = ['lttb', 'minmax'] + AGGREGATES
+
+
+def lttb(x, y, n):
+    ''' positions of n points chosen by Largest-Triangle-Three-Buckets, x must be sorted '''
+    size = len(x)
+    if n >= size or n < 3:
+        return np.arange(size) if n >= size else np.array([0, size - 1][:max(n, 0)])
+
+    # the first and last points are kept, the others are split into n - 2 buckets
+    edges = np.linspace(1, size - 1, n - 1).astype(np.int64)
+    selected = np.empty(n, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = size - 1
+    a = 0
+    for i in range(n - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else size
+        # the third corner is the average of the next bucket
+        cx = x[end:next_end].mean()
+        cy = y[end:next_end].mean()
+        area = np.abs((x[a] - cx) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (cy - y[a]))
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+
+def minmax(x, y, n):
+    ''' positions of the lowest and highest point of n / 2 buckets, and of the end points '''
+    size = len(x)
+    if n >= size:
+        return np.arange(size)
+    buckets = n // 2 - 1
+    if buckets < 1:
+        # no room for a bucket next to the end points
+        return np.array([0, size - 1][:max(n, 0)])
+    edges = np.linspace(0, size, buckets + 1).astype(np.int64)
+    positions = [0, size - 1]
+    for start, end in zip(edges[:-1], edges[1:]):
+        positions.append(start + int(np.argmin(y[start:end])))
+        positions.append(start + int(np.argmax(y[start:end])))
+    return np.unique(positions)
+
+
+def aggregate(x, y, n, function):
+    ''' y aggregated over n equal width buckets of x, at the mean x of each bucket '''
+    if not len(x):
+        return (x, y)
+    low, high = x[0], x[-1]
+    if high > low:
+        bucket = np.minimum(((x - low) / float(high - low) * n).astype(np.int64), n - 1)
+    else:
+        bucket = np.zeros(len(x), dtype=np.int64)
+    grouped = pd.DataFrame({'x': x, 'y': y}).groupby(bucket)
+    return (grouped['x'].mean().values, grouped['y'].agg(function).values)
+
+
+def numeric(values):
+    values = np.asarray(values)
+    if values.dtype.kind not in 'iuf':
+        values = pd.to_numeric(values)
+    return values.astype(np.float64)
+
+
+def downsample(x, y, n, method='lttb'):
+    ''' at most n points of the series (x, y), sorted by x, as numpy arrays '''
+    if method not in METHODS:
+        raise Exception('Unknown downsample method: ' + str(method))
+    x = numeric(x)
+    y = numeric(y)
+    keep = ~(np.isnan(x) | np.isnan(y))
+    if not keep.all():
+        x = x[keep]
+        y = y[keep]
+    if len(x) > 1 and (np.diff(x) < 0).any():
+        order = np.argsort(x, kind='mergesort')
+        x = x[order]
+        y = y[order]
+
+    if method in AGGREGATES:
+        return aggregate(x, y, n, method)
+    if len(x) <= n:
+        return (x, y)
+    positions = lttb(x, y, n) if method == 'lttb' else minmax(x, y, n)
+    return (x[positions], y[positions])
@@ -7,6 +7,7 @@ by Bereket Abraham
 from reader import *
 from processor import *
 from writer import *
+from joiner import Joiner
 import pandas as pd
 import numpy as np
 
@@ -22,7 +23,16 @@ r = createReader(source)
 domain_seller_dvcode = r.read()
 
 # dv_block_reason,site_domain,Imps_blocked,Imps,MediaCost,Clicks,Convs
-domain_dvcode = df.groupby(by=['site_domain','dv_block_reason'], as_index=False).aggregate(np.sum).sort(columns=['Imps'], ascending=[False])
+domain_dvcode = df.groupby(by=['site_domain','dv_block_reason'], as_index=False).aggregate(np.sum)
+# only the top domains of each block reason are used, no need for a full sort
+top_domains = {
+    "top_n": {
+        "column_name":"Imps",
+        "n":5000,
+        "group_by":["dv_block_reason"]
+    }
+}
+domain_dvcode = DataProcessor(top_domains).top(domain_dvcode)
 domain_total = df.groupby(by=['site_domain'], as_index=False).aggregate(np.sum) # dv_block_reason broken
 domain_total = domain_total[[ 'site_domain','Imps_blocked','Imps','MediaCost','Clicks','Convs' ]]
 
@@ -31,7 +41,12 @@ for i in range(len(h)):
     h[i] = h[i] + '_total'
 domain_total.columns = h
 
-domain_dvcode = merge(domain_dvcode, domain_total, left_on='site_domain', right_on='site_domain_total', how='left')
+join = {
+    "left_on":"site_domain",
+    "right_on":"site_domain_total",
+    "how":"left"
+}
+domain_dvcode = Joiner(join).join(domain_dvcode, domain_total)
 
 create_fraud = {
     "column_name_1":"Imps",
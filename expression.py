@@ -0,0 +1,241 @@
+'''
+Arithmetic and boolean expressions over dataframe columns, parsed once and evaluated in blocks.
+
+Implement:
+e = compile_expression("(Imps_blocked - Clicks) / Imps * 100")
+values = e.evaluate(df)
+
+Used by the "expression" operation and the "expression" comparator of the DataProcessor.
+Division by zero gives NaN, like the "/" operation.
+'''
+
+import ast
+import pandas as pd
+import numpy as np
+from downcast import widen
+
+try:
+    import numexpr
+except ImportError:
+    numexpr = None
+
+
+class ExpressionError(Exception):
+    ''' An expression that cannot be parsed or uses unsupported syntax '''
+    pass
+
+
+# rows per block, so the temporaries of a block stay in cache
+BLOCK_ROWS = 16384
+# numexpr splits its input into cache sized blocks on several threads itself, it gets larger ones
+NUMEXPR_BLOCK_ROWS = 1048576
+
+BINARY = {
+    ast.Add: (np.add, '+'),
+    ast.Sub: (np.subtract, '-'),
+    ast.Mult: (np.multiply, '*'),
+    ast.Mod: (np.mod, '%'),
+    ast.Pow: (np.power, '**'),
+}
+COMPARE = {
+    ast.Eq: (np.equal, '=='),
+    ast.NotEq: (np.not_equal, '!='),
+    ast.Lt: (np.less, '<'),
+    ast.LtE: (np.less_equal, '<='),
+    ast.Gt: (np.greater, '>'),
+    ast.GtE: (np.greater_equal, '>='),
+}
+
+
+def divide(a, b):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result = np.true_divide(a, b)
+    return np.where(np.asarray(b) == 0, np.nan, result)
+
+
+class Expression:
+    ''' A parsed expression. Columns are referenced by name, e.g.
+    "(Imps_blocked - Clicks) / Imps * 100"
+    "Imps > 5000 and Convs == 0 and not (dv_block_reason == 3)"
+    '''
+
+    def __init__(self, text):
+        self.text = text
+        try:
+            self.tree = ast.parse(text.strip(), mode='eval').body
+        except SyntaxError, e:
+            raise ExpressionError("invalid expression '" + text + "': " + str(e))
+        self.columns = []
+        self.strings = False
+        self.check(self.tree)
+        self.numexpr_text = self.to_numexpr(self.tree)
+
+    def check(self, node):
+        ''' reject anything but columns, literals, arithmetic, comparisons, and boolean logic '''
+        if isinstance(node, ast.Name):
+            if node.id not in self.columns:
+                self.columns.append(node.id)
+        elif isinstance(node, ast.Num):
+            pass
+        elif isinstance(node, ast.Str):
+            self.strings = True
+        elif isinstance(node, ast.BinOp) and (type(node.op) in BINARY or isinstance(node.op, ast.Div)):
+            self.check(node.left)
+            self.check(node.right)
+        elif isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd, ast.Not)):
+            self.check(node.operand)
+        elif isinstance(node, ast.BoolOp):
+            for value in node.values:
+                self.check(value)
+        elif isinstance(node, ast.Compare) and all(type(op) in COMPARE for op in node.ops):
+            self.check(node.left)
+            for comparator in node.comparators:
+                self.check(comparator)
+        else:
+            raise ExpressionError("unsupported syntax in '" + self.text + "': " + type(node).__name__)
+
+    def is_boolean(self, node):
+        return isinstance(node, (ast.Compare, ast.BoolOp)) or \
+                (isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not))
+
+    def to_numexpr(self, node):
+        ''' the same expression in numexpr syntax, None if numexpr cannot evaluate it.
+        numexpr has no string columns, and its boolean operators are bitwise, so they only
+        translate when their operands are already booleans.
+        '''
+        if self.strings:
+            return None
+        if isinstance(node, ast.Name):
+            return node.id
+        elif isinstance(node, ast.Num):
+            return repr(node.n)
+
+        if isinstance(node, ast.BinOp):
+            operands = [node.left, node.right]
+        elif isinstance(node, ast.UnaryOp):
+            operands = [node.operand]
+        elif isinstance(node, ast.BoolOp):
+            operands = node.values
+        else:
+            operands = [node.left] + node.comparators
+        if isinstance(node, ast.BoolOp) or isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+            if not all(self.is_boolean(operand) for operand in operands):
+                return None
+        terms = [self.to_numexpr(operand) for operand in operands]
+        if None in terms:
+            return None
+
+        if isinstance(node, ast.BinOp):
+            if isinstance(node.op, ast.Div):
+                return 'where((%s) == 0, nan, (%s) / (%s))' % (terms[1], terms[0], terms[1])
+            return '(%s %s %s)' % (terms[0], BINARY[type(node.op)][1], terms[1])
+        elif isinstance(node, ast.UnaryOp):
+            if isinstance(node.op, ast.Not):
+                return '(~%s)' % terms[0]
+            return '(%s%s)' % ('-' if isinstance(node.op, ast.USub) else '+', terms[0])
+        elif isinstance(node, ast.BoolOp):
+            op = ' & ' if isinstance(node.op, ast.And) else ' | '
+            return '(' + op.join(terms) + ')'
+        parts = ['(%s %s %s)' % (terms[i], COMPARE[type(op)][1], terms[i + 1]) for i, op in enumerate(node.ops)]
+        return '(' + ' & '.join(parts) + ')'
+
+    def evaluate_node(self, node, block):
+        if isinstance(node, ast.Name):
+            return block[node.id]
+        elif isinstance(node, ast.Num):
+            return node.n
+        elif isinstance(node, ast.Str):
+            return node.s
+        elif isinstance(node, ast.BinOp):
+            left = self.evaluate_node(node.left, block)
+            right = self.evaluate_node(node.right, block)
+            if isinstance(node.op, ast.Div):
+                return divide(left, right)
+            return BINARY[type(node.op)][0](left, right)
+        elif isinstance(node, ast.UnaryOp):
+            operand = self.evaluate_node(node.operand, block)
+            if isinstance(node.op, ast.Not):
+                return np.logical_not(operand)
+            elif isinstance(node.op, ast.USub):
+                return np.negative(operand)
+            return operand
+        elif isinstance(node, ast.BoolOp):
+            combine = np.logical_and if isinstance(node.op, ast.And) else np.logical_or
+            result = self.evaluate_node(node.values[0], block)
+            for value in node.values[1:]:
+                result = combine(result, self.evaluate_node(value, block))
+            return result
+        elif isinstance(node, ast.Compare):
+            left = self.evaluate_node(node.left, block)
+            result = None
+            for op, comparator in zip(node.ops, node.comparators):
+                right = self.evaluate_node(comparator, block)
+                with np.errstate(invalid='ignore'):
+                    # NaN compares False, as in pandas
+                    term = COMPARE[type(op)][0](left, right)
+                result = term if result is None else np.logical_and(result, term)
+                left = right
+            return result
+
+    def column_values(self, df):
+        ''' numpy arrays of the referenced columns, object columns are read as numbers when they are numeric '''
+        missing = [column for column in self.columns if column not in df.columns]
+        if missing:
+            raise ExpressionError("unknown column in '" + self.text + "': " + ', '.join(missing))
+
+        values = {}
+        for column in self.columns:
+            v = df[column].values
+            if v.dtype == object and not self.strings:
+                try:
+                    v = v.astype(np.float64)
+                except (ValueError, TypeError):
+                    pass
+            values[column] = v
+        return values
+
+    def evaluate_numexpr(self, block):
+        local = dict(block)
+        local['nan'] = np.nan
+        return numexpr.evaluate(self.numexpr_text, local_dict=local, truediv=True)
+
+    def evaluate(self, df, block_rows=BLOCK_ROWS):
+        ''' evaluate over every row of df, returns a numpy array '''
+        n = len(df)
+        values = self.column_values(df)
+
+        if numexpr is not None and self.numexpr_text is not None and \
+                all(v.dtype != object for v in values.values()):
+            evaluate_block = self.evaluate_numexpr
+            block_rows = max(block_rows, NUMEXPR_BLOCK_ROWS)
+        else:
+            evaluate_block = lambda block: self.evaluate_node(self.tree, block)
+
+        out = None
+        for start in xrange(0, max(n, 1), block_rows):
+            # downcast columns are computed on as 64 bit numbers, so they cannot overflow.
+            # They are widened a block at a time, not copied whole
+            block = dict((column, widen(v[start:start + block_rows])) for column, v in values.items())
+            result = np.asarray(evaluate_block(block))
+            if out is None:
+                out = np.empty(n, dtype=result.dtype)
+            elif result.dtype != out.dtype and np.can_cast(out.dtype, result.dtype):
+                out = out.astype(result.dtype)
+            out[start:start + block_rows] = result
+        return out
+
+    def mask(self, df):
+        ''' evaluate as a boolean row filter '''
+        result = self.evaluate(df)
+        if result.dtype != bool:
+            raise ExpressionError("'" + self.text + "' is not a boolean expression")
+        return result
+
+
+_expressions = {}
+
+def compile_expression(text):
+    ''' parse an expression, or return the already parsed one '''
+    if text not in _expressions:
+        _expressions[text] = Expression(text)
+    return _expressions[text]
@@ -0,0 +1,102 @@
+'''
+Writes the final dataframe of a feed to all of its destinations at once, on one thread each.
+Every writer gets its own shallow copy of the dataframe: it may add new columns, but the arrays
+are shared, so it must not change values or assign to existing columns. A writer that does sets
+mutates = True on its class and is given a deep copy. The feed takes as long as its slowest
+destination instead of the sum of all of them.
+
+example config::
+"destinations": [
+    {
+        "type":"API",
+        ...
+        "timeout_seconds":600
+    },
+    {
+        "type":"CSV",
+        "filename":"domains.csv"
+    }
+]
+A destination that runs past its timeout is reported as failed, its thread is left to finish.
+'''
+
+import threading, time, traceback
+
+
+def frame_for(writer, df):
+    ''' the frame a writer is given: a deep copy if it changes values, otherwise a shallow one '''
+    if df is None:
+        return df
+    return df.copy(deep=getattr(writer, 'mutates', False))
+
+
+class DestinationWrite:
+    ''' The outcome of writing to one destination '''
+
+    def __init__(self, index, config):
+        self.index = index
+        self.config = config
+        self.result = None
+        self.error = None
+        self.seconds = None
+        self.finished = False
+        self.thread = None
+
+    def ok(self):
+        return self.finished and self.error is None and self.result is not False
+
+    def __str__(self):
+        if not self.finished:
+            status = 'timed out'
+        elif self.error is not None:
+            status = 'failed: ' + self.error
+        else:
+            status = str(self.result)
+        seconds = self.seconds if self.seconds is not None else 0
+        return '%s %d: %s (%.1fs)' % (self.config['type'], self.index, status, seconds)
+
+
+def write_one(write, writer, df):
+    start = time.time()
+    try:
+        write.result = writer.write(df)
+    except Exception, e:
+        write.error = '%s: %s' % (type(e).__name__, e)
+        traceback.print_exc()
+    write.seconds = time.time() - start
+    write.finished = True
+
+
+def write_all(destinations, df, create, timeout=None):
+    ''' Write df to every destination concurrently, returns a DestinationWrite per destination.
+    create(config) makes the writer. Destinations may set timeout_seconds, otherwise timeout applies.
+    '''
+    writes = []
+    start = time.time()
+    for i, dest in enumerate(destinations):
+        write = DestinationWrite(i, dest)
+        writes.append(write)
+        try:
+            writer = create(dest)
+        except Exception, e:
+            write.error = '%s: %s' % (type(e).__name__, e)
+            write.seconds = 0
+            write.finished = True
+            continue
+        write.thread = threading.Thread(target=write_one, args=(write, writer, frame_for(writer, df)),
+                name='write-%s-%d' % (dest['type'], i))
+        write.thread.daemon = True
+        write.thread.start()
+
+    for write in writes:
+        if write.thread is None:
+            continue
+        limit = write.config.get('timeout_seconds', timeout)
+        if limit is None:
+            write.thread.join()
+        else:
+            write.thread.join(max(0, start + limit - time.time()))
+        if not write.finished:
+            write.seconds = time.time() - start
+
+    return writes
@@ -8,13 +8,148 @@ python feed_driver.py -c config.json
 by Bereket Abraham
 '''
 
-from reader import *
+from registry import createReader, createWriter
 from processor import *
-from writer import *
-import argparse, json
+from joiner import Joiner
+from fanout import write_all
+from downcast import downcast
+from compiler import compile_feed, describe_backend, feed_partition, ConfigError
+import argparse, json, signal, sys, traceback
+
+
+def read_sources(feed, cache=None):
+    ''' read every source of a feed and combine them into a single dataframe,
+    sources with "cache_minutes" come from the cache when one is given
+    '''
+    # sources with a join section are joined onto the sources before them,
+    # the others are appended by row and must have the same headers
+    df = None
+    for source in feed['sources']:
+        read = reader(source)
+        if cache is not None:
+            df_part = cache.read(source, read)
+        else:
+            df_part = read()
+        if df is None:
+            df = df_part
+        elif 'join' in source:
+            df = Joiner(source['join']).join(df, df_part)
+        else:
+            df = df.append(df_part, ignore_index=True)
+    return df
+
+
+def reader(source):
+    ''' the read function of a source, sources with "downcast" are shrunk as they are read, see downcast.py '''
+    r = createReader(source)
+    if 'downcast' not in source:
+        return r.read
+    return lambda: downcast(r.read(), source['downcast'], describe_backend(source))
+
+
+def read_chunks(feed):
+    ''' the sources of a feed, one chunk at a time '''
+    for source in feed['sources']:
+        r = createReader(source)
+        for chunk in r.read_chunks():
+            if 'downcast' in source:
+                chunk = downcast(chunk, source['downcast'], describe_backend(source))
+            yield chunk
+
+
+def process(feed, df):
+    ''' apply the operators and selectors of a feed, in the order of its compiled plan '''
+    return compile_feed(feed).process(df)
+
+
+def write_destinations(feed, df, checkpoint=None):
+    ''' write the processed dataframe to every destination of a feed, concurrently, see fanout.py.
+    With a checkpoint, destinations that were written by an earlier run are skipped.
+    '''
+    destinations = list(enumerate(feed['destinations']))
+    if checkpoint is not None:
+        for i, dest in destinations:
+            if checkpoint.written(dest):
+                print '%s %d: already written, skipped' % (dest['type'], i)
+        destinations = [(i, dest) for i, dest in destinations if not checkpoint.written(dest)]
+
+    writes = write_all([dest for i, dest in destinations], df, createWriter, feed.get('timeout_seconds'))
+    results = [None] * len(feed['destinations'])
+    failed = []
+    for (i, dest), write in zip(destinations, writes):
+        write.index = i
+        print write
+        results[i] = write.result
+        if not write.ok():
+            failed.append(write)
+        elif checkpoint is not None:
+            checkpoint.mark_written(dest)
+    if failed:
+        raise Exception('Failed destinations: ' + ', '.join(['%s %d' % (w.config['type'], w.index) for w in failed]))
+    return results
+
+
+def run_feed(feed, cache=None, resume=False):
+    print
+    print 'Starting feed: ' + feed['name'] + ' ....'
+
+    plan = compile_feed(feed)
+    checkpoint = None
+    done = None
+    if 'checkpoint' in feed:
+        # see checkpoint.py
+        from checkpoint import Checkpoint
+        checkpoint = Checkpoint(feed, plan, resume)
+        (done, df) = checkpoint.restore()
+
+    if done is not None:
+        df = plan.process(df, start=done, checkpoint=checkpoint)
+    elif 'memory_budget_mb' in feed:
+        # out of core, see spill.py
+        from spill import process_out_of_core
+        df = process_out_of_core(plan, read_chunks(feed))
+        if checkpoint is not None:
+            checkpoint.save(len(plan.stages), df)
+    else:
+        df = read_sources(feed, cache)
+        if checkpoint is not None:
+            checkpoint.after(0, df)
+        df = plan.process(df, checkpoint=checkpoint)
+
+    sketches = getattr(df, 'sketches', None)
+    if sketches is not None:
+        # the sketch writer merges a partition into its file once, see writer.py
+        sketches.partitions = set([feed_partition(feed)])
+
+    results = write_destinations(feed, df, checkpoint)
+    if checkpoint is not None:
+        checkpoint.finish()
+    return results
+
+
+def load_feeds(config_file):
+    # configurations to handle new aggregations, thresholds, and blacklists
+    with open(config_file) as f:
+        try:
+            feeds = json.load(f)
+        except ValueError, e:
+            raise ConfigError(config_file + ': ' + str(e))
+    if not isinstance(feeds, dict) or not isinstance(feeds.get("feeds"), list):
+        raise ConfigError(config_file + ': must be an object with a "feeds" list')
+    feeds = feeds["feeds"]
+    for i, feed in enumerate(feeds):
+        if not isinstance(feed, dict):
+            raise ConfigError(config_file + ': feed ' + str(i) + ' is not an object')
+    return feeds
+
+
+def compile_feeds(feeds):
+    ''' validate every feed before any of them reads data '''
+    return [compile_feed(feed) for feed in feeds]
+
 
 if __name__ == "__main__":
-    
+
     helpdesc = '''
     Reads, processes, and writes flat data types using the FeedReader, FeedWriter, and DataProcessor classes.
     Visit their documentation for example configuration files.
@@ -24,42 +159,50 @@ if __name__ == "__main__":
     parser._optionals.title = "For help"
     required_group = parser.add_argument_group("REQUIRED")
     required_group.add_argument('-c',dest='config', type=str, help='Configuration File, in JSON')
-    #optional_group = parser.add_argument_group("OPTIONAL")
+    optional_group = parser.add_argument_group("OPTIONAL")
+    optional_group.add_argument('--explain', dest='explain', action='store_true', help='Print the plan of each feed and exit')
+    optional_group.add_argument('--daemon', dest='daemon', action='store_true', help='Keep running, run each feed on its schedule')
+    optional_group.add_argument('--resume', dest='resume', action='store_true', help='Continue feeds from their last checkpoint')
+    optional_group.add_argument('-w', dest='workers', type=int, default=4, help='Worker threads in daemon mode')
     #optional_group.add_argument('-l',dest='litem', type=int, nargs='?', default=None, help='Line item id')
 
     # Parse the arguments and store the collection in 'args'
     args = parser.parse_args()
-    config_file = args.config
 
-    # configurations to handle new aggregations, thresholds, and blacklists
-    with open(config_file) as f:
-        feeds = json.load(f)
-        feeds = feeds["feeds"]
+    try:
+        feeds = load_feeds(args.config)
+        plans = compile_feeds(feeds)
+    except ConfigError, e:
+        print 'Invalid configuration: ' + str(e)
+        sys.exit(1)
 
+    if args.explain:
+        for plan in plans:
+            print plan.explain()
+            print
+        sys.exit(0)
+
+    if args.daemon:
+        from scheduler import FeedScheduler
+        scheduler = FeedScheduler(args.config, workers=args.workers, resume=args.resume)
+        signal.signal(signal.SIGTERM, scheduler.stop)
+        signal.signal(signal.SIGINT, scheduler.stop)
+        scheduler.run_forever()
+        sys.exit(0)
+
+    # a failed feed does not stop the feeds after it, the exit status reports it
+    failed = []
     for feed in feeds:
+        try:
+            run_feed(feed, resume=args.resume)
+        except Exception:
+            print 'Feed failed: ' + feed['name']
+            traceback.print_exc()
+            failed.append(feed['name'])
+
+    if failed:
         print
-        print 'Starting feed: ' + feed['name'] + ' ....'
-
-        # combine sources, must have same headers
-        df = None
-        for source in feed['sources']:
-            r = createReader(source)
-            df_part = r.read()
-            # merge dfs!!! by row or by column??
-            # only one source for now
-            if df is not None:
-                df = df.append(df_part, ignore_index=True)
-            else:
-                df = df_part
-
-        processor = DataProcessor(feed)
-        df = processor.operate(df)
-        df = processor.select(df)
-
-        for dest in feed['destinations']:
-            w = createWriter(dest)
-            result = w.write(df)
-            print result
+        print 'Failed feeds: ' + ', '.join(failed)
+        sys.exit(1)
 
         ##
-
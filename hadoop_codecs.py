@@ -0,0 +1,305 @@
+'''
+Decompresses Hadoop part files in process, instead of spawning `lzop -dcf` or `hdfs dfs -text`
+for every part. A part is opened as a file-like stream that decompresses one block at a time as
+the csv parser reads from it, so neither the compressed nor the decompressed part is held whole.
+
+Formats, by file extension:
+.lzo        lzop container (Hadoop LzopCodec), needs the python-lzo package
+.snappy     Hadoop SnappyCodec block framing, needs the python-snappy package
+.gz         gzip (GzipCodec), zlib
+.deflate    zlib (DefaultCodec), zlib
+Uncompressed parts (part-r-00000) and the other formats are read with `hdfs dfs -text`.
+
+Implement:
+if available(path):
+    df = pd.read_csv(open_part(path), names=headers, header=None)
+'''
+
+import os, struct, subprocess, zlib, collections
+from multiprocessing.pool import ThreadPool
+
+
+READ_BYTES = 262144
+
+
+def read_exact(f, n):
+    data = f.read(n)
+    if len(data) != n:
+        raise Exception('Truncated part file: %s' % getattr(f, 'name', f))
+    return data
+
+
+class PartStream:
+    ''' File-like stream over the decompressed blocks of a part file.
+    Subclasses implement blocks(), a generator of decompressed strings.
+    '''
+
+    def __init__(self, f):
+        self.f = f
+        self.name = getattr(f, 'name', None)
+        self.pending = collections.deque()
+        self.buffered = 0
+        self.source = self.blocks()
+
+    def blocks(self):
+        raise NotImplementedError
+
+    def fill(self, size):
+        while size < 0 or self.buffered < size:
+            try:
+                block = next(self.source)
+            except StopIteration:
+                return
+            if block:
+                self.pending.append(block)
+                self.buffered += len(block)
+
+    def read(self, size=-1):
+        if size is None:
+            size = -1
+        self.fill(size)
+        if size < 0 or size >= self.buffered:
+            data = ''.join(self.pending)
+            self.pending.clear()
+        else:
+            pieces = []
+            need = size
+            while need > 0:
+                block = self.pending.popleft()
+                if len(block) > need:
+                    self.pending.appendleft(block[need:])
+                    block = block[:need]
+                pieces.append(block)
+                need -= len(block)
+            data = ''.join(pieces)
+        self.buffered -= len(data)
+        return data
+
+    def __iter__(self):
+        ''' the decompressed lines, with their newlines '''
+        tail = ''
+        while True:
+            block = self.read(READ_BYTES)
+            if not block:
+                break
+            lines = (tail + block).split('\n')
+            tail = lines.pop()
+            for line in lines:
+                yield line + '\n'
+        if tail:
+            yield tail
+
+    def close(self):
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+class ZlibStream(PartStream):
+    ''' gzip or zlib data, including files of several concatenated gzip members '''
+
+    def blocks(self):
+        d = zlib.decompressobj(47)
+        while True:
+            data = self.f.read(READ_BYTES)
+            if not data:
+                break
+            while data:
+                yield d.decompress(data)
+                data = d.unused_data
+                if data:
+                    # the next gzip member
+                    yield d.flush()
+                    d = zlib.decompressobj(47)
+        yield d.flush()
+
+
+class SnappyStream(PartStream):
+    ''' Hadoop's snappy framing: each block is the big-endian uncompressed length, followed by
+    length prefixed snappy chunks until that many bytes are produced
+    '''
+
+    def blocks(self):
+        import snappy
+        while True:
+            head = self.f.read(4)
+            if not head:
+                break
+            if len(head) != 4:
+                raise Exception('Truncated part file: %s' % self.name)
+            (expected,) = struct.unpack('>I', head)
+            produced = 0
+            while produced < expected:
+                (length,) = struct.unpack('>I', read_exact(self.f, 4))
+                block = snappy.uncompress(read_exact(self.f, length))
+                produced += len(block)
+                yield block
+
+
+LZOP_MAGIC = '\x89LZO\x00\r\n\x1a\n'
+F_ADLER32_D = 0x1
+F_ADLER32_C = 0x2
+F_H_EXTRA_FIELD = 0x40
+F_CRC32_D = 0x100
+F_CRC32_C = 0x200
+F_H_FILTER = 0x800
+
+
+class LzopStream(PartStream):
+    ''' The lzop file format, as written by lzop and Hadoop's LzopCodec '''
+
+    def header(self):
+        f = self.f
+        if read_exact(f, 9) != LZOP_MAGIC:
+            raise Exception('Not an lzop file: %s' % self.name)
+        (version, lib_version) = struct.unpack('>HH', read_exact(f, 4))
+        if version >= 0x0940:
+            read_exact(f, 2)  # version needed to extract
+        (method,) = struct.unpack('>B', read_exact(f, 1))
+        if version >= 0x0940:
+            read_exact(f, 1)  # level
+        (flags,) = struct.unpack('>I', read_exact(f, 4))
+        if flags & F_H_FILTER:
+            read_exact(f, 4)
+        read_exact(f, 8)  # mode, mtime
+        if version >= 0x0940:
+            read_exact(f, 4)  # mtime high
+        (name_length,) = struct.unpack('>B', read_exact(f, 1))
+        read_exact(f, name_length + 4)  # name, header checksum
+        if flags & F_H_EXTRA_FIELD:
+            (extra_length,) = struct.unpack('>I', read_exact(f, 4))
+            read_exact(f, extra_length + 4)
+        return flags
+
+    def blocks(self):
+        flags = self.header()
+        lzo = None
+        while True:
+            (raw_length,) = struct.unpack('>I', read_exact(self.f, 4))
+            if raw_length == 0:
+                break
+            (length,) = struct.unpack('>I', read_exact(self.f, 4))
+            checksums = []
+            if flags & F_ADLER32_D:
+                checksums.append(('adler32', struct.unpack('>I', read_exact(self.f, 4))[0]))
+            if flags & F_CRC32_D:
+                checksums.append(('crc32', struct.unpack('>I', read_exact(self.f, 4))[0]))
+            if flags & F_ADLER32_C and length < raw_length:
+                read_exact(self.f, 4)
+            if flags & F_CRC32_C and length < raw_length:
+                read_exact(self.f, 4)
+
+            data = read_exact(self.f, length)
+            if length < raw_length:
+                if lzo is None:
+                    import lzo
+                block = lzo.decompress(data, False, raw_length)
+            else:
+                # incompressible blocks are stored as is
+                block = data
+
+            for (kind, expected) in checksums:
+                if (getattr(zlib, kind)(block) & 0xffffffff) != expected:
+                    raise Exception('Corrupt block in ' + str(self.name))
+            yield block
+
+
+class ProcessStream(PartStream):
+    ''' The stdout of a decompressing command, read as it is produced '''
+
+    def __init__(self, args, path, stderr=None):
+        self.part = open(path, 'rb')
+        self.process = subprocess.Popen(args, stdin=self.part, stdout=subprocess.PIPE, stderr=stderr)
+        PartStream.__init__(self, self.process.stdout)
+        self.name = path
+
+    def blocks(self):
+        while True:
+            data = self.f.read(READ_BYTES)
+            if not data:
+                break
+            yield data
+
+    def close(self):
+        self.f.close()
+        self.process.wait()
+        self.part.close()
+
+
+# extension -> (stream class, python module it needs)
+CODECS = {
+    '.lzo': (LzopStream, 'lzo'),
+    '.snappy': (SnappyStream, 'snappy'),
+    '.gz': (ZlibStream, None),
+    '.deflate': (ZlibStream, None),
+}
+
+# command line decompressors, used when the python module of a codec is missing
+COMMANDS = {
+    '.lzo': ['lzop', '-dcf'],
+}
+
+
+def extension(path):
+    return os.path.splitext(path)[1]
+
+
+def is_part(path):
+    ''' True for the data files of an output directory, compressed or not. Other files, such as
+    the part-r-00000.lzo.index of an indexed lzo part, are left out
+    '''
+    ext = extension(path)
+    return ext in CODECS or (ext == '' and os.path.basename(path).startswith('part-'))
+
+
+def has_module(name):
+    if name is None:
+        return True
+    try:
+        __import__(name)
+        return True
+    except ImportError:
+        return False
+
+
+def available(path):
+    ''' True if the part file can be decompressed in process '''
+    ext = extension(path)
+    return ext in CODECS and has_module(CODECS[ext][1])
+
+
+def open_part(path, stderr=None):
+    ''' a file-like stream of the decompressed part '''
+    ext = extension(path)
+    if ext not in CODECS:
+        raise Exception('Unknown part file format: ' + path)
+    if available(path):
+        return CODECS[ext][0](open(path, 'rb'))
+    if ext in COMMANDS:
+        return ProcessStream(COMMANDS[ext], path, stderr)
+    raise Exception('Decompressing %s needs the %s package' % (path, CODECS[ext][1]))
+
+
+def decode_parts(paths, decode, workers=4):
+    ''' yield decode(path) for every path, in order, with up to `workers` parts decoded at once '''
+    if workers <= 1 or len(paths) <= 1:
+        for path in paths:
+            yield decode(path)
+        return
+
+    pool = ThreadPool(min(workers, len(paths)))
+    try:
+        running = collections.deque()
+        for path in paths:
+            running.append(pool.apply_async(decode, (path,)))
+            if len(running) >= workers:
+                yield running.popleft().get()
+        while running:
+            yield running.popleft().get()
+    finally:
+        pool.terminate()
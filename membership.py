@@ -0,0 +1,170 @@
+'''
+Sets of values for the "in" and "not in" selectors, such as a domain list or an allowlist.
+The set is read once per feed run, from the config, a file with one value per line, or any source
+(for example an API domain list), and indexed in a hash table. Every row of the column is then
+looked up at once, instead of row by row in python or with a merge. Values match by their text,
+so 5 from a config or a file matches 5, 5.0 and '5' in the column, with or without the Bloom filter.
+
+example config::
+"selectors": [
+    {
+        "column_name":"site_domain",
+        "comparator":"not in",
+        "value_source":{
+            "type":"API",
+            "environment":"dw-prod",
+            "service":"domain-list",
+            "filter":{
+                "id":[3911]
+            },
+            "field_name":"domains"
+        }
+    },
+    {
+        "column_name":"site_domain",
+        "comparator":"in",
+        "value_file":"allowlist.txt",
+        "bloom":{
+            "error_rate":0.001,
+            "exact":true
+        }
+    },
+    {
+        "column_name":"dv_block_reason",
+        "comparator":"in",
+        "value":[1, 2]
+    }
+]
+With "bloom", values are first checked against a Bloom filter, only the possible members are
+looked up in the set. With "exact":false only the Bloom filter is kept, a set of millions of values
+then takes a few bytes per value, and "in" keeps about error_rate of the other rows as well.
+The Bloom filter saves memory, not time: a set that fits in memory is faster without it.
+'''
+
+import math
+import pandas as pd
+import numpy as np
+from sketch import hash_values
+
+
+def canonical(values):
+    ''' the values as strings, so 5, 5.0 and '5' from a file or an object column hash the same '''
+    values = np.asarray(values)
+    if values.dtype == object and pd.api.types.infer_dtype(values, skipna=False) in ['string', 'unicode']:
+        return values
+    if values.dtype == object:
+        values = np.array([integral_float(value) for value in values], dtype=object)
+    text = pd.Series(values).astype(str).values.astype(object)
+    if values.dtype.kind == 'f':
+        # integral floats are written as the integers they equal, value by value
+        with np.errstate(invalid='ignore'):
+            integral = np.isfinite(values) & (values == np.round(values)) & (np.abs(values) < 2 ** 63)
+        if integral.any():
+            text[integral] = pd.Series(values[integral].astype(np.int64)).astype(str).values
+    return text
+
+
+def integral_float(value):
+    if isinstance(value, float) and value.is_integer() and abs(value) < 2 ** 63:
+        return int(value)
+    return value
+
+
+class BloomFilter:
+    ''' A bit array with k hashes per value, no false negatives and about error_rate false positives '''
+
+    def __init__(self, values, error_rate=0.001):
+        n = max(len(values), 1)
+        self.m = int(math.ceil(-n * math.log(error_rate) / math.log(2) ** 2))
+        self.k = max(1, int(round(float(self.m) / n * math.log(2))))
+
+        # set the bits unpacked, then keep them packed, 8 per byte
+        bits = np.zeros(self.m, dtype=np.bool_)
+        for positions in self.positions(values):
+            bits[positions] = True
+        self.bits = np.packbits(bits)
+
+    def positions(self, values):
+        hashes = hash_values(canonical(values))
+        h1 = hashes & np.uint64(0xffffffff)
+        h2 = hashes >> np.uint64(32)
+        for i in range(self.k):
+            yield ((h1 + np.uint64(i) * h2) % np.uint64(self.m)).astype(np.int64)
+
+    def contains(self, values):
+        result = np.ones(len(values), dtype=np.bool_)
+        for positions in self.positions(values):
+            # packbits puts the first bit in the high bit of each byte
+            result &= (self.bits[positions >> 3] >> (7 - (positions & 7)).astype(np.uint8)) & 1 == 1
+        return result
+
+
+class ValueSet:
+    ''' The values of a membership test, indexed for vectorized lookups.
+    Implement:
+    s = ValueSet(values)
+    mask = s.contains(df['site_domain'])
+    '''
+
+    def __init__(self, values, error_rate=None, exact=True):
+        values = pd.Series(values).dropna().unique()
+        self.size = len(values)
+        self.bloom = BloomFilter(values, error_rate) if error_rate else None
+        # exact lookups compare canonical() values like the Bloom filter, so "in [1, 2]" keeps the
+        # same rows of a text column either way. Sets of integers are also indexed as integers,
+        # integer columns are looked up there without converting them to text
+        self.values = values if exact or self.bloom is None else None
+        self.integers = values.dtype.kind in 'iu'
+        self.indexes = {}
+        if self.values is not None:
+            self.index(self.integers)
+
+    def index(self, integers):
+        if integers not in self.indexes:
+            self.indexes[integers] = pd.Index(self.values if integers else canonical(self.values))
+        return self.indexes[integers]
+
+    def lookup(self, values):
+        # the index keeps its hash table between lookups
+        if self.integers and values.dtype.kind in 'iu':
+            return self.index(True).get_indexer(values) >= 0
+        return self.index(False).get_indexer(canonical(values)) >= 0
+
+    def contains(self, column):
+        values = column.values
+        if self.bloom is None:
+            return self.lookup(values)
+        maybe = self.bloom.contains(values)
+        if self.values is None:
+            return maybe
+        result = np.zeros(len(values), dtype=np.bool_)
+        positions = np.flatnonzero(maybe)
+        result[positions] = self.lookup(values[positions])
+        return result
+
+
+def read_values(selector):
+    ''' the values of an "in" or "not in" selector '''
+    if 'value' in selector:
+        return selector['value']
+    if 'value_file' in selector:
+        # one value per line, numbers are read as numbers
+        df = pd.read_csv(selector['value_file'], header=None, names=['value'], skip_blank_lines=True)
+        return df['value'].values
+
+    from registry import createReader
+    source = selector['value_source']
+    df = createReader(source).read()
+    column = selector.get('value_column', source.get('field_name'))
+    if column is None:
+        if len(df.columns) != 1:
+            raise Exception('value_source has several columns, set value_column')
+        column = df.columns[0]
+    return df[column].values
+
+
+def value_set(selector):
+    bloom = selector.get('bloom')
+    if bloom is not None:
+        return ValueSet(read_values(selector), bloom.get('error_rate', 0.001), bloom.get('exact', True))
+    return ValueSet(read_values(selector))
@@ -0,0 +1,114 @@
+'''
+Runs the operators and selectors of a feed on row blocks of the frame, on a pool of worker processes.
+They only look at one row at a time, so each block is processed on its own and the blocks are
+concatenated in order, which gives exactly the frame of the serial run.
+
+The workers are forked after the frame is set aside, so they read it from the memory they share
+with the driver instead of receiving it pickled. Only the processed blocks are sent back, after
+the selectors these are usually a small part of the frame.
+
+example config::
+{
+    "name":"double_verify",
+    "parallel":{
+        "workers":8,
+        "block_rows":1000000
+    },
+    ...
+}
+"workers" defaults to the number of cores, "block_rows" to four blocks per worker.
+Aggregates, top_n and sketches look at every row together, and still run on the whole frame.
+Forking a thread of a threaded process can deadlock the child on a lock another thread held, so
+the pool is only used from the main thread. Feeds run by the --daemon scheduler, on its worker
+threads, process their operators and selectors serially.
+
+Implement:
+df = process_blocks(df, stages, processor, feed['parallel'])
+'''
+
+import itertools, math, multiprocessing, threading
+import pandas as pd
+
+
+ROW_STAGES = ['operate', 'select']
+
+# token -> (frame, stages, processor) of the running segments, the workers inherit these
+# when the pool forks.
+_segments = {}
+_tokens = itertools.count()
+
+
+def run_block(df, stages, processor, filtered=True):
+    ''' the operate and select stages on a block of rows. A filtered frame, or a block
+    sliced from one, is copied before an operator adds its column
+    '''
+    for stage in stages:
+        if stage.kind == 'operate':
+            if filtered:
+                df = df.copy()
+                filtered = False
+            df = processor.operate_single(df, stage.rule)
+        elif stage.kind == 'select':
+            df = processor.select_single(df, stage.rule)
+            filtered = True
+        else:
+            raise Exception('Not a row by row stage: ' + stage.kind)
+    return df
+
+
+def process_bounds(args):
+    ''' in a worker, the block of rows start:end of a segment '''
+    (token, start, end) = args
+    (df, stages, processor) = _segments[token]
+    return run_block(df.iloc[start:end], stages, processor)
+
+
+def block_bounds(rows, workers, block_rows=None):
+    if block_rows is None:
+        block_rows = int(math.ceil(rows / (4.0 * workers)))
+    return [(start, min(start + block_rows, rows)) for start in xrange(0, rows, max(block_rows, 1))]
+
+
+def concat_blocks(blocks):
+    ''' the blocks in order. Empty blocks are left out, the columns an operator adds
+    to an empty block have no dtype of their own
+    '''
+    kept = [block for block in blocks if len(block)] or blocks[:1]
+    if len(kept) == 1:
+        return kept[0]
+    return pd.concat(kept, copy=False)
+
+
+def main_thread():
+    return isinstance(threading.current_thread(), threading._MainThread)
+
+
+def process_blocks(df, stages, processor, config, filtered=False):
+    ''' run a segment of operate and select stages on row blocks of df, on a pool of processes.
+    Off the main thread the segment is run serially
+    '''
+    workers = config.get('workers') or multiprocessing.cpu_count()
+    bounds = block_bounds(len(df), workers, config.get('block_rows'))
+    if workers <= 1 or len(bounds) <= 1:
+        return run_block(df, stages, processor, filtered)
+    if not main_thread():
+        print 'Not on the main thread, operators and selectors run serially'
+        return run_block(df, stages, processor, filtered)
+
+    # value sets are read once here, not once per worker
+    for stage in stages:
+        if stage.kind == 'select' and stage.rule['comparator'] in ['in', 'not in']:
+            processor.value_set(stage.rule)
+
+    token = next(_tokens)
+    _segments[token] = (df, stages, processor)
+    try:
+        pool = multiprocessing.Pool(min(workers, len(bounds)))
+        try:
+            blocks = pool.map(process_bounds, [(token, start, end) for (start, end) in bounds], chunksize=1)
+            pool.close()
+        finally:
+            pool.terminate()
+    finally:
+        del _segments[token]
+    return concat_blocks(blocks)
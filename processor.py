@@ -1,17 +1,28 @@
 import json, datetime
 import pandas as pd
 import numpy as np
+from expression import compile_expression
+from downcast import wide, widen
 
 class DataProcessor:
     ''' Process pandas dataframe according to operator and selector rules defined in the config file
 
     example config::
+    "aggregate": {
+                "group_by":["site_domain","dv_block_reason"],
+                "function":"sum"
+            },
     "operators": [
                 {
                     "column_name_1":"Imps_blocked",
                     "column_name_2":"Imps",
                     "column_name_new":"Fraud",
                     "operation":"/"
+                },
+                {
+                    "expression":"(Imps_blocked - Clicks) / Imps * 100",
+                    "column_name_new":"BlockRate",
+                    "operation":"expression"
                 }
             ],
     "selectors": [
@@ -19,16 +30,73 @@ class DataProcessor:
                     "column_name":"dv_block_reason",
                     "comparator":"==",
                     "value":1
+                },
+                {
+                    "expression":"Imps > 5000 and Convs == 0",
+                    "comparator":"expression"
+                },
+                {
+                    "column_name":"site_domain",
+                    "comparator":"not in",
+                    "value_file":"domain_list.txt"
+                }
+            ],
+    "top_n": {
+                "column_name":"Imps",
+                "n":5000,
+                "group_by":["dv_block_reason"],
+                "ascending":false,
+                "sorted":false
+            },
+    "sketches": [
+                {
+                    "name":"domains",
+                    "type":"distinct",
+                    "column_name":"site_domain"
                 }
             ]
     '''
 
     def __init__(self, config):
         self.config = config
+        # sets of the in / not in selectors, read once per processor
+        self.value_sets = {}
+
+    def aggregate(self, df):
+        if df is None or 'aggregate' not in self.config:
+            return df
+
+        return self.aggregate_single(df, self.config['aggregate'])
+
+    def aggregate_single(self, df, rule):
+        ''' one row per group, the other columns combined with function (sum, mean, min, max, count) '''
+        keys = rule['group_by']
+        if isinstance(keys, basestring):
+            keys = [keys]
+        function = rule.get('function', 'sum')
+        # numbers read as text would be dropped by the aggregation,
+        # downcast columns are summed and averaged as 64 bit numbers, see downcast.py.
+        # min, max and count cannot overflow and keep the narrow columns
+        numeric = {}
+        for column in df.columns:
+            if column in keys:
+                continue
+            values = df[column].values
+            if values.dtype == object:
+                numeric[column] = pd.to_numeric(df[column], errors='ignore')
+            elif function in ['sum', 'mean']:
+                wide_values = widen(values)
+                if wide_values is not values:
+                    numeric[column] = wide_values
+        if numeric:
+            df = df.assign(**numeric)
+
+        grouped = df.groupby(keys, as_index=False, sort=False)
+        return grouped.agg(function)
 
     def operate(self, df):
         #headers = df.columns.values.tolist()
-        if not df or 'operators' not in self.config:
+        if df is None or 'operators' not in self.config:
             return df
 
         for operator in self.config['operators']:
@@ -37,23 +105,28 @@ class DataProcessor:
         return df
 
     def operate_single(self, df, operator):
+        if operator['operation'] == 'expression':
+            # vectorized, evaluated block by block
+            df[ operator['column_name_new'] ] = compile_expression(operator['expression']).evaluate(df)
+            return df
+
         if operator['operation'] == '+':
             def op_func(row):
-                return row[operator['column_name_1']] + row[operator['column_name_2']]
+                return wide(row[operator['column_name_1']]) + wide(row[operator['column_name_2']])
         elif operator['operation'] == '-':
             def op_func(row):
-                return row[operator['column_name_1']] - row[operator['column_name_2']]
+                return wide(row[operator['column_name_1']]) - wide(row[operator['column_name_2']])
         elif operator['operation'] == '*':
             def op_func(row):
-                return row[operator['column_name_1']] * row[operator['column_name_2']]
+                return wide(row[operator['column_name_1']]) * wide(row[operator['column_name_2']])
         elif operator['operation'] == '/':
             def op_func(row):
                 if row[operator['column_name_2']] == 0:
                     return np.nan
-                return row[operator['column_name_1']] / row[operator['column_name_2']]
+                return wide(row[operator['column_name_1']]) / wide(row[operator['column_name_2']])
         elif operator['operation'] == '(-)':
             def op_func(row):
-                return -row[operator['column_name_1']]
+                return -wide(row[operator['column_name_1']])
         elif operator['operation'] == 'str':
             def op_func(row):
                 return str(row[operator['column_name_1']])
@@ -63,6 +136,11 @@ class DataProcessor:
         else:
             raise Exception("Unknown rule")
 
+        if not len(df):
+            # apply returns a frame, not a column, on an empty frame
+            df[ operator['column_name_new']] = pd.Series(index=df.index)
+            return df
+
         df[ operator['column_name_new']] = df.apply( op_func, axis=1)
         return df
 
@@ -70,7 +148,7 @@ class DataProcessor:
     
     def select(self, df):
         #headers = df.columns.values.tolist()
-        if not df or 'selectors' not in self.config:
+        if df is None or 'selectors' not in self.config:
             return df
 
         for selector in self.config['selectors']:
@@ -95,9 +173,84 @@ class DataProcessor:
             df = df[ pd.isnull(df[ selector['column_name'] ]) ]
         elif selector['comparator'] == 'not null':
             df = df[ pd.isnull(df[ selector['column_name'] ])==False ]
+        elif selector['comparator'] == 'expression':
+            df = df[ compile_expression(selector['expression']).mask(df) ]
+        elif selector['comparator'] in ['in', 'not in']:
+            mask = self.value_set(selector).contains(df[ selector['column_name'] ])
+            if selector['comparator'] == 'not in':
+                mask = ~mask
+            df = df[mask]
         else:
             raise Exception("Unknown rule")
                 
         return df
 
 
+    def value_set(self, selector):
+        ''' the indexed values of an in / not in selector, see membership.py '''
+        from membership import value_set
+        key = json.dumps(selector, sort_keys=True)
+        if key not in self.value_sets:
+            self.value_sets[key] = value_set(selector)
+        return self.value_sets[key]
+
+    def top(self, df):
+        if df is None or 'top_n' not in self.config:
+            return df
+
+        return self.top_single(df, self.config['top_n'])
+
+    def top_positions(self, values, n, ascending, ordered):
+        ''' positions of the n smallest or largest values, found by partial selection.
+        Missing values are never selected, ties at the boundary are broken arbitrarily.
+        '''
+        values = np.asarray(values, dtype=np.float64)
+        if not ascending:
+            values = -values
+        valid = np.flatnonzero(~np.isnan(values))
+
+        if n < len(valid):
+            keep = np.argpartition(values[valid], n - 1)[:n]
+            valid = valid[keep]
+        if ordered:
+            return valid[np.argsort(values[valid], kind='mergesort')]
+        return np.sort(valid)
+
+    def top_single(self, df, rule):
+        ''' Keep the top n rows by a column, per group if group_by is given, in O(n) instead of a full sort.
+        Rows keep their original order unless sorted is set.
+        '''
+        n = int(rule['n'])
+        ascending = rule.get('ascending', False)
+        ordered = rule.get('sorted', False)
+        values = df[ rule['column_name'] ].values
+
+        if rule.get('group_by'):
+            groups = df.groupby(rule['group_by'], sort=ordered).indices
+            keys = groups.keys()
+            if ordered:
+                keys = sorted(keys)
+            positions = [idx[ self.top_positions(values[idx], n, ascending, ordered) ] for idx in (groups[key] for key in keys)]
+            if positions:
+                positions = np.concatenate(positions)
+            else:
+                positions = np.array([], dtype=np.int64)
+            if not ordered:
+                positions = np.sort(positions)
+        else:
+            positions = self.top_positions(values, n, ascending, ordered)
+
+        return df.iloc[positions]
+
+    def sketch(self, df):
+        if df is None or 'sketches' not in self.config:
+            return df
+
+        return self.sketch_single(df, self.config['sketches'])
+
+    def sketch_single(self, df, rules):
+        ''' Approximate distinct counts and heavy hitters in one pass, see sketch.py.
+        Returns the summary of the sketches, which keeps the sketches themselves for merging.
+        '''
+        from sketch import SketchSet
+        return SketchSet(rules).update(df).summary()
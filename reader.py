@@ -1,24 +1,16 @@
-import subprocess, json, datetime, glob, os
+import subprocess, json, datetime, glob, os, shutil, tempfile
 import pandas as pd
 import numpy as np
-from AnxPy import Console
-from AnxPy.environ import DW_PROD, DW_CTEST, DW_SAND
-from anxapi import *
-from link import lnk
 from abc import ABCMeta, abstractmethod
+import connections
+import hadoop_codecs
+# AnxPy, anxapi and link are imported by the readers that use them
 
 
 def createReader(config):
-    if config['type'] == 'hdfs':
-        return HadoopFeedReader(config)
-    elif config['type'] == 'API':
-        return ApiReader(config)
-    elif config['type'] == 'database':
-        return DatabaseReader(config)
-    elif config['type'] == 'CSV':
-        return CsvReader(config)
-    else:
-        raise Exception('FeedReader not found')
+    ''' create the reader registered for config['type'], see registry.py '''
+    from registry import readers
+    return readers.create(config)
 
 
 class FeedReader:
@@ -26,6 +18,7 @@ class FeedReader:
     Implement:
     r = createReader(config)
     dataframe = r.read()
+    for dataframe in r.read_chunks(): ...
     '''
     __metaclass__ = ABCMeta
 
@@ -39,6 +32,10 @@ class FeedReader:
     def read(self):
         pass
 
+    def read_chunks(self):
+        ''' yield the data in pieces, readers that can stream override this '''
+        yield self.read()
+
     def get_config(self):
         return self.config
 
@@ -62,6 +59,8 @@ class HadoopFeedReader(FeedReader):
     '''
     def __init__(self, config):
         self.config = config
+        # a work directory of its own, feeds run concurrently by the scheduler read at the same time
+        self.tmp = None
 
     def day_calc(self, n_days):
         ''' get date (n day ago from now, in UTC) '''
@@ -69,14 +68,17 @@ class HadoopFeedReader(FeedReader):
         d = datetime.datetime.utcnow() - datetime.timedelta(days=n_days)
         return d.strftime("%Y/%m/%d")
 
+    def makeTmp(self):
+        ''' create the work directory of this read '''
+        if self.tmp is None:
+            self.tmp = tempfile.mkdtemp(prefix='rpw_hdfs_')
+        return self.tmp
+
     def deleteTmp(self):
-        ''' remove previous files from tmp/ if it exists '''
-        if os.path.exists('tmp/'):
-            filelist = glob.glob("tmp/*")
-            for f in filelist:
-                os.remove(f)
-        else:
-            os.makedirs('tmp/')
+        ''' remove the work directory and its files '''
+        if self.tmp is not None:
+            shutil.rmtree(self.tmp, ignore_errors=True)
+            self.tmp = None
 
     def getHDFS(self):
         ''' Connect to HDFS and get all of the compressed part files '''
@@ -89,7 +91,7 @@ class HadoopFeedReader(FeedReader):
 
         loc = self.config['location']
 
-        cmd1 = "hdfs dfs -get " + loc + daystr + "/* tmp/"
+        cmd1 = "hdfs dfs -get " + loc + daystr + "/* " + self.makeTmp() + "/"
         args1 = cmd1.split()
         p1 = subprocess.Popen(args1, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
         (stdout, stderr) = p1.communicate()
@@ -98,36 +100,30 @@ class HadoopFeedReader(FeedReader):
 
     def decompressLZO(self):
         ''' find all file parts, decompress .lzo files '''
-        with open("tmp/.pig_header", "r") as h:
+        with open(os.path.join(self.makeTmp(), ".pig_header"), "r") as h:
             headers = h.read()
             headers = headers[:-1]
             headers = headers.split(",")
 
+        # parts are decompressed in process as they are read, see hadoop_codecs.py
+        def rows(filepart):
+            with hadoop_codecs.open_part(filepart, stderr=err) as part:
+                return [line.rstrip("\n")[:-1].split(",") for line in part if line != "\n"]
+
         data = []
-        filelist = glob.glob("tmp/*.lzo")
+        filelist = sorted(glob.glob(os.path.join(self.tmp, "*.lzo")))
         with open("error.log", "ab") as err:
             err.write(self.day_calc( self.config['filter']['days_ago'] ) + ":")
-            for filepart in filelist:
-                cmd2 = "/usr/bin/lzop -dcf"
-                args2 = cmd2.split()
-                
-                with open(filepart, "rb") as part:
-                    p2 = subprocess.Popen(args2, stdin=part, stdout=subprocess.PIPE, stderr=err)
-                    (stdout, stderr) = p2.communicate()
-                    segment = stdout.split("\n")
-                    for row in segment:
-                        row = row[:-1]
-                        row = row.split(",")
-                        data.append(row)
-                    del segment, stdout
+            for part_rows in hadoop_codecs.decode_parts(filelist, rows, self.config.get('decode_workers', 4)):
+                data.extend(part_rows)
 
         print "headers: " + str(headers)
 
         df = pd.DataFrame(data, columns=headers)
         return df
 
-    def textHDFS(self):
-        ''' Connect to HDFS and process all of the snappy part files '''
+    def listHDFS(self):
+        ''' Connect to HDFS, returns the headers and the part files of the partition '''
         # hdfs dfs -ls /dv/domain_hourly_blocks/2014/06/05/
         # hdfs dfs -text /dv/domain_hourly_blocks/2014/06/05/part-r-00000.snappy
 
@@ -143,10 +139,10 @@ class HadoopFeedReader(FeedReader):
         (stdout, stderr) = p1.communicate()
         print stderr
 
-        # get snappy files
+        # get part files
         data_files = stdout.replace('\n',' ')
         data_files = data_files.split()
-        data_files = [f for f in data_files if '.snappy' in f]
+        data_files = [f for f in data_files if hadoop_codecs.is_part(f)]
         # sort by part number
         data_files.sort()
 
@@ -155,47 +151,99 @@ class HadoopFeedReader(FeedReader):
         p2 = subprocess.Popen( cmd2.split(), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
         (headers, stderr) = p2.communicate()
         print stderr
-        # create empty DataFrame
         headers = headers.replace('\n','')
         #headers = headers + ','
         headers = headers.split(',')
+        return (headers, data_files)
+
+    def textPartHDFS(self, data_file, headers):
+        ''' Read one part file with hdfs dfs -text, returns None if it cannot be read '''
+        cmd3 = "hdfs dfs -text " + data_file
+        # forced to use temp csv file in orderto get nice unit conversion
+        temp_csv = os.path.join(self.makeTmp(), os.path.basename(data_file) + '.csv')
+        try:
+            temp_file = open(temp_csv,'w')
+            p3 = subprocess.Popen( cmd3.split(), stdout=temp_file, stderr=subprocess.PIPE)
+            (s, stderr) = p3.communicate()
+            print stderr
+            temp_file.close()
+        except Exception, e:
+            print "Skipping: " + data_file
+            print str(e)
+            # logger.exception
+            return None
+
+        # convert string to list of lists
+        #data_part = [row.split(',') for row in stdout.split('\n') if row]
+        # convert list of lists (with headers) to a list of dictionaries
+        #df = [ {data_part[0][i]:row[i] for i in range(len(row))} for row in data_part[1:] ]
+        #df = pd.DataFrame(df)
+        # Pretty harsh unit conversion, watch for columns with all NaN
+        #df = df.convert_objects(convert_numeric=True)
+
+        try:
+            return pd.read_csv(temp_csv, index_col=False, names=headers, header=None)
+        finally:
+            os.remove(temp_csv)
+
+    def readPart(self, data_file, local_file, headers):
+        ''' Read one part file, from its local copy when it can be decompressed in process '''
+        if local_file is None or not os.path.exists(local_file):
+            return self.textPartHDFS(data_file, headers)
+        try:
+            with hadoop_codecs.open_part(local_file) as part:
+                return pd.read_csv(part, index_col=False, names=headers, header=None)
+        except Exception, e:
+            # hdfs decompresses with the codecs of the cluster, a part it cannot read raises there
+            print "Decompressing %s failed, reading it with hdfs dfs -text: %s" % (data_file, e)
+            return self.textPartHDFS(data_file, headers)
+
+    def parts(self, headers, data_files):
+        ''' Yield the dataframe of every part file, in order.
+        When every part can be decompressed in process, the partition is copied once with
+        `hdfs dfs -get` and the parts are decompressed on a thread pool, otherwise each
+        part is printed with `hdfs dfs -text`, one at a time.
+        '''
+        local_files = [None] * len(data_files)
+        workers = 1
+        if data_files and all(hadoop_codecs.available(f) for f in data_files):
+            self.getHDFS()
+            local_files = [os.path.join(self.tmp, os.path.basename(f)) for f in data_files]
+            workers = self.config.get('decode_workers', 4)
+
+        def read_part(i):
+            return self.readPart(data_files[i], local_files[i], headers)
+
+        for df in hadoop_codecs.decode_parts(range(len(data_files)), read_part, workers):
+            if df is not None:
+                yield df
+
+    def textHDFS(self):
+        ''' Connect to HDFS and process all of the part files '''
+        (headers, data_files) = self.listHDFS()
+        # create empty DataFrame
         data_df = pd.DataFrame(columns=headers)
 
-        # retreive data
-        for data_file in data_files:
-            cmd3 = "hdfs dfs -text " + data_file
-            # forced to use temp csv file in orderto get nice unit conversion
-            try:
-                temp_file = open('temp.csv','w')
-                p3 = subprocess.Popen( cmd3.split(), stdout=temp_file, stderr=subprocess.PIPE)
-                (s, stderr) = p3.communicate()
-                print stderr
-                temp_file.close()
-            except Exception, e:
-                print "Skipping: " + data_file
-                print str(e)
-                # logger.exception
-                continue
-
-            # convert string to list of lists
-            #data_part = [row.split(',') for row in stdout.split('\n') if row]
-            # convert list of lists (with headers) to a list of dictionaries
-            #df = [ {data_part[0][i]:row[i] for i in range(len(row))} for row in data_part[1:] ]
-            #df = pd.DataFrame(df)
-            # Pretty harsh unit conversion, watch for columns with all NaN
-            #df = df.convert_objects(convert_numeric=True)
-
-            # read and append csv
-            df = pd.read_csv('temp.csv', index_col=False, names=headers, header=None)            
-            data_df = data_df.append(df, ignore_index=True)
-
-        return data_df
+        # retreive data, appended at once instead of one part at a time
+        frames = [data_df] + list(self.parts(headers, data_files))
+        return pd.concat(frames, ignore_index=True)
 
     def read(self):
-        # read in .snappy files
-        df = self.textHDFS()
+        # read in the compressed part files
+        try:
+            df = self.textHDFS()
+        finally:
+            self.deleteTmp()
         return df
 
+    def read_chunks(self):
+        ''' one dataframe per part file '''
+        try:
+            for df in self.parts(*self.listHDFS()):
+                yield df
+        finally:
+            self.deleteTmp()
+
 
 
 class ApiReader(FeedReader):
@@ -217,21 +265,8 @@ class ApiReader(FeedReader):
     '''
     def __init__(self, config):
         self.config = config
-
-        if self.config['environment'] in ['prod', 'dw-prod']:
-            self.base = 'dw-prod'
-            self.console = Console(DW_PROD)
-        elif self.config['environment'] in ['sand', 'dw-sand']:
-            self.base = 'dw-sand'
-            self.console = Console(DW_SAND)
-        elif self.config['environment'] in ['ctest', 'dw-ctest']:
-            self.base = 'dw-ctest'
-            self.console = Console(DW_CTEST)
-        elif self.config['environment'] in ['api-prod', 'api-sand', 'api-ctest']:
-            self.base = self.config['environment']
-            self.console = None
-        else:
-            raise Exception('Environment not found')
+        # consoles are logged in once per thread, see connections.py
+        (self.base, self.console) = connections.api_console(self.config['environment'])
 
     def querystr(self):
         ''' convert filter into query string params
@@ -254,12 +289,13 @@ class ApiReader(FeedReader):
             # convert dashs to camelcase
             service = ''.join( [word[0].upper() + word[1:] for word in service.split('-')] )
             # same as: service = console.DomainList
-            service = getattr(console, service)
+            service = getattr(self.console, service)
             api_collection = service.get(filter=self.config['filter'])
             api_objects = api_collection.get_all()
             api_objects = [ api_object.data for api_object in api_objects ]
 
         else:
+            from anxapi import anx_get, anx_get_all
             response = anx_get(self.base, self.querystr())
 
             if 'error' in response or 'error_code' in response:
@@ -325,7 +361,7 @@ class DatabaseReader(FeedReader):
         self.config = config
 
     def read(self):
-        db = getattr(lnk.dbs, self.config['db'])
+        db = connections.database(self.config['db'])
         df = db.select_dataframe(self.config['query'])
         return df
 
@@ -343,8 +379,34 @@ class CsvReader(FeedReader):
         self.config = config
 
     def read(self):
-        db = pd.read_csv( self.config['filename'], index_col=False )
+        df = pd.read_csv( self.config['filename'], index_col=False )
         return df
 
+    def read_chunks(self):
+        for df in pd.read_csv( self.config['filename'], index_col=False, chunksize=self.config.get('chunk_rows', 1000000) ):
+            yield df
+
 
+class SketchReader(FeedReader):
+    '''
+    Read in sketches saved by the sketch writer, merged into one summary (dataframe).
+    The filename may be a pattern, to merge the sketches of several days.
+
+    example config::
+    {
+        "type":"sketch",
+        "filename":"sketches/domains-*.sketch"
+    }
+    '''
+    def __init__(self, config):
+        self.config = config
 
+    def read(self):
+        from sketch import SketchSet
+        filenames = sorted(glob.glob(self.config['filename']))
+        if not filenames:
+            raise Exception('No sketches found: ' + self.config['filename'])
+        sketches = SketchSet.load(filenames[0])
+        for filename in filenames[1:]:
+            sketches.merge(SketchSet.load(filename))
+        return sketches.summary()
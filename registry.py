@@ -0,0 +1,134 @@
+'''
+Registry of FeedReader and FeedWriter backends. A backend is only imported when a feed uses it,
+so a feed that reads CSV and writes to stdout never loads the API or database libraries.
+
+Implement:
+r = createReader(config)
+w = createWriter(config)
+readers.get('hdfs').supports('streaming')
+
+Third party backends register through setuptools entry points::
+    entry_points={
+        'rpw.readers': ['s3 = rpw_s3.reader:S3Reader'],
+        'rpw.writers': ['s3 = rpw_s3.writer:S3Writer'],
+    }
+Their classes may declare `required` config keys and a `capabilities` dict.
+'''
+
+import importlib
+
+
+# streaming: can hand over the data in chunks
+# pushdown: can apply filters at the source
+# append: adds to the destination instead of replacing it, destinations ask for it with
+#   "append" (or "merge" for sketches)
+CAPABILITIES = ['streaming', 'pushdown', 'append']
+
+
+class Backend:
+    ''' A reader or writer class, imported on first use '''
+
+    def __init__(self, name, target, required=None, **capabilities):
+        self.name = name
+        self.target = target
+        self.required = required or []
+        self.capabilities = capabilities
+        self.cls = None
+
+    def load(self):
+        if self.cls is None:
+            module, attr = self.target.split(':')
+            self.cls = getattr(importlib.import_module(module), attr)
+        return self.cls
+
+    def supports(self, capability):
+        return self.capabilities.get(capability, False)
+
+
+class EntryPointBackend(Backend):
+    ''' A backend registered by another package, its class declares the keys and capabilities '''
+
+    def __init__(self, entry_point):
+        Backend.__init__(self, entry_point.name, str(entry_point).split('=', 1)[1].strip())
+        self.entry_point = entry_point
+
+    def load(self):
+        if self.cls is None:
+            self.cls = self.entry_point.load()
+            self.required = list(getattr(self.cls, 'required', []))
+            self.capabilities = dict(getattr(self.cls, 'capabilities', {}))
+        return self.cls
+
+
+class Registry:
+    ''' Backends by config type, for one kind of class (FeedReader or FeedWriter) '''
+
+    def __init__(self, kind, group):
+        self.kind = kind
+        self.group = group
+        self.backends = {}
+        self.scanned = False
+
+    def register(self, name, target, required=None, **capabilities):
+        unknown = [c for c in capabilities if c not in CAPABILITIES]
+        if unknown:
+            raise Exception('Unknown capabilities: ' + ', '.join(unknown))
+        self.backends[name] = Backend(name, target, required, **capabilities)
+
+    def load_entry_points(self):
+        ''' scan installed packages once, only when a type is not registered here '''
+        if self.scanned:
+            return
+        self.scanned = True
+        try:
+            import pkg_resources
+        except ImportError:
+            return
+        for entry_point in pkg_resources.iter_entry_points(self.group):
+            if entry_point.name not in self.backends:
+                self.backends[entry_point.name] = EntryPointBackend(entry_point)
+
+    def has(self, name):
+        if name not in self.backends:
+            self.load_entry_points()
+        return name in self.backends
+
+    def get(self, name):
+        if not self.has(name):
+            raise Exception(self.kind + ' not found')
+        return self.backends[name]
+
+    def required(self, name):
+        ''' config keys the backend needs '''
+        backend = self.get(name)
+        if isinstance(backend, EntryPointBackend):
+            backend.load()
+        return backend.required
+
+    def create(self, config):
+        return self.get(config['type']).load()(config)
+
+
+readers = Registry('FeedReader', 'rpw.readers')
+readers.register('hdfs', 'reader:HadoopFeedReader', ['location', 'filter'], streaming=True)
+readers.register('API', 'reader:ApiReader', ['environment', 'service', 'filter', 'field_name'])
+readers.register('database', 'reader:DatabaseReader', ['db', 'query'])
+readers.register('CSV', 'reader:CsvReader', ['filename'], streaming=True)
+readers.register('sketch', 'reader:SketchReader', ['filename'])
+
+writers = Registry('FeedWriter', 'rpw.writers')
+writers.register('API', 'writer:ApiWriter', ['environment', 'service', 'filter', 'column_name', 'field_name', 'field_type', 'action'])
+writers.register('database', 'writer:DatabaseWriter', ['db', 'table'], append=True)
+writers.register('CSV', 'writer:CsvWriter', ['filename'], append=True)
+writers.register('stdout', 'writer:StdoutWriter', [])
+writers.register('mail', 'writer:MailWriter', ['filename', 'recipients', 'sender', 'subject', 'body'])
+writers.register('chart', 'writer:ChartWriter', ['filename', 'x_column_name', 'y_column_name'])
+writers.register('sketch', 'writer:SketchWriter', ['filename'], append=True)
+
+
+def createReader(config):
+    return readers.create(config)
+
+
+def createWriter(config):
+    return writers.create(config)
@@ -0,0 +1,200 @@
+'''
+Runs feeds on their own schedules in one long running process, instead of one cron job per run.
+The config is loaded once and reloaded when the file changes, API consoles and database
+connections stay logged in on the worker threads, and a feed never overlaps with itself.
+
+Execution:
+python feed_driver.py -c config.json --daemon
+
+example config::
+{
+    "name":"double_verify",
+    "schedule":{
+        "every_minutes":60
+    },
+    "sources": [
+        {
+            "type":"API",
+            "environment":"dw-prod",
+            "service":"domain-list",
+            "filter":{
+                "id":[3911]
+            },
+            "field_name":"domains",
+            "cache_minutes":30
+        }
+    ],
+    ...
+}
+Sources with "cache_minutes" are read once and reused by later runs until the cache expires.
+'''
+
+import hashlib, json, os, threading, time, Queue, traceback
+import connections
+
+
+def feed_key(config):
+    return hashlib.md5(json.dumps(config, sort_keys=True)).hexdigest()
+
+
+def copy(df):
+    return df.copy() if df is not None else df
+
+
+class SourceCache:
+    ''' Dataframes of slowly changing sources (domain lists, dimension tables), kept between runs '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.frames = {}
+
+    def read(self, source, read):
+        ''' return a copy of the cached frame of a source, or call read() and cache its result.
+        Every run gets its own copy, operators add and overwrite columns in place.
+        '''
+        if 'cache_minutes' not in source:
+            return read()
+
+        key = feed_key(source)
+        with self.lock:
+            if key in self.frames and self.frames[key][0] > time.time():
+                return copy(self.frames[key][1])
+
+        df = read()
+        with self.lock:
+            self.frames[key] = (time.time() + 60 * source['cache_minutes'], df)
+        return copy(df)
+
+    def clear(self):
+        with self.lock:
+            self.frames = {}
+
+
+class Job:
+    ''' A scheduled feed '''
+
+    def __init__(self, feed, now):
+        self.feed = feed
+        self.name = feed['name']
+        self.key = feed_key(feed)
+        self.interval = 60 * feed['schedule']['every_minutes']
+        self.next_run = now
+
+
+class FeedScheduler:
+    ''' Run every feed with a "schedule" section on a pool of worker threads '''
+
+    def __init__(self, config_file, workers=4, poll_seconds=1, resume=False):
+        self.config_file = config_file
+        self.workers = workers
+        self.resume = resume
+        self.poll_seconds = poll_seconds
+        self.jobs = {}
+        self.running = set()
+        self.mtime = None
+        self.lock = threading.Lock()
+        self.queue = Queue.Queue()
+        self.cache = SourceCache()
+        self.stopped = threading.Event()
+
+    def load(self):
+        ''' (re)load the config, an invalid config keeps the current jobs '''
+        from feed_driver import load_feeds, compile_feeds
+        from compiler import ConfigError
+
+        self.mtime = os.path.getmtime(self.config_file)
+        try:
+            feeds = load_feeds(self.config_file)
+            compile_feeds(feeds)
+        except (ConfigError, IOError), e:
+            print 'Invalid configuration, keeping the current feeds: ' + str(e)
+            return False
+        except Exception, e:
+            # a config the compiler does not catch must not stop the feeds that are running
+            print 'Invalid configuration, keeping the current feeds: %s: %s' % (type(e).__name__, e)
+            traceback.print_exc()
+            return False
+
+        now = time.time()
+        jobs = {}
+        with self.lock:
+            for feed in feeds:
+                if 'schedule' not in feed:
+                    print 'Not scheduled: ' + feed['name']
+                    continue
+                job = Job(feed, now)
+                old = self.jobs.get(job.name)
+                if old is not None and old.key == job.key:
+                    # unchanged feeds keep their place in the schedule
+                    job = old
+                elif old is not None:
+                    job.next_run = old.next_run
+                jobs[job.name] = job
+            self.jobs = jobs
+        print 'Loaded %d scheduled feeds from %s' % (len(jobs), self.config_file)
+        return True
+
+    def reload_if_changed(self):
+        try:
+            mtime = os.path.getmtime(self.config_file)
+        except OSError:
+            return False
+        if mtime != self.mtime:
+            return self.load()
+        return False
+
+    def due(self, now):
+        ''' jobs to start now, a job that is still running skips its turn '''
+        ready = []
+        with self.lock:
+            for job in self.jobs.values():
+                if job.next_run > now:
+                    continue
+                job.next_run = now + job.interval
+                if job.name in self.running:
+                    print 'Still running, skipping this run: ' + job.name
+                    continue
+                self.running.add(job.name)
+                ready.append(job)
+        return ready
+
+    def run_job(self, job):
+        from feed_driver import run_feed
+        start = time.time()
+        try:
+            run_feed(job.feed, cache=self.cache, resume=self.resume)
+            print 'Finished feed: %s (%.1fs)' % (job.name, time.time() - start)
+        except Exception:
+            print 'Failed feed: ' + job.name
+            traceback.print_exc()
+            connections.reset()
+        finally:
+            with self.lock:
+                self.running.discard(job.name)
+
+    def worker(self):
+        while not self.stopped.is_set():
+            try:
+                job = self.queue.get(timeout=self.poll_seconds)
+            except Queue.Empty:
+                continue
+            self.run_job(job)
+
+    def stop(self, *args):
+        self.stopped.set()
+
+    def run_forever(self):
+        self.load()
+        threads = [threading.Thread(target=self.worker, name='feed-worker-%d' % i) for i in range(self.workers)]
+        for t in threads:
+            t.daemon = True
+            t.start()
+
+        while not self.stopped.is_set():
+            self.reload_if_changed()
+            for job in self.due(time.time()):
+                self.queue.put(job)
+            self.stopped.wait(self.poll_seconds)
+
+        for t in threads:
+            t.join()
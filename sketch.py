@@ -0,0 +1,301 @@
+'''
+Approximate answers in one pass and bounded memory, instead of exact group-bys over a whole partition.
+HyperLogLog counts distinct values, Count-Min and Space-Saving find the heavy hitters of a column.
+Every sketch can be merged with another of the same kind and settings, across the chunks of a
+partition and across days, and saved to a file to be merged into later.
+
+example config::
+"selectors": [ ... ],
+"sketches": [
+    {
+        "name":"domains",
+        "type":"distinct",
+        "column_name":"site_domain",
+        "precision":14
+    },
+    {
+        "name":"blocked_domains",
+        "type":"heavy_hitters",
+        "column_name":"site_domain",
+        "weight":"Imps_blocked",
+        "k":100,
+        "width":4096,
+        "depth":5
+    }
+]
+The sketches run on the selected rows. The feed then outputs one row per estimate, with the columns
+sketch, type, key, estimate and error: the distinct count with its standard error, or each heavy
+hitter with the most its count may be overestimated by.
+'''
+
+import cPickle, math, os
+import pandas as pd
+import numpy as np
+from downcast import widen
+
+
+SUMMARY_COLUMNS = ['sketch', 'type', 'key', 'estimate', 'error']
+
+# rows Space-Saving counts exactly at a time, before it keeps only the k heaviest again
+BLOCK_ROWS = 65536
+
+
+def hash_values(values):
+    ''' a 64 bit hash of every value, the same in every process and on every day,
+    and whether or not the column was downcast
+    '''
+    return pd.util.hash_pandas_object(pd.Series(widen(np.asarray(values))), index=False).values
+
+
+def bit_length(values):
+    ''' the number of significant bits of each uint64 '''
+    high = (values >> np.uint64(32)).astype(np.float64)
+    low = (values & np.uint64(0xffffffff)).astype(np.float64)
+    # 32 bit values are exact as doubles, frexp gives their bit length
+    return np.where(high > 0, 32 + np.frexp(high)[1], np.frexp(low)[1])
+
+
+class HyperLogLog:
+    ''' Distinct count with a standard error of 1.04 / sqrt(2 ** precision), in 2 ** precision bytes '''
+
+    def __init__(self, precision=14):
+        if not 4 <= precision <= 18:
+            raise Exception('HyperLogLog precision must be between 4 and 18')
+        self.p = precision
+        self.m = 1 << precision
+        self.registers = np.zeros(self.m, dtype=np.uint8)
+
+    def update(self, values):
+        hashes = hash_values(values)
+        if not len(hashes):
+            return
+        index = (hashes >> np.uint64(64 - self.p)).astype(np.int64)
+        rest = hashes & np.uint64((1 << (64 - self.p)) - 1)
+        # position of the first 1 bit in the remaining 64 - p bits
+        rank = (64 - self.p) - bit_length(rest) + 1
+        top = pd.Series(rank).groupby(index).max()
+        self.registers[top.index.values] = np.maximum(self.registers[top.index.values], top.values.astype(np.uint8))
+
+    def merge(self, other):
+        if self.p != other.p:
+            raise Exception('Cannot merge HyperLogLogs of different precision')
+        self.registers = np.maximum(self.registers, other.registers)
+        return self
+
+    def estimate(self):
+        alpha = 0.7213 / (1 + 1.079 / self.m)
+        raw = alpha * self.m ** 2 / np.sum(np.power(2.0, -self.registers.astype(np.float64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if zeros:
+            # linear counting, the raw estimate is biased up to a few times m
+            linear = self.m * math.log(float(self.m) / zeros)
+            if linear <= 3 * self.m:
+                return linear
+        return raw
+
+    def error(self):
+        return 1.04 / math.sqrt(self.m)
+
+
+class CountMin:
+    ''' Weighted counts of any value, overestimated by at most e / width of the total weight
+    with probability 1 - exp(-depth)
+    '''
+
+    def __init__(self, width=4096, depth=5):
+        self.width = width
+        self.depth = depth
+        self.table = np.zeros((depth, width), dtype=np.float64)
+        self.total = 0.0
+
+    def columns(self, hashes):
+        ''' the column of each hash in every row, by double hashing '''
+        h1 = hashes & np.uint64(0xffffffff)
+        h2 = hashes >> np.uint64(32)
+        return [((h1 + np.uint64(i) * h2) % np.uint64(self.width)).astype(np.int64) for i in range(self.depth)]
+
+    def update(self, values, weights=None):
+        hashes = hash_values(values)
+        if weights is None:
+            weights = np.ones(len(hashes))
+        weights = np.asarray(weights, dtype=np.float64)
+        for i, columns in enumerate(self.columns(hashes)):
+            self.table[i] += np.bincount(columns, weights=weights, minlength=self.width)
+        self.total += weights.sum()
+
+    def query(self, values):
+        hashes = hash_values(values)
+        if not len(hashes):
+            return np.zeros(0)
+        return np.min([self.table[i][columns] for i, columns in enumerate(self.columns(hashes))], axis=0)
+
+    def merge(self, other):
+        if (self.width, self.depth) != (other.width, other.depth):
+            raise Exception('Cannot merge Count-Min sketches of different sizes')
+        self.table += other.table
+        self.total += other.total
+        return self
+
+    def error(self):
+        return math.e / self.width * self.total
+
+
+class SpaceSaving:
+    ''' The k heaviest values, each with an upper bound of its count and how much it may be over.
+    A value that is not kept has a count of at most floor. Rows are counted exactly in blocks of
+    BLOCK_ROWS, each block is merged in and trimmed back to k values, so memory is bounded by k
+    and the block size whatever the size of the chunk.
+    '''
+
+    def __init__(self, k=100):
+        self.k = k
+        self.counts = pd.Series([], dtype=np.float64)
+        self.errors = pd.Series([], dtype=np.float64)
+        self.floor = 0.0
+
+    def update(self, values, weights=None):
+        values = np.asarray(values)
+        if weights is None:
+            weights = np.ones(len(values))
+        weights = np.asarray(weights, dtype=np.float64)
+        for start in xrange(0, len(values), BLOCK_ROWS):
+            counts = pd.Series(weights[start:start + BLOCK_ROWS]).groupby(values[start:start + BLOCK_ROWS]).sum()
+            block = SpaceSaving(self.k)
+            block.counts = counts
+            block.errors = pd.Series(0.0, index=counts.index)
+            self.merge(block.trim())
+
+    def trim(self):
+        ''' keep the k heaviest values, the dropped ones raise the floor '''
+        if len(self.counts) > self.k:
+            order = np.argsort(-self.counts.values, kind='mergesort')
+            self.floor = max(self.floor, float(self.counts.values[order[self.k]]))
+            keep = self.counts.index[order[:self.k]]
+            self.counts = self.counts.loc[keep]
+            self.errors = self.errors.loc[keep]
+        return self
+
+    def merge(self, other):
+        if self.k != other.k:
+            raise Exception('Cannot merge Space-Saving sketches of different k')
+        index = self.counts.index.union(other.counts.index)
+        # a value missing from one side may have had up to that side's floor there
+        self.counts = self.counts.reindex(index).fillna(self.floor) + other.counts.reindex(index).fillna(other.floor)
+        self.errors = self.errors.reindex(index).fillna(self.floor) + other.errors.reindex(index).fillna(other.floor)
+        self.floor = self.floor + other.floor
+        return self.trim()
+
+    def top(self):
+        order = np.argsort(-self.counts.values, kind='mergesort')
+        return (self.counts.iloc[order], self.errors.iloc[order])
+
+
+class Sketch:
+    ''' One configured sketch of a column '''
+
+    def __init__(self, rule):
+        self.rule = rule
+        self.name = rule['name']
+        self.type = rule['type']
+        if self.type == 'distinct':
+            self.hll = HyperLogLog(rule.get('precision', 14))
+        elif self.type == 'heavy_hitters':
+            self.cm = CountMin(rule.get('width', 4096), rule.get('depth', 5))
+            self.ss = SpaceSaving(rule.get('k', 100))
+        else:
+            raise Exception('Unknown sketch type: ' + str(self.type))
+
+    def update(self, df):
+        column = df[ self.rule['column_name'] ]
+        if column.isnull().any():
+            df = df[ column.notnull() ]
+        values = df[ self.rule['column_name'] ].values
+        if self.type == 'distinct':
+            self.hll.update(values)
+        else:
+            weights = df[ self.rule['weight'] ].values if 'weight' in self.rule else None
+            self.cm.update(values, weights)
+            self.ss.update(values, weights)
+
+    def merge(self, other):
+        if self.type != other.type or self.rule['column_name'] != other.rule['column_name']:
+            raise Exception('Cannot merge sketch %s into %s' % (other.name, self.name))
+        if self.type == 'distinct':
+            self.hll.merge(other.hll)
+        else:
+            self.cm.merge(other.cm)
+            self.ss.merge(other.ss)
+        return self
+
+    def summary(self):
+        if self.type == 'distinct':
+            return [[self.name, self.type, self.rule['column_name'], self.hll.estimate(), self.hll.error()]]
+        (counts, errors) = self.ss.top()
+        # both sketches overestimate, the smaller count is the closer one
+        estimates = np.minimum(counts.values, self.cm.query(counts.index.values)) if len(counts) else counts.values
+        return [[self.name, self.type, key, estimate, error] for key, estimate, error in
+                zip(counts.index, estimates, np.minimum(errors.values, self.cm.error()))]
+
+
+class SketchSet:
+    ''' The sketches of a feed, by name, and the partitions they count '''
+
+    def __init__(self, rules=None):
+        self.sketches = [Sketch(rule) for rule in (rules or [])]
+        self.partitions = set()
+
+    def update(self, df):
+        for sketch in self.sketches:
+            sketch.update(df)
+        return self
+
+    def merge(self, other):
+        ''' merge sketches by name, sketches only in other are added '''
+        mine = dict((sketch.name, sketch) for sketch in self.sketches)
+        for sketch in other.sketches:
+            if sketch.name in mine:
+                mine[sketch.name].merge(sketch)
+            else:
+                self.sketches.append(sketch)
+        self.partitions |= other.partitions
+        return self
+
+    def summary(self):
+        rows = []
+        for sketch in self.sketches:
+            rows.extend(sketch.summary())
+        df = SketchFrame(rows, columns=SUMMARY_COLUMNS)
+        df.sketches = self
+        return df
+
+    def save(self, filename):
+        ''' written to a temp file and renamed, a failed write keeps the previous sketches '''
+        temp = filename + '.tmp'
+        with open(temp, 'wb') as f:
+            cPickle.dump(self, f, cPickle.HIGHEST_PROTOCOL)
+        os.rename(temp, filename)
+
+    @staticmethod
+    def load(filename):
+        with open(filename, 'rb') as f:
+            return cPickle.load(f)
+
+
+class SketchFrame(pd.DataFrame):
+    ''' The summary of a SketchSet, which it keeps as df.sketches for the sketch writer '''
+    _metadata = ['sketches']
+
+    @property
+    def _constructor(self):
+        return SketchFrame
+
+
+def sketch_frames(frames):
+    ''' merge the sketches of the summaries of several chunks into one summary '''
+    sketches = None
+    for df in frames:
+        if sketches is None:
+            sketches = df.sketches
+        else:
+            sketches.merge(df.sketches)
+    return sketches.summary()
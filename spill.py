@@ -0,0 +1,187 @@
+'''
+Out of core execution of a feed, for partitions that do not fit in memory.
+The sources are read in chunks, and a feed with an aggregate is hash partitioned on its group keys
+into spill files on local disk, so each partition can be aggregated on its own.
+Feeds without an aggregate only have row by row stages, their chunks are processed as they arrive.
+
+example config::
+{
+    "name":"double_verify",
+    "memory_budget_mb":2048,
+    "spill_partitions":64,
+    "spill_directory":"/tmp",
+    "aggregate":{
+        "group_by":["site_domain","dv_block_reason"]
+    },
+    ...
+}
+'''
+
+import cPickle, os, shutil, tempfile
+import pandas as pd
+import numpy as np
+from joiner import frame_bytes, mb
+from processor import DataProcessor
+from membership import canonical
+
+
+def key_hashes(df, keys):
+    ''' a hash of the keys of every row, equal for equal keys whatever the dtypes of the chunk:
+    a chunk with a missing key reads an integer column as float64, its 1.0 goes with the 1 of
+    the other chunks. Numbers are hashed as float64, other values by canonical() text
+    '''
+    columns = {}
+    for i, key in enumerate(keys):
+        values = df[key].values
+        if values.dtype.kind in 'biuf':
+            columns[i] = values.astype(np.float64)
+        else:
+            columns[i] = canonical(values)
+    return pd.util.hash_pandas_object(pd.DataFrame(columns, columns=range(len(keys))), index=False).values
+
+
+class SpillPartitioner:
+    ''' Hash partition rows on key columns into spill files, keeping at most half of the budget
+    buffered in memory.
+    '''
+
+    def __init__(self, budget_bytes, keys, partitions=64, directory=None):
+        self.budget = budget_bytes
+        self.keys = keys
+        self.n = partitions
+        self.directory = tempfile.mkdtemp(prefix='rpw_spill_', dir=directory)
+        self.buffers = [[] for p in range(partitions)]
+        self.buffered = [0] * partitions
+        self.sizes = [0] * partitions
+        self.spilled = 0
+
+    def path(self, p):
+        return os.path.join(self.directory, 'part-%05d.pkl' % p)
+
+    def add(self, df):
+        if not len(df):
+            return
+        row_bytes = frame_bytes(df) / float(len(df))
+
+        codes = (key_hashes(df, self.keys) % np.uint64(self.n)).astype(np.int64)
+        groups = pd.Series(np.arange(len(df))).groupby(codes).indices
+        pieces = [(p, df.iloc[idx]) for p, idx in groups.items()]
+
+        for p, piece in pieces:
+            size = int(row_bytes * len(piece))
+            self.buffers[p].append(piece)
+            self.buffered[p] += size
+            self.sizes[p] += size
+
+        while sum(self.buffered) > self.budget / 2:
+            self.spill(self.buffered.index(max(self.buffered)))
+
+    def spill(self, p):
+        with open(self.path(p), 'ab') as f:
+            for piece in self.buffers[p]:
+                cPickle.dump(piece, f, cPickle.HIGHEST_PROTOCOL)
+        self.spilled += self.buffered[p]
+        self.buffers[p] = []
+        self.buffered[p] = 0
+
+    def load(self, p):
+        pieces = []
+        if os.path.exists(self.path(p)):
+            with open(self.path(p), 'rb') as f:
+                while True:
+                    try:
+                        pieces.append(cPickle.load(f))
+                    except EOFError:
+                        break
+            os.remove(self.path(p))
+        pieces.extend(self.buffers[p])
+        self.buffers[p] = []
+        self.buffered[p] = 0
+        return pieces
+
+    def partitions(self):
+        ''' yield each non empty partition as one dataframe '''
+        for p in range(self.n):
+            pieces = self.load(p)
+            if not pieces:
+                continue
+            if self.sizes[p] > self.budget:
+                print 'Partition %d is %s, over the memory budget of %s' % (p, mb(self.sizes[p]), mb(self.budget))
+            yield pd.concat(pieces, ignore_index=True)
+
+    def close(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def slices(df, budget_bytes):
+    ''' split a chunk that is larger than a quarter of the budget '''
+    size = frame_bytes(df)
+    if size <= budget_bytes / 4 or len(df) < 2:
+        yield df
+        return
+    rows = max(1, int(len(df) * (budget_bytes / 4.0) / size))
+    for start in xrange(0, len(df), rows):
+        yield df.iloc[start:start + rows]
+
+
+def process_out_of_core(plan, chunks):
+    ''' Run the stages of a compiled plan over an iterator of chunks within the feed's memory budget.
+    The per partition results are merged at the end, and top_n is applied again to the merged rows.
+    Sketches are updated chunk by chunk and merged.
+    '''
+    feed = plan.feed
+    budget = int(feed['memory_budget_mb'] * 1048576)
+    results = []
+    # one processor for every chunk, it keeps the value sets of in / not in selectors
+    processor = DataProcessor(feed)
+    # the columns of the chunks, for the result of a feed that keeps no rows
+    empty = None
+
+    if 'aggregate' in feed:
+        keys = feed['aggregate']['group_by']
+        if isinstance(keys, basestring):
+            keys = [keys]
+        partitioner = SpillPartitioner(budget, keys, feed.get('spill_partitions', 64), feed.get('spill_directory'))
+        # selectors on the group keys run before the aggregate, they also shrink what is spilled
+        before = []
+        for stage in plan.stages:
+            if stage.kind != 'select':
+                break
+            before.append(stage.rule)
+        try:
+            for chunk in chunks:
+                if empty is None:
+                    empty = chunk.iloc[:0]
+                for rule in before:
+                    chunk = processor.select_single(chunk, rule)
+                partitioner.add(chunk)
+            print 'Spilled %s to %s' % (mb(partitioner.spilled), partitioner.directory)
+            for part in partitioner.partitions():
+                results.append(plan.process(part, processor))
+        finally:
+            partitioner.close()
+    else:
+        for chunk in chunks:
+            if empty is None:
+                empty = chunk.iloc[:0]
+            for piece in slices(chunk, budget):
+                results.append(plan.process(piece, processor))
+
+    if not results:
+        # every row was filtered out, or there were no chunks
+        if empty is None:
+            return pd.DataFrame()
+        results = [plan.process(empty.copy(), processor)]
+    if 'sketches' in feed:
+        # one summary per chunk or partition, their sketches are merged
+        from sketch import sketch_frames
+        return sketch_frames(results)
+    # empty partitions would change the dtypes of computed columns
+    results = [r for r in results if len(r)] or results[:1]
+    df = pd.concat(results, ignore_index=True)
+    if 'top_n' in feed:
+        df = DataProcessor(feed).top_single(df, feed['top_n']).reset_index(drop=True)
+
+    if frame_bytes(df) > budget:
+        print 'Result is %s, over the memory budget of %s' % (mb(frame_bytes(df)), mb(budget))
+    return df
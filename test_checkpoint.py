@@ -0,0 +1,68 @@
+'''
+Checkpoints are resumed on the day they were saved, and not on another.
+
+python -m unittest test_checkpoint
+'''
+
+import datetime, shutil, tempfile, unittest
+import pandas as pd
+from checkpoint import Checkpoint
+from compiler import compile_feed, source_partition
+
+
+DAY = datetime.datetime(2014, 6, 5, 12)
+NEXT_DAY = DAY + datetime.timedelta(days=1)
+
+
+class CheckpointTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='rpw_checkpoint_')
+        self.feed = {
+            "name":"checkpointed",
+            "sources":[{"type":"CSV", "filename":"domains.csv"}],
+            "destinations":[{"type":"stdout"}],
+            "selectors":[{"column_name":"Imps", "comparator":">", "value":1}],
+            "checkpoint":{"directory":self.directory},
+        }
+        self.plan = compile_feed(self.feed)
+        self.df = pd.DataFrame({'Imps': [1, 2, 3]})
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def save(self, now):
+        checkpoint = Checkpoint(self.feed, self.plan, now=now)
+        checkpoint.after(0, self.df)
+        checkpoint.mark_written(self.feed['destinations'][0])
+        return checkpoint
+
+    def test_resume_on_the_same_day(self):
+        self.save(DAY)
+        checkpoint = Checkpoint(self.feed, self.plan, resume=True, now=DAY + datetime.timedelta(hours=6))
+        (done, df) = checkpoint.restore()
+        self.assertEqual(done, 0)
+        self.assertTrue(df.equals(self.df))
+        self.assertTrue(checkpoint.written(self.feed['destinations'][0]))
+
+    def test_not_resumed_on_another_day(self):
+        self.save(DAY)
+        checkpoint = Checkpoint(self.feed, self.plan, resume=True, now=NEXT_DAY)
+        self.assertEqual(checkpoint.restore(), (None, None))
+        self.assertFalse(checkpoint.written(self.feed['destinations'][0]))
+
+    def test_not_resumed_without_resume(self):
+        self.save(DAY)
+        checkpoint = Checkpoint(self.feed, self.plan, now=DAY)
+        self.assertEqual(checkpoint.restore(), (None, None))
+
+    def test_source_partition(self):
+        hdfs = {"type":"hdfs", "location":"/dv/domain_hourly_blocks/", "filter":{"days_ago":2}}
+        self.assertEqual(source_partition(hdfs, DAY), 'hdfs /dv/domain_hourly_blocks/ 2014/06/03')
+        hdfs['filter'] = {}
+        self.assertEqual(source_partition(hdfs, DAY), 'hdfs /dv/domain_hourly_blocks/ 2014/06/04')
+        self.assertEqual(source_partition(self.feed['sources'][0], DAY), 'CSV domains.csv 2014/06/05')
+
+
+if __name__ == '__main__':
+    unittest.main()
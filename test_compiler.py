@@ -0,0 +1,132 @@
+'''
+The order the compiler gives the stages of a feed, the rows they keep, and its --explain output.
+
+python -m unittest test_compiler
+'''
+
+import unittest
+from benchmark import benchmark_feed, generate_blocks, offline_feed
+from compiler import compile_feed, ConfigError
+from processor import DataProcessor
+
+
+OPERATORS = [
+    {"column_name_1":"Imps_blocked", "column_name_2":"Imps", "column_name_new":"Fraud", "operation":"/"},
+    {"expression":"Clicks + Convs", "column_name_new":"Actions", "operation":"expression"},
+]
+
+SELECTORS = [
+    {"column_name":"Fraud", "comparator":"<", "value":0.5},
+    {"column_name":"Imps", "comparator":">", "value":300},
+    {"column_name":"site_domain", "comparator":"not in", "value":["site0.example.com"]},
+    {"expression":"Actions > 0", "comparator":"expression"},
+    {"column_name":"dv_block_reason", "comparator":"in", "value":[1, 2]},
+]
+
+AGGREGATE = {"group_by":["site_domain", "dv_block_reason"], "function":"sum"}
+
+
+def order(plan):
+    return [(stage.kind, stage.describe(), stage.pushdown) for stage in plan.stages]
+
+
+class PushdownTest(unittest.TestCase):
+
+    def test_selectors_on_source_columns_run_first(self):
+        plan = compile_feed(offline_feed(operators=OPERATORS, selectors=SELECTORS))
+        self.assertEqual(order(plan), [
+            ('select', 'Imps > 300', True),
+            ('select', 'site_domain not in ["site0.example.com"]', True),
+            ('select', 'dv_block_reason in [1, 2]', True),
+            ('operate', 'Fraud = Imps_blocked / Imps', False),
+            ('operate', 'Actions = Clicks + Convs', False),
+            ('select', 'Fraud < 0.5', False),
+            ('select', 'Actions > 0', False),
+        ])
+
+    def test_selectors_on_group_keys_run_before_the_aggregate(self):
+        plan = compile_feed(offline_feed(operators=OPERATORS, selectors=SELECTORS, aggregate=AGGREGATE))
+        self.assertEqual([kind for (kind, describe, pushdown) in order(plan)],
+                         ['select', 'select', 'aggregate', 'select', 'operate', 'operate', 'select', 'select'])
+        self.assertEqual([describe for (kind, describe, pushdown) in order(plan)[:2]],
+                         ['site_domain not in ["site0.example.com"]', 'dv_block_reason in [1, 2]'])
+        # a selector on the sums runs after the aggregate
+        self.assertEqual(order(plan)[3], ('select', 'Imps > 300', True))
+
+    def test_without_operators_nothing_is_pushed_down(self):
+        plan = compile_feed(offline_feed(operators=[], selectors=SELECTORS[1:3]))
+        self.assertEqual([pushdown for (kind, describe, pushdown) in order(plan)], [False, False])
+
+    def test_pushdown_keeps_the_rows_of_the_config_order(self):
+        df = generate_blocks(20000, 300)
+        for sections in [{}, {'aggregate':AGGREGATE}]:
+            feed = offline_feed(operators=OPERATORS, selectors=SELECTORS, **sections)
+            result = compile_feed(feed).process(df.copy())
+            # the stages in the order of the config
+            processor = DataProcessor(feed)
+            expected = processor.aggregate_single(df.copy(), AGGREGATE) if sections else df.copy()
+            for operator in OPERATORS:
+                expected = processor.operate_single(expected, operator)
+            for selector in SELECTORS:
+                expected = processor.select_single(expected, selector)
+            self.assertGreater(len(expected), 0)
+            if sections:
+                # the groups are numbered after the selectors that ran before the aggregate
+                (result, expected) = (result.reset_index(drop=True), expected.reset_index(drop=True))
+            self.assertTrue(result.equals(expected))
+
+
+class ExplainTest(unittest.TestCase):
+
+    def feed(self, **sections):
+        config = benchmark_feed()
+        config['sources'][0]['estimated_rows'] = 90000
+        config.update(sections)
+        return config
+
+    def test_stages_and_estimated_rows(self):
+        lines = compile_feed(self.feed()).explain().split('\n')
+        self.assertEqual(lines, [
+            'Feed: benchmark',
+            '  stage     est. rows  detail',
+            '  read      90000      hdfs /dv/domain_hourly_blocks/  [streaming]',
+            '  select    9000       dv_block_reason == 1  [pushed down]',
+            '  select    3000       Imps > 5000  [pushed down]',
+            '  select    300        Convs == 0  [pushed down]',
+            '  operate   300        Fraud = Imps_blocked / Imps',
+            '  write     300        CSV benchmark_output.csv  [append]',
+            '  write     300        stdout',
+        ])
+
+    def test_modes(self):
+        explain = compile_feed(self.feed(aggregate=AGGREGATE, memory_budget_mb=64, checkpoint={"directory":"cp"},
+                parallel={"workers":3, "block_rows":1000}, top_n={"column_name":"Imps", "n":10})).explain()
+        lines = explain.split('\n')
+        self.assertEqual(lines[1:4], [
+            '  out of core within 64 MB, spilled by site_domain, dv_block_reason',
+            '  checkpoints in cp',
+            '  operators and selectors on 3 worker processes in blocks of 1000 rows',
+        ])
+        self.assertIn('  aggregate 9000       sum by site_domain, dv_block_reason', lines)
+        self.assertIn('  top_n     10         top 10 by Imps', lines)
+
+    def test_unknown_rows(self):
+        explain = compile_feed(offline_feed()).explain()
+        self.assertIn('  read      ?          CSV unused.csv  [streaming]', explain.split('\n'))
+
+
+class ValidationTest(unittest.TestCase):
+
+    def test_unknown_columns_fail_before_reading(self):
+        for sections in [{'selectors':[{"column_name":"Impz", "comparator":">", "value":1}]},
+                         {'operators':[{"column_name_1":"Imps", "column_name_2":"Clickz", "column_name_new":"x", "operation":"+"}]},
+                         {'aggregate':{"group_by":["site"], "function":"sum"}},
+                         {'top_n':{"column_name":"Fraud2", "n":5}}]:
+            self.assertRaises(ConfigError, compile_feed, dict(benchmark_feed(), **sections))
+
+    def test_columns_made_by_operators(self):
+        compile_feed(dict(benchmark_feed(), operators=OPERATORS, selectors=SELECTORS))
+
+
+if __name__ == '__main__':
+    unittest.main()
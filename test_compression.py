@@ -0,0 +1,63 @@
+'''
+Parts written by compression.py: a csv that fits in one part keeps its name, and a rerun leaves
+no parts of the earlier run behind.
+
+python -m unittest test_compression
+'''
+
+import gzip, os, shutil, tempfile, unittest
+import pandas as pd
+from benchmark import generate_blocks
+from compression import write_csv
+
+
+class PartsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='rpw_compression_')
+        self.filename = os.path.join(self.directory, 'domains.csv')
+        self.df = generate_blocks(20000, 500)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def files(self):
+        return sorted(name for name in os.listdir(self.directory) if not name.startswith('.'))
+
+    def rows(self, paths):
+        return sum(len(pd.read_csv(gzip.open(path))) for path in paths)
+
+    def test_one_part_keeps_the_name(self):
+        paths = write_csv(self.df, self.filename, 'gzip', chunk_rows=5000, max_part_bytes=10 ** 9)
+        self.assertEqual(paths, [self.filename + '.gz'])
+        self.assertEqual(self.rows(paths), len(self.df))
+
+    def test_rerun_removes_stale_parts(self):
+        paths = write_csv(self.df, self.filename, 'gzip', chunk_rows=1000, max_part_bytes=100000)
+        self.assertGreater(len(paths), 3)
+        self.assertEqual(self.files(), sorted(os.path.basename(path) for path in paths))
+        self.assertEqual(self.rows(paths), len(self.df))
+
+        # fewer rows, fewer parts
+        smaller = self.df.iloc[:5000]
+        paths = write_csv(smaller, self.filename, 'gzip', chunk_rows=1000, max_part_bytes=100000)
+        self.assertEqual(self.files(), sorted(os.path.basename(path) for path in paths))
+        self.assertEqual(self.rows(paths), len(smaller))
+
+        # one part replaces the parts, and parts replace the whole file
+        paths = write_csv(smaller, self.filename, 'gzip')
+        self.assertEqual(self.files(), ['domains.csv.gz'])
+        paths = write_csv(self.df, self.filename, 'gzip', chunk_rows=1000, max_part_bytes=100000)
+        self.assertEqual(self.files(), sorted(os.path.basename(path) for path in paths))
+        self.assertNotIn('domains.csv.gz', self.files())
+
+    def test_other_files_are_kept(self):
+        for name in ['domains-0001.csv.gz', 'domains-00000.csv', 'sites-00000.csv.gz', 'domains.csv']:
+            open(os.path.join(self.directory, name), 'w').close()
+        write_csv(self.df, self.filename, 'gzip')
+        self.assertEqual(self.files(), ['domains-00000.csv', 'domains-0001.csv.gz', 'domains.csv',
+                                        'domains.csv.gz', 'sites-00000.csv.gz'])
+
+
+if __name__ == '__main__':
+    unittest.main()
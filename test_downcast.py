@@ -0,0 +1,136 @@
+'''
+Downcast columns keep the values they were read with, and sums, means and operators on them
+give the results of the 64 bit columns.
+
+python -m unittest test_downcast
+'''
+
+import unittest
+import numpy as np
+import pandas as pd
+from benchmark import generate_blocks
+from downcast import downcast, shrink, wide, widen
+from processor import DataProcessor
+
+
+class ShrinkTest(unittest.TestCase):
+
+    def assertShrinks(self, values, dtype, expected=None):
+        result = shrink(np.array(values, dtype=object) if isinstance(values, list) else values)
+        self.assertEqual(result.dtype, np.dtype(dtype))
+        if expected is not None:
+            self.assertEqual(list(result), expected)
+
+    def test_integers(self):
+        self.assertShrinks(np.array([0, 127, -128]), np.int8)
+        self.assertShrinks(np.array([0, 128]), np.int16)
+        self.assertShrinks(np.array([0, 2 ** 31 - 1]), np.int32)
+        self.assertShrinks(np.array([0, 2 ** 31]), np.int64)
+        self.assertShrinks(np.array([5], dtype=np.uint64), np.int8)
+
+    def test_floats(self):
+        self.assertShrinks(np.array([0.5, 1.25, np.nan]), np.float32)
+        self.assertShrinks(np.array([0.1, 1.25]), np.float64)
+        self.assertEqual(shrink(np.array([0.1]), float32=True).dtype, np.float32)
+
+    def test_text(self):
+        self.assertShrinks(['1', '22', '-3'], np.int8, [1, 22, -3])
+        self.assertShrinks(['1.5', '2'], np.float32, [1.5, 2.0])
+        self.assertShrinks(['0.1', '2'], np.float64, [0.1, 2.0])
+        self.assertShrinks(['9007199254740993', '1'], np.int64, [9007199254740993, 1])
+        # ids with a leading zero, and text that is not a number, stay text
+        self.assertShrinks(['007', '12'], object, ['007', '12'])
+        self.assertShrinks(['a.com', '12'], object)
+        self.assertShrinks(['0', '0.5'], np.float32, [0.0, 0.5])
+
+    def test_text_with_missing_values(self):
+        result = shrink(np.array(['1', None, '3'], dtype=object))
+        self.assertEqual(result.dtype.kind, 'f')
+        self.assertEqual(list(result[[0, 2]]), [1.0, 3.0])
+        self.assertTrue(np.isnan(result[1]))
+
+
+class DowncastTest(unittest.TestCase):
+
+    def setUp(self):
+        self.df = generate_blocks(20000, 300, seed=5)
+        self.df['MediaCost'] = np.round(self.df['MediaCost'] * 4) / 4
+
+    def test_values_are_kept(self):
+        result = downcast(self.df)
+        self.assertEqual(list(result.columns), list(self.df.columns))
+        self.assertTrue(result.index.equals(self.df.index))
+        self.assertEqual(result['dv_block_reason'].dtype, np.int8)
+        self.assertEqual(result['MediaCost'].dtype, np.float32)
+        for column in self.df.columns:
+            self.assertTrue((result[column].values == self.df[column].values).all(), column)
+
+    def test_exclude_and_float32(self):
+        df = self.df.assign(Rate=self.df['Imps'] / 7.0)
+        result = downcast(df, {"exclude":["Imps"], "float32":["Rate"]})
+        self.assertEqual(result['Imps'].dtype, np.int64)
+        self.assertEqual(result['Rate'].dtype, np.float32)
+        self.assertEqual(downcast(df)['Rate'].dtype, np.float64)
+
+    def test_wide(self):
+        self.assertEqual(widen(np.array([1], dtype=np.int8)).dtype, np.int64)
+        self.assertEqual(widen(np.array([1], dtype=np.float32)).dtype, np.float64)
+        values = np.array(['a'], dtype=object)
+        self.assertTrue(widen(values) is values)
+        self.assertEqual(type(wide(np.int8(100)) + wide(np.int8(100))), np.int64)
+        self.assertEqual(wide(np.int8(100)) + wide(np.int8(100)), 200)
+
+
+class WidenTest(unittest.TestCase):
+    ''' aggregates and operators on downcast columns '''
+
+    def setUp(self):
+        # every group sums past the range of int8 and int16, the means are not float32 exact
+        rs = np.random.RandomState(6)
+        self.df = pd.DataFrame({
+            'g': rs.randint(0, 5, 50000),
+            'small': rs.randint(100, 127, 50000),
+            'count': rs.randint(30000, 32000, 50000),
+            'cost': rs.randint(0, 1000, 50000) / 4.0,
+        })
+        self.narrow = downcast(self.df)
+        self.assertEqual([self.narrow[c].dtype for c in ['small', 'count', 'cost']],
+                         [np.int8, np.int16, np.float32])
+        self.processor = DataProcessor({})
+
+    def aggregate(self, df, function):
+        return self.processor.aggregate_single(df, {"group_by":["g"], "function":function}).sort_values('g')
+
+    def test_sums_and_means_are_computed_wide(self):
+        for function in ['sum', 'mean']:
+            expected = self.aggregate(self.df, function)
+            result = self.aggregate(self.narrow, function)
+            for column in ['small', 'count', 'cost']:
+                self.assertEqual(result[column].dtype.itemsize, 8, (function, column))
+                self.assertTrue(np.allclose(result[column].values, expected[column].values, rtol=1e-12),
+                                (function, column))
+        self.assertGreater(self.aggregate(self.narrow, 'sum')['small'].min(), 2 ** 15)
+
+    def test_min_max_count_stay_narrow(self):
+        for function in ['min', 'max']:
+            result = self.aggregate(self.narrow, function)
+            self.assertEqual(result['small'].dtype, np.int8)
+            self.assertTrue((result['small'].values == self.aggregate(self.df, function)['small'].values).all())
+        result = self.aggregate(self.narrow, 'count')
+        self.assertEqual(result['small'].sum(), len(self.df))
+
+    def test_operators(self):
+        df = self.narrow.iloc[:200].copy()
+        for (operation, expected) in [('+', df['small'].astype(np.int64) + df['count']),
+                                      ('*', df['small'].astype(np.int64) * df['count']),
+                                      ('-', df['small'].astype(np.int64) - df['count'])]:
+            operator = {"column_name_1":"small", "column_name_2":"count", "column_name_new":"x", "operation":operation}
+            result = self.processor.operate_single(df.copy(), operator)
+            self.assertEqual(list(result['x']), list(expected), operation)
+        operator = {"expression":"small * count", "column_name_new":"x", "operation":"expression"}
+        result = self.processor.operate_single(df.copy(), operator)
+        self.assertEqual(list(result['x']), list(df['small'].astype(np.int64) * df['count']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+'''
+The points each downsample method keeps, at the edges of its buckets and of the series.
+
+python -m unittest test_downsample
+'''
+
+import unittest
+import numpy as np
+from downsample import downsample, lttb, minmax, aggregate
+
+
+def series(size, seed=0):
+    rs = np.random.RandomState(seed)
+    return (np.arange(size, dtype=np.float64), rs.normal(size=size).cumsum())
+
+
+class LttbTest(unittest.TestCase):
+
+    def test_one_point_per_bucket(self):
+        for (size, n) in [(1000, 100), (101, 100), (10, 3), (7, 6), (100000, 2000)]:
+            (x, y) = series(size)
+            positions = lttb(x, y, n)
+            self.assertEqual(len(positions), n)
+            self.assertEqual((positions[0], positions[-1]), (0, size - 1))
+            # the buckets split 1 .. size - 2 in order, one point is taken from each
+            edges = np.linspace(1, size - 1, n - 1).astype(np.int64)
+            for i in range(n - 2):
+                self.assertTrue(edges[i] <= positions[i + 1] < edges[i + 1], (size, n, i))
+
+    def test_small_n(self):
+        (x, y) = series(50)
+        self.assertEqual(list(lttb(x, y, 2)), [0, 49])
+        self.assertEqual(list(lttb(x, y, 1)), [0])
+        self.assertEqual(list(lttb(x, y, 0)), [])
+        self.assertEqual(list(lttb(x, y, 50)), range(50))
+        self.assertEqual(list(lttb(x, y, 80)), range(50))
+
+    def test_keeps_a_spike(self):
+        (x, y) = (np.arange(10000, dtype=np.float64), np.zeros(10000))
+        y[4321] = 100
+        positions = lttb(x, y, 50)
+        self.assertIn(4321, positions)
+
+
+class MinMaxTest(unittest.TestCase):
+
+    def test_lowest_and_highest_of_every_bucket(self):
+        for (size, n) in [(1000, 100), (1001, 99), (10, 4), (10, 5)]:
+            (x, y) = series(size, seed=1)
+            positions = minmax(x, y, n)
+            self.assertLessEqual(len(positions), n)
+            self.assertEqual(list(positions), sorted(set(positions)))
+            self.assertEqual((positions[0], positions[-1]), (0, size - 1))
+            buckets = n // 2 - 1
+            edges = np.linspace(0, size, buckets + 1).astype(np.int64)
+            for start, end in zip(edges[:-1], edges[1:]):
+                self.assertIn(start + np.argmin(y[start:end]), positions)
+                self.assertIn(start + np.argmax(y[start:end]), positions)
+
+    def test_spikes_at_the_ends(self):
+        y = np.zeros(1000)
+        y[0] = -5
+        y[999] = 5
+        y[500] = 7
+        positions = minmax(np.arange(1000.0), y, 20)
+        for position in [0, 500, 999]:
+            self.assertIn(position, positions)
+
+    def test_small_n(self):
+        (x, y) = series(10)
+        self.assertEqual(list(minmax(x, y, 10)), range(10))
+        self.assertEqual(list(minmax(x, y, 3)), [0, 9])
+        self.assertEqual(list(minmax(x, y, 2)), [0, 9])
+        self.assertEqual(list(minmax(x, y, 1)), [0])
+
+
+class AggregateTest(unittest.TestCase):
+
+    def test_bucket_edges(self):
+        x = np.array([0.0, 1, 2, 3, 4])
+        # the last value falls in the last bucket, not one past it
+        (bx, by) = aggregate(x, np.ones(5), 2, 'count')
+        self.assertEqual(list(by), [2, 3])
+        self.assertEqual(list(bx), [0.5, 3.0])
+        (bx, by) = aggregate(x, x * 10, 4, 'sum')
+        self.assertEqual(list(by), [0, 10, 20, 70])
+
+    def test_equal_x_is_one_bucket(self):
+        (bx, by) = aggregate(np.array([3.0, 3.0, 3.0]), np.array([1.0, 2.0, 6.0]), 5, 'mean')
+        self.assertEqual((list(bx), list(by)), ([3.0], [3.0]))
+
+    def test_empty_buckets_are_left_out(self):
+        x = np.array([0.0, 0.1, 9.9, 10.0])
+        (bx, by) = aggregate(x, np.ones(4), 10, 'count')
+        self.assertEqual(list(by), [2, 2])
+
+    def test_counts_add_up(self):
+        (x, y) = series(12345)
+        for n in [1, 7, 100, 20000]:
+            (bx, by) = aggregate(x, y, n, 'count')
+            self.assertLessEqual(len(by), n)
+            self.assertEqual(by.sum(), len(x))
+            self.assertEqual(list(bx), sorted(bx))
+
+
+class DownsampleTest(unittest.TestCase):
+
+    def test_missing_and_unsorted_points(self):
+        x = np.array([5.0, np.nan, 1.0, 3.0, 2.0, 4.0])
+        y = np.array([50.0, 0.0, 10.0, np.nan, 20.0, 40.0])
+        for method in ['lttb', 'minmax', 'mean']:
+            (dx, dy) = downsample(x, y, 100, method)
+            self.assertEqual(list(dx), [1.0, 2.0, 4.0, 5.0])
+            self.assertEqual(list(dy), [10.0, 20.0, 40.0, 50.0])
+
+    def test_at_most_n_points(self):
+        (x, y) = series(50000, seed=3)
+        for method in ['lttb', 'minmax', 'mean', 'max']:
+            (dx, dy) = downsample(x, y, 500, method)
+            self.assertLessEqual(len(dx), 500)
+            self.assertEqual(len(dx), len(dy))
+            self.assertEqual((dx[0] <= 250, dx[-1] >= 49750), (True, True))
+            for n in [1, 2, 3]:
+                self.assertLessEqual(len(downsample(x, y, n, method)[0]), n)
+
+    def test_text_numbers_and_unknown_method(self):
+        (dx, dy) = downsample(['1', '2', '3'], ['4', '5', '6'], 10)
+        self.assertEqual(list(dy), [4.0, 5.0, 6.0])
+        self.assertRaises(Exception, downsample, [1, 2], [1, 2], 10, 'median')
+
+
+if __name__ == '__main__':
+    unittest.main()
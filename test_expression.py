@@ -0,0 +1,101 @@
+'''
+Compiled expressions give the values of the same arithmetic in pandas, with numexpr and without,
+in one block or many.
+
+python -m unittest test_expression
+'''
+
+import unittest
+import numpy as np
+import pandas as pd
+import expression
+from expression import Expression, ExpressionError
+from benchmark import generate_blocks
+
+
+ARITHMETIC = [
+    ("(Imps_blocked - Clicks) / Imps * 100", lambda df: (df.Imps_blocked - df.Clicks) / df.Imps.replace(0, np.nan) * 100),
+    ("Clicks + Convs * 2 - 1", lambda df: df.Clicks + df.Convs * 2 - 1),
+    ("-MediaCost ** 2 % 7", lambda df: -df.MediaCost ** 2 % 7),
+    ("Convs / (Clicks - Clicks)", lambda df: df.Convs * np.nan),
+]
+
+BOOLEAN = [
+    ("Imps > 300 and Convs == 0", lambda df: (df.Imps > 300) & (df.Convs == 0)),
+    ("not (dv_block_reason == 3) or Clicks >= 5", lambda df: (df.dv_block_reason != 3) | (df.Clicks >= 5)),
+    ("1 < dv_block_reason <= 3", lambda df: (df.dv_block_reason > 1) & (df.dv_block_reason <= 3)),
+    ("Imps_blocked / Imps < 0.5", lambda df: df.Imps_blocked / df.Imps.replace(0, np.nan) < 0.5),
+]
+
+
+class ExpressionTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.df = generate_blocks(5000, 100, seed=2)
+        cls.df.loc[::50, 'Imps'] = 0
+
+    def setUp(self):
+        self.numexpr = expression.numexpr
+
+    def tearDown(self):
+        expression.numexpr = self.numexpr
+
+    def paths(self):
+        ''' evaluate with numexpr where it is installed, and with numpy in one block and in many '''
+        runs = [lambda e, df: e.evaluate(df)]
+        if self.numexpr is not None:
+            def numpy_path(e, df, block_rows):
+                expression.numexpr = None
+                try:
+                    return e.evaluate(df, block_rows)
+                finally:
+                    expression.numexpr = self.numexpr
+            runs += [lambda e, df: numpy_path(e, df, expression.BLOCK_ROWS), lambda e, df: numpy_path(e, df, 333)]
+        else:
+            runs += [lambda e, df: e.evaluate(df, 333)]
+        return runs
+
+    def test_arithmetic(self):
+        for (text, expected) in ARITHMETIC:
+            e = Expression(text)
+            for run in self.paths():
+                result = run(e, self.df)
+                np.testing.assert_allclose(result, expected(self.df).values, err_msg=text)
+
+    def test_boolean(self):
+        for (text, expected) in BOOLEAN:
+            e = Expression(text)
+            for run in self.paths():
+                result = run(e, self.df)
+                self.assertEqual(result.dtype, bool, text)
+                self.assertTrue((result == expected(self.df).values).all(), text)
+
+    def test_strings_use_numpy(self):
+        e = Expression("site_domain == 'site3.example.com' or Imps > 10000")
+        self.assertIsNone(e.numexpr_text)
+        expected = (self.df.site_domain == 'site3.example.com') | (self.df.Imps > 10000)
+        self.assertTrue((e.mask(self.df) == expected.values).all())
+
+    def test_downcast_columns_do_not_overflow(self):
+        df = pd.DataFrame({'a': np.array([100, 120, -100], dtype=np.int8)})
+        for run in self.paths():
+            self.assertEqual(list(run(Expression('a * 100 + a'), df)), [10100, 12120, -10100])
+
+    def test_numbers_in_text_columns(self):
+        df = pd.DataFrame({'a': np.array(['1.5', '2', '4'], dtype=object), 'b': [1, 2, 0]})
+        self.assertEqual(list(Expression('a * b').evaluate(df)), [1.5, 4.0, 0.0])
+        self.assertTrue(np.isnan(Expression('a / b').evaluate(df)[2]))
+
+    def test_empty_frame(self):
+        self.assertEqual(len(Expression('Imps + 1').evaluate(self.df.iloc[:0])), 0)
+
+    def test_errors(self):
+        for text in ['abs(Imps)', 'Imps.max', 'lambda: 1', 'Imps if Clicks else Convs', 'Imps +']:
+            self.assertRaises(ExpressionError, Expression, text)
+        self.assertRaises(ExpressionError, Expression('Impz + 1').evaluate, self.df)
+        self.assertRaises(ExpressionError, Expression('Imps + 1').mask, self.df)
+
+
+if __name__ == '__main__':
+    unittest.main()
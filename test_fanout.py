@@ -0,0 +1,97 @@
+'''
+Writing one dataframe to several destinations at once with fanout.py.
+
+python -m unittest test_fanout
+'''
+
+import threading, unittest
+import numpy as np
+import pandas as pd
+from fanout import write_all
+from sketch import SketchFrame
+
+
+class AddColumn:
+    ''' a writer that adds a column to the frame it is given '''
+
+    def __init__(self, config):
+        self.config = config
+
+    def write(self, df):
+        df[self.config['column']] = self.config['value']
+        self.config['seen'] = sorted(df.columns)
+        return True
+
+
+class Zero:
+    ''' a writer that changes values, and says so '''
+    mutates = True
+
+    def __init__(self, config):
+        self.config = config
+
+    def write(self, df):
+        df['Imps'] = 0
+        df.loc[0, 'site_domain'] = 'z'
+        self.config['seen'] = list(df['Imps'])
+        return True
+
+
+class Blocked:
+    ''' a writer that waits on an event '''
+
+    def __init__(self, config):
+        self.config = config
+
+    def write(self, df):
+        self.config['event'].wait()
+        return True
+
+
+def create(config):
+    return {'add': AddColumn, 'zero': Zero, 'blocked': Blocked}[config['type']](config)
+
+
+class FanoutTest(unittest.TestCase):
+
+    def setUp(self):
+        self.df = pd.DataFrame({'site_domain': ['a', 'b', 'c'], 'Imps': np.arange(3)})
+
+    def test_writers_get_columns_of_their_own(self):
+        destinations = [{'type':'add', 'column':'x', 'value':1}, {'type':'add', 'column':'y', 'value':2},
+                        {'type':'zero'}]
+        writes = write_all(destinations, self.df, create)
+        self.assertTrue(all(write.ok() for write in writes))
+        self.assertEqual(destinations[0]['seen'], ['Imps', 'site_domain', 'x'])
+        self.assertEqual(destinations[1]['seen'], ['Imps', 'site_domain', 'y'])
+        self.assertEqual(destinations[2]['seen'], [0, 0, 0])
+        self.assertEqual(sorted(self.df.columns), ['Imps', 'site_domain'])
+        self.assertEqual(list(self.df['Imps']), [0, 1, 2])
+        self.assertEqual(list(self.df['site_domain']), ['a', 'b', 'c'])
+
+    def test_sketches_are_passed_on(self):
+        df = SketchFrame(self.df)
+        df.sketches = object()
+        seen = []
+
+        class Sketches:
+            def write(self, frame):
+                seen.append(frame.sketches)
+                return True
+        write_all([{'type':'sketch'}], df, lambda config: Sketches())
+        self.assertEqual(seen, [df.sketches])
+
+    def test_timeout_and_failed_create(self):
+        event = threading.Event()
+        destinations = [{'type':'blocked', 'event':event, 'timeout_seconds':0.1}, {'type':'unknown'}]
+        writes = write_all(destinations, self.df, create)
+        self.assertFalse(writes[0].finished)
+        self.assertIn('KeyError', writes[1].error)
+        self.assertFalse(any(write.ok() for write in writes))
+        event.set()
+        writes[0].thread.join()
+        self.assertTrue(writes[0].ok())
+
+
+if __name__ == '__main__':
+    unittest.main()
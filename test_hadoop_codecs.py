@@ -0,0 +1,241 @@
+'''
+Round trips text through every part file format of hadoop_codecs.py. Fixtures are written in the
+framing Hadoop uses, the lzo and snappy ones need their python packages.
+
+fixtures/ holds one part file of each format, made from fixtures/domains.csv by the reference
+compressors: lzo1x_1 of minilzo (5 compressed and 4 stored blocks), snappy, gzip and zlib.
+
+python -m unittest test_hadoop_codecs
+'''
+
+import gzip, os, shutil, struct, tempfile, unittest, zlib
+import pandas as pd
+import hadoop_codecs
+from benchmark import OfflineEnvironment, benchmark_feed, generate_blocks, write_partition
+from reader import HadoopFeedReader
+
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def lines(rows, seed):
+    return generate_blocks(rows, 500, seed=seed).to_csv(None, header=False, index=False)
+
+
+def blocks(text, size):
+    return [text[i:i + size] for i in xrange(0, len(text), size)]
+
+
+def write_gzip(path, text):
+    ''' two gzip members, as written by concatenating gzip streams '''
+    with open(path, 'wb') as f:
+        for piece in blocks(text, len(text) // 2 + 1):
+            member = gzip.GzipFile(fileobj=f, mode='wb')
+            member.write(piece)
+            member.close()
+
+
+def write_deflate(path, text):
+    with open(path, 'wb') as f:
+        f.write(zlib.compress(text))
+
+
+def write_snappy(path, text, block_size=65536, chunk_size=16384):
+    ''' Hadoop's BlockCompressorStream framing around raw snappy chunks '''
+    import snappy
+    with open(path, 'wb') as f:
+        for block in blocks(text, block_size):
+            f.write(struct.pack('>I', len(block)))
+            for chunk in blocks(block, chunk_size):
+                data = snappy.compress(chunk)
+                f.write(struct.pack('>I', len(data)) + data)
+
+
+def write_lzop(path, text, compress=True, flags=None, block_size=65536):
+    ''' an lzop file, blocks that do not shrink (or every block, without compress) are stored '''
+    if flags is None:
+        flags = (hadoop_codecs.F_ADLER32_D | hadoop_codecs.F_ADLER32_C |
+                 hadoop_codecs.F_CRC32_D | hadoop_codecs.F_CRC32_C)
+    if compress:
+        import lzo
+    with open(path, 'wb') as f:
+        name = os.path.basename(path)
+        header = struct.pack('>HHHBBI', 0x1030, 0x2080, 0x0940, 1, 5, flags)
+        header += struct.pack('>III', 0100644, 0, 0) + struct.pack('>B', len(name)) + name
+        f.write(hadoop_codecs.LZOP_MAGIC + header + struct.pack('>I', zlib.adler32(header) & 0xffffffff))
+        for block in blocks(text, block_size):
+            data = lzo.compress(block, 1, False) if compress else block
+            if len(data) >= len(block):
+                data = block
+            f.write(struct.pack('>II', len(block), len(data)))
+            for (flag, checksum, value) in [(hadoop_codecs.F_ADLER32_D, zlib.adler32, block),
+                                            (hadoop_codecs.F_CRC32_D, zlib.crc32, block)]:
+                if flags & flag:
+                    f.write(struct.pack('>I', checksum(value) & 0xffffffff))
+            if len(data) < len(block):
+                for (flag, checksum) in [(hadoop_codecs.F_ADLER32_C, zlib.adler32),
+                                         (hadoop_codecs.F_CRC32_C, zlib.crc32)]:
+                    if flags & flag:
+                        f.write(struct.pack('>I', checksum(data) & 0xffffffff))
+            f.write(data)
+        f.write(struct.pack('>I', 0))
+
+
+class HadoopCodecsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='rpw_codecs_')
+        self.texts = [lines(3000, seed) for seed in range(3)]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def parts(self, write, ext, **kwargs):
+        paths = []
+        for i, text in enumerate(self.texts):
+            path = os.path.join(self.directory, 'part-r-%05d%s' % (i, ext))
+            write(path, text, **kwargs)
+            paths.append(path)
+        return paths
+
+    def assertRoundTrips(self, paths, open_part=hadoop_codecs.open_part):
+        for path, text in zip(paths, self.texts):
+            with open_part(path) as part:
+                self.assertEqual(part.read(), text)
+            # small reads, across block boundaries
+            with open_part(path) as part:
+                pieces = []
+                while True:
+                    piece = part.read(1000)
+                    if not piece:
+                        break
+                    pieces.append(piece)
+                self.assertEqual(''.join(pieces), text)
+            with open_part(path) as part:
+                self.assertEqual(list(part), text.splitlines(True))
+
+        def decode(path):
+            with open_part(path) as part:
+                return pd.read_csv(part, header=None)
+        expected = [pd.read_csv(pd.compat.StringIO(text), header=None) for text in self.texts]
+        for workers in [1, 4]:
+            decoded = list(hadoop_codecs.decode_parts(paths, decode, workers))
+            self.assertEqual(len(decoded), len(expected))
+            for df, other in zip(decoded, expected):
+                self.assertTrue(df.equals(other))
+
+    def test_gzip(self):
+        paths = self.parts(write_gzip, '.gz')
+        self.assertTrue(all(hadoop_codecs.available(path) for path in paths))
+        self.assertRoundTrips(paths)
+
+    def test_deflate(self):
+        self.assertRoundTrips(self.parts(write_deflate, '.deflate'))
+
+    def test_lzop_stored_blocks(self):
+        # stored blocks are copied as they are, without the lzo package
+        paths = self.parts(write_lzop, '.lzo', compress=False)
+        self.assertRoundTrips(paths, lambda path: hadoop_codecs.LzopStream(open(path, 'rb')))
+
+    @unittest.skipUnless(hadoop_codecs.has_module('lzo'), 'needs the python-lzo package')
+    def test_lzop_compressed_blocks(self):
+        paths = self.parts(write_lzop, '.lzo')
+        self.assertRoundTrips(paths)
+        paths = self.parts(write_lzop, '.lzo', flags=hadoop_codecs.F_ADLER32_D)
+        self.assertRoundTrips(paths)
+
+    @unittest.skipUnless(hadoop_codecs.has_module('snappy'), 'needs the python-snappy package')
+    def test_snappy(self):
+        self.assertRoundTrips(self.parts(write_snappy, '.snappy'))
+
+    def test_lzop_corrupt_block(self):
+        path = self.parts(write_lzop, '.lzo', compress=False)[0]
+        with open(path, 'r+b') as f:
+            f.seek(-100, os.SEEK_END)
+            f.write('#')
+        with hadoop_codecs.LzopStream(open(path, 'rb')) as part:
+            self.assertRaises(Exception, part.read)
+
+    def test_truncated_part(self):
+        path = self.parts(write_lzop, '.lzo', compress=False)[0]
+        with open(path, 'r+b') as f:
+            f.truncate(os.path.getsize(path) - 100)
+        with hadoop_codecs.LzopStream(open(path, 'rb')) as part:
+            self.assertRaises(Exception, part.read)
+
+    def test_is_part(self):
+        for name in ['part-r-00000', 'part-m-00001.gz', 'part-r-00002.snappy', 'x.lzo']:
+            self.assertTrue(hadoop_codecs.is_part('/dv/2014/06/05/' + name))
+        for name in ['.pig_header', '_SUCCESS', 'supergroup', '2014-06-05', 'part-r-00000.lzo.index']:
+            self.assertFalse(hadoop_codecs.is_part(name))
+
+
+class FixtureTest(unittest.TestCase):
+    ''' part files written by the reference compressors '''
+
+    def setUp(self):
+        with open(os.path.join(FIXTURES, 'domains.csv'), 'rb') as f:
+            self.text = f.read()
+
+    def assertDecodes(self, name):
+        path = os.path.join(FIXTURES, name)
+        self.assertTrue(hadoop_codecs.available(path))
+        with hadoop_codecs.open_part(path) as part:
+            self.assertEqual(part.read(), self.text)
+        with hadoop_codecs.open_part(path) as part:
+            self.assertEqual(list(part), self.text.splitlines(True))
+
+    def test_gzip(self):
+        self.assertDecodes('part-r-00002.gz')
+
+    def test_deflate(self):
+        self.assertDecodes('part-r-00003.deflate')
+
+    @unittest.skipUnless(hadoop_codecs.has_module('lzo'), 'needs the python-lzo package')
+    def test_lzop(self):
+        self.assertDecodes('part-r-00000.lzo')
+
+    @unittest.skipUnless(hadoop_codecs.has_module('snappy'), 'needs the python-snappy package')
+    def test_snappy(self):
+        self.assertDecodes('part-r-00001.snappy')
+
+    @unittest.skipIf(hadoop_codecs.has_module('lzo'), 'the lzo package is installed')
+    def test_lzop_without_package(self):
+        # the header and stored blocks are read, the first compressed block asks for the package
+        with hadoop_codecs.LzopStream(open(os.path.join(FIXTURES, 'part-r-00000.lzo'), 'rb')) as part:
+            self.assertRaises(ImportError, part.read)
+
+
+class ListPartsTest(unittest.TestCase):
+    ''' the part files a partition lists, with the fake hdfs of benchmark.py '''
+
+    def setUp(self):
+        self.df = generate_blocks(2000, 100)
+        self.source = benchmark_feed()['sources'][0]
+
+    def read(self, codec):
+        with OfflineEnvironment() as env:
+            path = write_partition(self.df, env.data, parts=3, codec=codec)
+            # an lzo index and the marker of a finished job sit next to the parts
+            for name in ['part-r-00001.lzo.index', '_SUCCESS']:
+                with open(os.path.join(path, name), 'wb') as f:
+                    f.write('\x00\x00\x00\x00\x00\x00\x01\x00')
+            reader = HadoopFeedReader(self.source)
+            (headers, data_files) = reader.listHDFS()
+            return ([os.path.basename(f) for f in data_files], reader.read())
+
+    def test_text_parts(self):
+        (names, df) = self.read('text')
+        self.assertEqual(names, ['part-r-00000', 'part-r-00001', 'part-r-00002'])
+        self.assertEqual(len(df), len(self.df))
+        self.assertEqual(df['Imps'].sum(), self.df['Imps'].sum())
+
+    def test_gzip_parts(self):
+        (names, df) = self.read('gzip')
+        self.assertEqual(names, ['part-r-00000.gz', 'part-r-00001.gz', 'part-r-00002.gz'])
+        self.assertEqual(len(df), len(self.df))
+        self.assertEqual(df['Imps'].sum(), self.df['Imps'].sum())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+'''
+Joins of two sources on key columns.
+
+python -m unittest test_joiner
+'''
+
+import unittest
+import numpy as np
+import pandas as pd
+from joiner import Joiner
+
+
+class JoinerTest(unittest.TestCase):
+
+    def test_keys_of_different_dtypes(self):
+        left = pd.DataFrame({'id': np.arange(1, 41, dtype=np.int64), 'Imps': np.arange(40)})
+        right = pd.DataFrame({'id': np.arange(1, 41, dtype=np.float64)[::-1], 'category': np.arange(40)[::-1]})
+        for (a, b) in [(left, right), (right, left)]:
+            for how in ['inner', 'left', 'right', 'outer']:
+                df = Joiner({'on':'id', 'how':how}).join(a, b)
+                self.assertEqual(len(df), 40)
+                self.assertEqual(list(df['Imps']), list(df['category']))
+
+    def test_missing_keys(self):
+        left = pd.DataFrame({'site_domain': ['a.com', 'b.com', 'c.com', 'b.com'], 'Imps': [1, 2, 3, 4]})
+        right = pd.DataFrame({'domain': ['b.com', 'd.com'], 'category': [7, 8]})
+        config = {'left_on':'site_domain', 'right_on':'domain'}
+        df = Joiner(dict(config, how='inner')).join(left, right)
+        self.assertEqual(list(df['Imps']), [2, 4])
+        df = Joiner(dict(config, how='left')).join(left, right)
+        # the rows of the left side, in order
+        self.assertEqual(list(df['Imps']), [1, 2, 3, 4])
+        self.assertEqual(list(df['category'].fillna(0)), [0, 7, 0, 7])
+        df = Joiner(dict(config, how='outer')).join(left, right)
+        self.assertEqual(len(df), 5)
+
+    def test_stats(self):
+        left = pd.DataFrame({'id': np.arange(1000), 'Imps': np.ones(1000)})
+        right = pd.DataFrame({'id': np.arange(10), 'category': np.arange(10)})
+        joiner = Joiner({'on':['id'], 'how':'left'})
+        df = joiner.join(left, right)
+        self.assertEqual(joiner.stats['rows'], 1000)
+        # the hash table is built from the keys of the small side
+        self.assertEqual(joiner.stats['hash_bytes'], int(right[['id']].memory_usage(index=True, deep=True).sum()))
+        self.assertEqual(joiner.stats['bytes'], int(df.memory_usage(index=True, deep=True).sum()))
+
+
+if __name__ == '__main__':
+    unittest.main()
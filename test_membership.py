@@ -0,0 +1,126 @@
+'''
+The "in" and "not in" value sets keep the same rows with and without the Bloom filter.
+
+python -m unittest test_membership
+'''
+
+import os, shutil, tempfile, unittest
+import numpy as np
+import pandas as pd
+from benchmark import generate_blocks
+from membership import BloomFilter, ValueSet, canonical, value_set
+from processor import DataProcessor
+
+
+MODES = [{}, {'error_rate':0.001}, {'error_rate':0.001, 'exact':False}]
+
+
+class ValueSetTest(unittest.TestCase):
+
+    def assertKeeps(self, values, column, expected):
+        for mode in MODES:
+            mask = ValueSet(values, **mode).contains(pd.Series(column))
+            self.assertEqual(list(mask), expected, 'mode %s' % mode)
+
+    def test_numbers_in_text_column(self):
+        self.assertKeeps([1, 2], ['1', '2', '3', '1', 'x'], [True, True, False, True, False])
+
+    def test_text_in_number_columns(self):
+        self.assertKeeps(['5', '7'], [5, 6, 7], [True, False, True])
+        self.assertKeeps(['5', '7'], [5.0, 6.0, np.nan], [True, False, False])
+
+    def test_integral_floats(self):
+        self.assertKeeps([5, 5.5], [5, 6], [True, False])
+        self.assertKeeps([5.0, 6.0], np.array([5, 6, 7], dtype=np.int8), [True, True, False])
+        self.assertKeeps([5, 6], [5.0, 5.5, 6.0], [True, False, True])
+
+    def test_strings(self):
+        self.assertKeeps(['a.com', 'b.com'], ['a.com', 'c.com', 'b.com'], [True, False, True])
+
+    def test_canonical(self):
+        self.assertEqual(list(canonical(np.array([5.0, 5.5, np.nan]))), ['5', '5.5', 'nan'])
+        self.assertEqual(list(canonical(np.array(['5', 5.0, 6], dtype=object))), ['5', '5', '6'])
+        self.assertEqual(list(canonical(np.array([5, 6], dtype=np.int16))), ['5', '6'])
+
+
+class BloomFilterTest(unittest.TestCase):
+
+    def test_no_false_negatives_and_few_false_positives(self):
+        members = np.array(['site%d.example.com' % i for i in range(20000)], dtype=object)
+        others = np.array(['other%d.example.net' % i for i in range(100000)], dtype=object)
+        for error_rate in [0.01, 0.001]:
+            bloom = BloomFilter(members, error_rate)
+            self.assertTrue(bloom.contains(members).all())
+            self.assertLess(bloom.contains(others).mean(), 2 * error_rate)
+            # about 1.44 log2(1 / error_rate) bits per value, packed 8 to a byte
+            self.assertLess(len(bloom.bits), 2.0 * len(members) * np.log2(1 / error_rate) / 8)
+
+    def test_numbers_match_their_text(self):
+        bloom = BloomFilter(np.array([5, 7]))
+        self.assertEqual(list(bloom.contains(np.array(['5', '7']))), [True, True])
+        self.assertEqual(list(bloom.contains(np.array([5.0, 7.0]))), [True, True])
+
+
+class ValueSetSelectorTest(unittest.TestCase):
+    ''' in / not in selectors of a feed, through the value sets of the processor '''
+
+    @classmethod
+    def setUpClass(cls):
+        cls.df = generate_blocks(20000, 3000, seed=4)
+        cls.domains = ['site%d.example.com' % i for i in range(0, 3000, 3)]
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='rpw_membership_')
+        self.value_file = os.path.join(self.directory, 'allowlist.txt')
+        with open(self.value_file, 'w') as f:
+            f.write('\n'.join(self.domains) + '\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def select(self, selector):
+        processor = DataProcessor({'selectors': [selector]})
+        return processor.select_single(self.df, selector)
+
+    def test_value_file_with_and_without_bloom(self):
+        expected = self.df[self.df['site_domain'].isin(self.domains)]
+        for comparator in ['in', 'not in']:
+            if comparator == 'not in':
+                expected = self.df[~self.df['site_domain'].isin(self.domains)]
+            for bloom in [None, {}, {"error_rate":0.01}]:
+                selector = {"column_name":"site_domain", "comparator":comparator, "value_file":self.value_file}
+                if bloom is not None:
+                    selector['bloom'] = bloom
+                self.assertEqual(list(self.select(selector).index), list(expected.index), str(bloom))
+
+    def test_bloom_only(self):
+        selector = {"column_name":"site_domain", "comparator":"in", "value_file":self.value_file,
+                    "bloom":{"error_rate":0.01, "exact":False}}
+        values = value_set(selector)
+        self.assertIsNone(values.values)
+        self.assertEqual(values.bloom.k, 7)
+        # every member is kept, with a few other rows
+        result = self.select(selector)
+        expected = self.df[self.df['site_domain'].isin(self.domains)]
+        self.assertTrue(set(expected.index) <= set(result.index))
+        self.assertLess(len(result) - len(expected), 0.02 * (len(self.df) - len(expected)) + 5)
+
+    def test_value_source(self):
+        source = os.path.join(self.directory, 'domains.csv')
+        pd.DataFrame({'domain': self.domains, 'n': range(len(self.domains))}).to_csv(source, index=False)
+        selector = {"column_name":"site_domain", "comparator":"in", "bloom":{},
+                    "value_source":{"type":"CSV", "filename":source}, "value_column":"domain"}
+        expected = self.df[self.df['site_domain'].isin(self.domains)]
+        self.assertEqual(list(self.select(selector).index), list(expected.index))
+
+    def test_read_once_per_processor(self):
+        selector = {"column_name":"site_domain", "comparator":"in", "value_file":self.value_file, "bloom":{}}
+        processor = DataProcessor({'selectors': [selector]})
+        values = processor.value_set(selector)
+        os.remove(self.value_file)
+        self.assertTrue(processor.value_set(dict(selector)) is values)
+        processor.select_single(self.df, selector)
+
+
+if __name__ == '__main__':
+    unittest.main()
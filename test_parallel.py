@@ -0,0 +1,129 @@
+'''
+Operators and selectors on worker processes give exactly the frame of the serial run: the same
+rows, values, dtypes and index, also across checkpoints and when blocks are left empty.
+
+python -m unittest test_parallel
+'''
+
+import threading, unittest
+import pandas as pd
+from pandas.util.testing import assert_frame_equal
+import parallel
+from benchmark import generate_blocks, offline_feed
+from compiler import compile_feed
+from downcast import downcast
+
+
+PARALLEL = {"workers":3, "block_rows":1500}
+
+OPERATORS = [
+    {"column_name_1":"Imps_blocked", "column_name_2":"Imps", "column_name_new":"Fraud", "operation":"/"},
+    {"column_name_1":"Clicks", "column_name_2":"Convs", "column_name_new":"Actions", "operation":"+"},
+    {"expression":"(Imps - Imps_blocked) * MediaCost / 1000", "column_name_new":"Spend", "operation":"expression"},
+]
+
+SELECTORS = [
+    {"column_name":"dv_block_reason", "comparator":"in", "value":[1, 2, 4]},
+    {"column_name":"site_domain", "comparator":"not in", "value":["site0.example.com", "site3.example.com"]},
+    {"column_name":"Imps", "comparator":">", "value":300},
+    {"expression":"Fraud < 0.5", "comparator":"expression"},
+]
+
+NOTHING = {"column_name":"Imps", "comparator":">", "value":10 ** 12}
+
+
+class Recorder:
+    ''' the frames a run would checkpoint, after the plan stages in positions '''
+
+    def __init__(self, positions):
+        self.positions = positions
+        self.frames = {}
+
+    def after(self, n, df):
+        if n in self.positions:
+            self.frames[n] = df.copy()
+
+
+class ParallelTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.df = generate_blocks(12000, 400)
+
+    def assertSameRun(self, df, operators, selectors, positions=None):
+        ''' the serial and the parallel run, and their checkpoints, give the same frames '''
+        serial = compile_feed(offline_feed(name='serial', operators=operators, selectors=selectors))
+        parallel = compile_feed(offline_feed(name='parallel', operators=operators, selectors=selectors, parallel=PARALLEL))
+        checkpoints = [Recorder(positions) if positions is not None else None for i in range(2)]
+        expected = serial.process(df.copy(), checkpoint=checkpoints[0])
+        result = parallel.process(df.copy(), checkpoint=checkpoints[1])
+        assert_frame_equal(expected, result)
+        if positions is not None:
+            self.assertEqual(sorted(checkpoints[0].frames), sorted(checkpoints[1].frames))
+            for n in checkpoints[0].frames:
+                assert_frame_equal(checkpoints[0].frames[n], checkpoints[1].frames[n])
+        return result
+
+    def test_operators_and_selectors(self):
+        result = self.assertSameRun(self.df, OPERATORS, SELECTORS)
+        self.assertGreater(len(result), 0)
+        self.assertLess(len(result), len(self.df))
+
+    def test_downcast_columns(self):
+        df = downcast(self.df)
+        self.assertSameRun(df, OPERATORS, SELECTORS)
+
+    def test_selectors_only(self):
+        self.assertSameRun(self.df, [], SELECTORS[:3])
+
+    def test_operators_only(self):
+        self.assertSameRun(self.df, OPERATORS, [])
+
+    def test_nothing_selected(self):
+        result = self.assertSameRun(self.df, OPERATORS, SELECTORS[:2] + [NOTHING])
+        self.assertEqual(len(result), 0)
+        result = self.assertSameRun(self.df, [], [NOTHING])
+        self.assertEqual(len(result), 0)
+
+    def test_empty_blocks(self):
+        # rows sorted by Imps, so only the last blocks keep rows
+        df = self.df.sort_values('Imps', kind='mergesort').reset_index(drop=True)
+        threshold = df['Imps'].iloc[int(len(df) * 0.9)]
+        result = self.assertSameRun(df, OPERATORS, [{"column_name":"Imps", "comparator":">", "value":int(threshold)}])
+        self.assertGreater(len(result), 0)
+        self.assertGreater(result.index[0], 5 * PARALLEL['block_rows'])
+
+    def test_empty_frame(self):
+        self.assertSameRun(self.df.iloc[:0], OPERATORS, SELECTORS)
+
+    def test_checkpoint_boundaries(self):
+        plan = compile_feed(offline_feed(name='parallel', operators=OPERATORS, selectors=SELECTORS, parallel=PARALLEL))
+        stages = len(plan.stages)
+        for positions in [{0:'read'}, {0:'read', 2:'stage', stages:'processed'},
+                          {1:'stage', 3:'stage', 4:'stage', stages - 1:'stage'}]:
+            self.assertSameRun(self.df, OPERATORS, SELECTORS, positions)
+        # a checkpoint splits the run of row stages into segments
+        self.assertEqual(plan.parallel_end(0, Recorder({2:'stage'})), 2)
+        self.assertEqual(plan.parallel_end(2, Recorder({2:'stage'})), stages)
+
+    def test_serial_off_the_main_thread(self):
+        # scheduler worker threads never fork a pool
+        def no_pool(*args, **kwargs):
+            raise AssertionError('forked a pool off the main thread')
+        plan = compile_feed(offline_feed(name='parallel', operators=OPERATORS, selectors=SELECTORS, parallel=PARALLEL))
+        results = []
+        pool = parallel.multiprocessing.Pool
+        parallel.multiprocessing.Pool = no_pool
+        try:
+            thread = threading.Thread(target=lambda: results.append(plan.process(self.df.copy())))
+            thread.start()
+            thread.join()
+        finally:
+            parallel.multiprocessing.Pool = pool
+        self.assertEqual(len(results), 1)
+        expected = compile_feed(offline_feed(name='serial', operators=OPERATORS, selectors=SELECTORS)).process(self.df.copy())
+        assert_frame_equal(expected, results[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
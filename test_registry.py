@@ -0,0 +1,63 @@
+'''
+Capabilities of the registered backends, and the compiler refusing a destination that asks
+for one its writer does not have.
+
+python -m unittest test_registry
+'''
+
+import os, shutil, tempfile, unittest
+import pandas as pd
+from benchmark import offline_feed
+from compiler import compile_feed, ConfigError
+from registry import writers, createWriter
+
+
+def feed(*destinations):
+    return offline_feed(name='append', destinations=list(destinations))
+
+
+class CapabilitiesTest(unittest.TestCase):
+
+    def test_append_writers(self):
+        appending = sorted(name for name in writers.backends if writers.get(name).supports('append'))
+        self.assertEqual(appending, ['CSV', 'database', 'sketch'])
+
+    def test_destinations_that_cannot_append(self):
+        for dest in [{"type":"stdout", "append":True},
+                     {"type":"chart", "filename":"c.png", "x_column_name":"Imps", "y_column_name":"Clicks", "append":True},
+                     {"type":"CSV", "filename":"domains.csv", "append":True, "compression":"gzip"}]:
+            self.assertRaises(ConfigError, compile_feed, feed(dest))
+
+    def test_destinations_that_append(self):
+        compile_feed(feed({"type":"CSV", "filename":"domains.csv", "append":True},
+                          {"type":"sketch", "filename":"domains.sketch", "merge":True},
+                          {"type":"stdout", "append":False}))
+
+
+class CsvAppendTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='rpw_registry_')
+        self.filename = os.path.join(self.directory, 'domains.csv')
+        self.df = pd.DataFrame({'site_domain': ['a', 'b'], 'Imps': [1, 2]}, columns=['site_domain', 'Imps'])
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_append_adds_rows_under_one_header(self):
+        writer = createWriter({"type":"CSV", "filename":self.filename, "append":True})
+        writer.write(self.df)
+        writer.write(self.df)
+        df = pd.read_csv(self.filename)
+        self.assertEqual(list(df.columns), ['site_domain', 'Imps'])
+        self.assertEqual(list(df['site_domain']), ['a', 'b', 'a', 'b'])
+
+    def test_without_append_replaces(self):
+        writer = createWriter({"type":"CSV", "filename":self.filename})
+        writer.write(self.df)
+        writer.write(self.df)
+        self.assertEqual(len(pd.read_csv(self.filename)), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+'''
+The --daemon scheduler: reloading its config, and never running a feed twice at once.
+
+python -m unittest test_scheduler
+'''
+
+import json, os, shutil, tempfile, threading, time, unittest
+import feed_driver
+from benchmark import offline_feed
+from scheduler import FeedScheduler, Job
+
+
+def scheduled(name, every_minutes=60, **sections):
+    return offline_feed(name=name, schedule={"every_minutes":every_minutes}, **sections)
+
+
+class ReloadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='rpw_scheduler_')
+        self.config_file = os.path.join(self.directory, 'config.json')
+        self.scheduler = FeedScheduler(self.config_file)
+        self.version = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, text):
+        with open(self.config_file, 'w') as f:
+            f.write(text)
+        # a new mtime for every write, however fast they follow each other
+        self.version += 1
+        os.utime(self.config_file, (1000000000 + self.version, 1000000000 + self.version))
+
+    def write_feeds(self, feeds):
+        self.write(json.dumps({"feeds":feeds}))
+
+    def test_reload_keeps_the_schedule_of_unchanged_feeds(self):
+        self.write_feeds([scheduled('a'), scheduled('b')])
+        self.assertTrue(self.scheduler.load())
+        self.assertEqual(sorted(self.scheduler.jobs), ['a', 'b'])
+        a = self.scheduler.jobs['a']
+        self.assertFalse(self.scheduler.reload_if_changed())
+
+        self.write_feeds([scheduled('a'), scheduled('b', 5), scheduled('c')])
+        self.assertTrue(self.scheduler.reload_if_changed())
+        self.assertEqual(sorted(self.scheduler.jobs), ['a', 'b', 'c'])
+        self.assertTrue(self.scheduler.jobs['a'] is a)
+        self.assertEqual(self.scheduler.jobs['b'].interval, 300)
+
+        # removed feeds are dropped
+        self.write_feeds([scheduled('b', 5)])
+        self.assertTrue(self.scheduler.reload_if_changed())
+        self.assertEqual(sorted(self.scheduler.jobs), ['b'])
+
+    def test_invalid_config_keeps_the_last_good_feeds(self):
+        self.write_feeds([scheduled('a')])
+        self.assertTrue(self.scheduler.load())
+        jobs = self.scheduler.jobs
+        for text in ['{"feeds": [', json.dumps({"feeds":[scheduled('a', -1)]}),
+                     json.dumps({"feeds":[scheduled('a', selectors=[5])]}), '[]']:
+            self.write(text)
+            self.assertFalse(self.scheduler.reload_if_changed())
+            self.assertTrue(self.scheduler.jobs is jobs)
+        os.remove(self.config_file)
+        self.assertFalse(self.scheduler.reload_if_changed())
+        self.assertTrue(self.scheduler.jobs is jobs)
+
+
+class OverlapTest(unittest.TestCase):
+
+    def setUp(self):
+        self.run_feed = feed_driver.run_feed
+        self.started = []
+        self.release = threading.Event()
+
+        def run_feed(feed, cache=None, resume=False):
+            self.started.append(feed['name'])
+            self.release.wait()
+            if feed['name'] == 'fails':
+                raise Exception('failed')
+        feed_driver.run_feed = run_feed
+
+        self.scheduler = FeedScheduler('unused.json', workers=2, poll_seconds=0.01)
+        now = time.time()
+        with self.scheduler.lock:
+            for feed in [scheduled('a', 1), scheduled('fails', 1)]:
+                self.scheduler.jobs[feed['name']] = Job(feed, now)
+        self.threads = [threading.Thread(target=self.scheduler.worker) for i in range(2)]
+        for t in self.threads:
+            t.start()
+
+    def tearDown(self):
+        self.release.set()
+        self.scheduler.stop()
+        for t in self.threads:
+            t.join()
+        feed_driver.run_feed = self.run_feed
+
+    def start(self, now):
+        jobs = self.scheduler.due(now)
+        for job in jobs:
+            self.scheduler.queue.put(job)
+        return sorted(job.name for job in jobs)
+
+    def wait_idle(self):
+        while self.scheduler.running:
+            time.sleep(0.01)
+
+    def test_a_running_feed_skips_its_turn(self):
+        now = time.time()
+        self.assertEqual(self.start(now), ['a', 'fails'])
+        self.assertEqual(self.start(now + 30), [])
+        # due again, but still running
+        self.assertEqual(self.start(now + 61), [])
+        self.assertEqual(self.scheduler.running, set(['a', 'fails']))
+        self.release.set()
+        self.wait_idle()
+        # a failed run does not keep the feed from its next turn
+        self.assertEqual(self.start(now + 122), ['a', 'fails'])
+        self.wait_idle()
+        self.assertEqual(sorted(self.started), ['a', 'a', 'fails', 'fails'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+'''
+Bounds of the sketches, and merging them into a sketch file once per partition.
+
+python -m unittest test_sketch
+'''
+
+import os, shutil, tempfile, unittest
+import numpy as np
+import pandas as pd
+import sketch
+from sketch import SpaceSaving, HyperLogLog, SketchSet
+from writer import SketchWriter
+
+
+RULES = [{"name":"domains", "type":"distinct", "column_name":"site_domain"},
+         {"name":"blocked", "type":"heavy_hitters", "column_name":"site_domain", "weight":"Imps", "k":20}]
+
+
+def zipf_values(rows, seed=0):
+    return np.random.RandomState(seed).zipf(1.3, rows) % 100000
+
+
+class SpaceSavingTest(unittest.TestCase):
+
+    def test_bounds_over_blocks(self):
+        values = zipf_values(5 * sketch.BLOCK_ROWS + 123)
+        weights = np.random.RandomState(1).randint(1, 10, len(values)).astype(np.float64)
+        ss = SpaceSaving(20)
+        ss.update(values, weights)
+        self.assertLessEqual(len(ss.counts), 20)
+        (counts, errors) = ss.top()
+        true = pd.Series(weights).groupby(values).sum()
+        self.assertGreater(errors.max(), 0)
+        for value in counts.index:
+            self.assertLessEqual(counts[value] - errors[value], true[value] + 1e-6)
+            self.assertGreaterEqual(counts[value], true[value] - 1e-6)
+        # the heaviest values stand well above the error
+        for value in true.sort_values(ascending=False).index[:5]:
+            self.assertIn(value, counts.index)
+
+    def test_small_input_is_exact(self):
+        ss = SpaceSaving(10)
+        ss.update(np.array(['a', 'b', 'a', 'c', 'a', 'b']))
+        (counts, errors) = ss.top()
+        self.assertEqual(list(counts.index), ['a', 'b', 'c'])
+        self.assertEqual(list(counts.values), [3, 2, 1])
+        self.assertEqual(errors.max(), 0)
+
+
+class HyperLogLogTest(unittest.TestCase):
+
+    def test_estimate_within_error(self):
+        hll = HyperLogLog(12)
+        for start in range(0, 200000, 50000):
+            hll.update(np.arange(start, start + 50000))
+        self.assertLess(abs(hll.estimate() / 200000.0 - 1), 4 * hll.error())
+
+
+class SketchWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='rpw_sketch_')
+        self.filename = os.path.join(self.directory, 'domains.sketch')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def summary(self, partition, seed):
+        values = zipf_values(20000, seed)
+        df = pd.DataFrame({'site_domain': values, 'Imps': np.ones(len(values))})
+        summary = SketchSet(RULES).update(df).summary()
+        summary.sketches.partitions = set([partition])
+        return summary
+
+    def total(self):
+        return SketchSet.load(self.filename).sketches[1].cm.total
+
+    def test_rerun_is_not_merged_twice(self):
+        writer = SketchWriter({"type":"sketch", "filename":self.filename, "merge":True})
+        self.assertTrue(writer.write(self.summary('hdfs /dv/ 2014/06/05', 0)))
+        self.assertEqual(self.total(), 20000)
+        self.assertTrue(writer.write(self.summary('hdfs /dv/ 2014/06/05', 0)))
+        self.assertEqual(self.total(), 20000)
+        self.assertTrue(writer.write(self.summary('hdfs /dv/ 2014/06/06', 1)))
+        self.assertEqual(self.total(), 40000)
+        self.assertEqual(SketchSet.load(self.filename).partitions,
+                set(['hdfs /dv/ 2014/06/05', 'hdfs /dv/ 2014/06/06']))
+
+    def test_saved_partitions_are_merged(self):
+        sketches = self.summary('a', 0).sketches
+        sketches.save(self.filename)
+        loaded = SketchSet.load(self.filename)
+        self.assertEqual(loaded.partitions, set(['a']))
+        loaded.merge(self.summary('b', 1).sketches)
+        self.assertEqual(loaded.partitions, set(['a', 'b']))
+        self.assertEqual(loaded.sketches[1].cm.total, 40000)
+
+    def test_without_merge_overwrites(self):
+        writer = SketchWriter({"type":"sketch", "filename":self.filename})
+        writer.write(self.summary('a', 0))
+        writer.write(self.summary('b', 1))
+        self.assertEqual(self.total(), 20000)
+        self.assertEqual(SketchSet.load(self.filename).partitions, set(['b']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+'''
+Out of core execution against the in-memory plan, on a synthetic dataset several times
+larger than the memory budget.
+
+python -m unittest test_spill
+'''
+
+import unittest
+import pandas as pd
+import spill
+from benchmark import generate_blocks, offline_feed as feed
+from compiler import compile_feed
+from joiner import frame_bytes
+
+
+BUDGET_MB = 2
+CHUNK_ROWS = 20000
+
+
+Partitioner = spill.SpillPartitioner
+
+
+class RecordingPartitioner(Partitioner):
+    ''' A SpillPartitioner that keeps the spill files it wrote '''
+    instances = []
+
+    def __init__(self, *args, **kwargs):
+        Partitioner.__init__(self, *args, **kwargs)
+        self.files = set()
+        RecordingPartitioner.instances.append(self)
+
+    def spill(self, p):
+        self.files.add(self.path(p))
+        Partitioner.spill(self, p)
+
+
+def normalized(df, columns=None):
+    columns = columns or list(df.columns)
+    return df.sort_values(columns).reset_index(drop=True)
+
+
+class OutOfCoreTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.df = generate_blocks(200000, 3000)
+
+    def setUp(self):
+        spill.SpillPartitioner = RecordingPartitioner
+        RecordingPartitioner.instances = []
+
+    def tearDown(self):
+        spill.SpillPartitioner = Partitioner
+
+    def chunks(self):
+        for start in xrange(0, len(self.df), CHUNK_ROWS):
+            yield self.df.iloc[start:start + CHUNK_ROWS].copy()
+
+    def run_both(self, config):
+        ''' (in memory result, out of core result) of a feed '''
+        expected = compile_feed(config).process(self.df.copy())
+        config = dict(config, memory_budget_mb=BUDGET_MB)
+        result = spill.process_out_of_core(compile_feed(config), self.chunks())
+        return (expected, result)
+
+    def test_dataset_is_larger_than_budget(self):
+        self.assertGreater(frame_bytes(self.df), 5 * BUDGET_MB * 1048576)
+
+    def test_aggregate_spills_and_matches(self):
+        config = feed(aggregate={"group_by":["site_domain", "dv_block_reason"], "function":"sum"}, selectors=[])
+        (expected, result) = self.run_both(config)
+        self.assertEqual(len(RecordingPartitioner.instances), 1)
+        self.assertGreater(RecordingPartitioner.instances[0].spilled, 0)
+        self.assertTrue(RecordingPartitioner.instances[0].files)
+        keys = ['site_domain', 'dv_block_reason']
+        self.assertGreater(len(expected), 0)
+        self.assertTrue(normalized(expected, keys).equals(normalized(result, keys)))
+
+    def test_aggregate_with_selectors_matches(self):
+        config = feed(aggregate={"group_by":["site_domain", "dv_block_reason"], "function":"sum"})
+        (expected, result) = self.run_both(config)
+        keys = ['site_domain', 'dv_block_reason']
+        self.assertTrue(normalized(expected, keys).equals(normalized(result, keys)))
+
+    def test_row_by_row_matches(self):
+        (expected, result) = self.run_both(feed())
+        self.assertEqual(RecordingPartitioner.instances, [])
+        self.assertGreater(len(expected), 0)
+        self.assertTrue(expected.reset_index(drop=True).equals(result))
+
+    def test_top_n_matches(self):
+        config = feed(top_n={"column_name":"Imps", "n":100})
+        (expected, result) = self.run_both(config)
+        self.assertEqual(len(result), 100)
+        self.assertTrue(normalized(expected).equals(normalized(result)))
+
+    def test_grouped_top_n_after_aggregate_matches(self):
+        config = feed(aggregate={"group_by":["site_domain", "dv_block_reason"], "function":"sum"},
+                top_n={"column_name":"Imps", "n":5, "group_by":["dv_block_reason"]}, selectors=[])
+        (expected, result) = self.run_both(config)
+        self.assertTrue(RecordingPartitioner.instances[0].files)
+        self.assertTrue(normalized(expected).equals(normalized(result)))
+
+    def test_no_rows_kept_gives_empty_frame(self):
+        for sections in [{}, {'aggregate':{"group_by":["site_domain"], "function":"sum"}}]:
+            config = feed(selectors=[{"column_name":"Imps", "comparator":">", "value":10 ** 12}], **sections)
+            (expected, result) = self.run_both(config)
+            self.assertIsNotNone(result)
+            self.assertEqual(len(result), 0)
+            self.assertEqual(list(result.columns), list(expected.columns))
+
+    def test_chunks_with_different_key_dtypes(self):
+        # a chunk with a missing key reads the key column as float64, the others as int64
+        text = 'k,j,v\n' + ''.join('%s,%d,%d\n' % ('' if i % 7 == 5 else i % 3, i % 2, i) for i in range(60))
+        config = feed(aggregate={"group_by":["k", "j"], "function":"sum"}, operators=[], selectors=[],
+                memory_budget_mb=BUDGET_MB, spill_partitions=16)
+        chunks = list(pd.read_csv(pd.compat.StringIO(text), chunksize=3))
+        self.assertEqual(set(str(chunk['k'].dtype) for chunk in chunks), set(['int64', 'float64']))
+        expected = compile_feed(config).process(pd.read_csv(pd.compat.StringIO(text)))
+        result = spill.process_out_of_core(compile_feed(config), iter(chunks))
+        self.assertEqual(len(result), 6)
+        self.assertTrue(normalized(expected, ['k', 'j']).equals(normalized(result, ['k', 'j'])))
+
+    def test_no_chunks_gives_empty_frame(self):
+        config = feed(memory_budget_mb=BUDGET_MB)
+        result = spill.process_out_of_core(compile_feed(config), iter([]))
+        self.assertTrue(isinstance(result, pd.DataFrame))
+        self.assertEqual(len(result), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+'''
+The top_n stage keeps the rows a full sort would, found by partial selection.
+
+python -m unittest test_top_n
+'''
+
+import unittest
+import numpy as np
+import pandas as pd
+from benchmark import generate_blocks, offline_feed
+from compiler import compile_feed, ConfigError
+from processor import DataProcessor
+
+
+def top(df, **rule):
+    return DataProcessor({}).top_single(df, rule)
+
+
+class TopNTest(unittest.TestCase):
+
+    def setUp(self):
+        self.df = generate_blocks(5000, 200, seed=1)
+        # distinct values, so the top rows do not depend on how ties are broken
+        self.df['MediaCost'] = np.random.RandomState(1).permutation(len(self.df)) / 7.0
+
+    def test_same_rows_as_a_sort(self):
+        for (n, ascending) in [(1, False), (10, False), (10, True), (4999, False)]:
+            result = top(self.df, column_name='MediaCost', n=n, ascending=ascending)
+            expected = self.df.sort_values('MediaCost', ascending=ascending).iloc[:n]
+            self.assertEqual(list(result.index), sorted(expected.index))
+
+    def test_sorted(self):
+        result = top(self.df, column_name='MediaCost', n=10, sorted=True)
+        expected = self.df.sort_values('MediaCost', ascending=False).iloc[:10]
+        self.assertTrue(result.equals(expected))
+        result = top(self.df, column_name='MediaCost', n=10, ascending=True, sorted=True)
+        self.assertEqual(list(result['MediaCost']), sorted(self.df['MediaCost'])[:10])
+
+    def test_missing_values_are_never_kept(self):
+        df = pd.DataFrame({'x': [3.0, np.nan, 1.0, np.nan, 2.0]})
+        self.assertEqual(list(top(df, column_name='x', n=2).index), [0, 4])
+        self.assertEqual(list(top(df, column_name='x', n=2, ascending=True).index), [2, 4])
+        # more than there are values
+        self.assertEqual(list(top(df, column_name='x', n=10).index), [0, 2, 4])
+
+    def test_per_group(self):
+        result = top(self.df, column_name='MediaCost', n=3, group_by=['dv_block_reason'])
+        expected = self.df.groupby('dv_block_reason')['MediaCost'].nlargest(3)
+        self.assertEqual(list(result.index), sorted(expected.index.get_level_values(1)))
+
+        result = top(self.df, column_name='MediaCost', n=3, group_by=['dv_block_reason'], sorted=True)
+        for reason, group in result.groupby('dv_block_reason', sort=False):
+            self.assertEqual(list(group['MediaCost']), list(expected.loc[reason]))
+        self.assertEqual(list(result['dv_block_reason']), sorted(result['dv_block_reason']))
+
+    def test_groups_smaller_than_n(self):
+        df = pd.DataFrame({'g': ['a', 'b', 'a', 'c'], 'x': [1, 2, 3, 4]})
+        result = top(df, column_name='x', n=5, group_by='g')
+        self.assertTrue(result.equals(df))
+        self.assertEqual(len(top(df.iloc[:0], column_name='x', n=5, group_by='g')), 0)
+
+    def test_stage_in_a_feed(self):
+        plan = compile_feed(offline_feed(selectors=[], operators=[], top_n={"column_name":"MediaCost", "n":7}))
+        self.assertEqual(plan.stages[-1].kind, 'top_n')
+        self.assertEqual(len(plan.process(self.df.copy())), 7)
+
+    def test_n_must_be_a_positive_integer(self):
+        for n in [0, -1, 2.5, '5', True]:
+            self.assertRaises(ConfigError, compile_feed, offline_feed(top_n={"column_name":"Imps", "n":n}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,29 +1,15 @@
 import subprocess, json, datetime, glob, os, unicodedata
 import pandas as pd
 import numpy as np
-from AnxPy import Console
-from AnxPy.environ import DW_PROD, DW_CTEST, DW_SAND
-from anxapi import *
-from anxtools import *
-from link import lnk
 from abc import ABCMeta, abstractmethod
+import connections
+# AnxPy, anxapi, anxtools and link are imported by the writers that use them
 
 
 def createWriter(config):
-    if config['type'] == 'API':
-        return ApiWriter(config)
-    elif config['type'] == 'database':
-        return DatabaseWriter(config)
-    elif config['type'] == 'CSV':
-        return CsvWriter(config)
-    elif config['type'] == 'stdout':
-        return StdoutWriter(config)
-    elif config['type'] == 'mail':
-        return MailWriter(config)
-    elif config['type'] == 'chart':
-        return ChartWriter(config)
-    else:
-        raise Exception('FeedWriter not found')
+    ''' create the writer registered for config['type'], see registry.py '''
+    from registry import writers
+    return writers.create(config)
 
 
 class FeedWriter:
@@ -73,21 +59,8 @@ class ApiWriter(FeedWriter):
     '''
     def __init__(self, config):
         self.config = config
-
-        if self.config['environment'] in ['prod', 'dw-prod']:
-            self.base = 'dw-prod'
-            self.console = Console(DW_PROD)
-        elif self.config['environment'] in ['sand', 'dw-sand']:
-            self.base = 'dw-sand'
-            self.console = Console(DW_SAND)
-        elif self.config['environment'] in ['ctest', 'dw-ctest']:
-            self.base = 'dw-ctest'
-            self.console = Console(DW_CTEST)
-        elif self.config['environment'] in ['api-prod', 'api-sand', 'api-ctest']:
-            self.base = self.config['environment']
-            self.console = None
-        else:
-            raise Exception('Environment not found')
+        # consoles are logged in once per thread, see connections.py
+        (self.base, self.console) = connections.api_console(self.config['environment'])
 
     def querystr(self):
         ''' convert filter into query string params
@@ -115,6 +88,7 @@ class ApiWriter(FeedWriter):
             api_objects = api_collection.get_all()
 
         else:
+            from anxapi import anx_get, anx_get_all
             response = anx_get(self.base, self.querystr())
 
             if 'error' in response or 'error_code' in response:
@@ -173,6 +147,7 @@ class ApiWriter(FeedWriter):
                 else:
                     success.append(api_object.id)
             else:
+                from anxapi import anx_put
                 api_object = { self.config['service'] : api_dict }
                 response = anx_put( self.base, self.querystr(), json.dumps(api_object) )
 
@@ -190,7 +165,7 @@ class ApiWriter(FeedWriter):
 
 
     def write(self, df):
-	if not df:
+        if df is None:
             return False
 
         values = df[ self.config['column_name'] ].values.tolist()
@@ -216,6 +191,9 @@ class DatabaseWriter(FeedWriter):
     '''
     def __init__(self, config):
         self.config = config
+        # looked up here, on the thread of the feed, and not in write: fanout.py calls
+        # write on a thread of its own, which would connect again on every run
+        self.db = connections.database(self.config['db'])
 
     # based off of David Blaikie's fiba script library, dfutils
     def insert_df(df, table_name, chunksize=100, dbconnection=None, doinsert=False, encoding='latin-1'):
@@ -339,14 +317,27 @@ class DatabaseWriter(FeedWriter):
 
 
     def write(self, df):
-        if not df:
+        if df is None:
             return False
 
-        dbconn = getattr(lnk.dbs, self.config['db'])
-        result = self.insert_df(df, self.config['table'], dbconnection=dbconn)
+        result = self.insert_df(df, self.config['table'], dbconnection=self.db)
         return result
 
 
+def write_compressed(df, config, **kwargs):
+    ''' stream df to config['filename'] through compression.py, returns the paths written '''
+    from compression import write_csv
+    options = dict((key, config[key]) for key in ['chunk_rows', 'max_part_bytes', 'level'] if key in config)
+    options.update(kwargs)
+    if config.has_key('column_name') and isinstance(config['column_name'], list):
+        options['columns'] = config['column_name']
+    elif config.has_key('column_name'):
+        # a single column is written without a header
+        df = df[ config['column_name'] ]
+        options['header'] = False
+    return write_csv(df, config['filename'], config.get('compression'), **options)
+
+
 class CsvWriter(FeedWriter):
     '''
     Write data to a csv file from a 2D table (dataframe), using a native pandas function
@@ -354,20 +345,39 @@ class CsvWriter(FeedWriter):
     example config::
     {
         "type":"CSV",
-        "filename":"data.csv"
+        "filename":"data.csv",
+        "compression":"gzip"
     }
+    "compression" and "max_part_bytes" stream the file through compression.py, see there.
+    With "append" the rows are added to the end of a plain csv file that already exists,
+    under the header it has.
     '''
     def __init__(self, config):
         self.config = config
 
     def write(self, df):
-        if not df:
+        if df is None:
             return False
 
+        if self.config.has_key('compression') or self.config.has_key('max_part_bytes'):
+            write_compressed(df, self.config, index=False)
+            return True
+
+        options = {'index': False}
+        if self.config.get('append', False) and os.path.exists(self.config['filename']):
+            options.update(mode='a', header=False)
+
+        # write the selected columns straight from df instead of copying them out
         if self.config.has_key('column_name'):
-            df = df[ self.config['column_name'] ]
+            if isinstance(self.config['column_name'], list):
+                df.to_csv( self.config['filename'], columns=self.config['column_name'], **options )
+                return True
+            # a single column is a view, written without a header
+            options['header'] = False
+            df[ self.config['column_name'] ].to_csv( self.config['filename'], **options )
+            return True
 
-        df.to_csv( self.config['filename'], index=False )
+        df.to_csv( self.config['filename'], **options )
         return True
 
 
@@ -384,11 +394,20 @@ class StdoutWriter(FeedWriter):
         self.config = config
 
     def write(self, df):
-        if not df:
+        if df is None:
             return False
 
         if self.config.has_key('column_name'):
-            df = df[ self.config['column_name'] ]
+            column_name = self.config['column_name']
+            rows = pd.get_option('display.max_rows')
+            if isinstance(column_name, list) and rows and len(df) > rows:
+                # only the printed rows are copied
+                print df.iloc[:rows / 2][column_name]
+                print '...'
+                print df.iloc[-(rows / 2):][column_name]
+                print '[%d rows x %d columns]' % (len(df), len(column_name))
+                return True
+            df = df[ column_name ]
 
         print df
         return True
@@ -408,27 +427,43 @@ class MailWriter(FeedWriter):
         ],
         "sender":"babraham@appnexus.com",
         "subject":"New Dataframe",
-        "body":"Here is a new csv file of data."
+        "body":"Here is a new csv file of data.",
+        "compression":"gzip",
+        "max_part_bytes":10000000
     }
+    With "max_part_bytes" the csv is split into parts that fit under the mail size limit,
+    and each part is sent in its own email.
     '''
     def __init__(self, config):
         self.config = config
 
     def write(self, df):
-        if not df:
+        if df is None:
             return False
 
-        if self.config.has_key('column_name'):
-            df = df[ self.config['column_name'] ]
-
-        df.to_csv( self.config['filename'] )
-        # send email
-        send_email( self.config['recipients'], \
-                send_from= self.config['sender'], \
-                reply_to= self.config['sender'], \
-                subject= self.config['subject'], \
-                body= self.config['body'], \
-                attachment_paths= self.config['filename'] )
+        if self.config.has_key('compression') or self.config.has_key('max_part_bytes'):
+            attachments = write_compressed(df, self.config)
+        else:
+            if self.config.has_key('column_name') and isinstance(self.config['column_name'], list):
+                df.to_csv( self.config['filename'], columns=self.config['column_name'] )
+            elif self.config.has_key('column_name'):
+                df[ self.config['column_name'] ].to_csv( self.config['filename'], header=False )
+            else:
+                df.to_csv( self.config['filename'] )
+            attachments = [ self.config['filename'] ]
+
+        # send email, one per attachment
+        from anxtools import send_email
+        for i, attachment in enumerate(attachments):
+            subject = self.config['subject']
+            if len(attachments) > 1:
+                subject += ' (%d of %d)' % (i + 1, len(attachments))
+            send_email( self.config['recipients'], \
+                    send_from= self.config['sender'], \
+                    reply_to= self.config['sender'], \
+                    subject= subject, \
+                    body= self.config['body'], \
+                    attachment_paths= attachment )
         return True
 
 
@@ -436,28 +471,71 @@ class ChartWriter(FeedWriter):
     '''
     Write data to a png chart from a 2D table (dataframe)
     Uses the anxtools library. Axises must be numerical values.
+    Series longer than max_points (2000) are downsampled first, see downsample.py.
 
     example config::
     {
         "type":"chart",
         "filename":"chart.png",
         "x_column_name":"x_axis",
-        "y_column_name":"y_axis"
+        "y_column_name":"y_axis",
+        "max_points":2000,
+        "downsample":"lttb"
     }
     '''
     def __init__(self, config):
         self.config = config
 
     def write(self, df):
-        if not df:
+        if df is None:
             return False
 
         # assemble axises. Must be numerical values.
-        x_axis = df[ self.config['x_column_name'] ].values.tolist()
-        y_axis = df[ self.config['y_column_name'] ].values.tolist()
-        
-        make_chart(x_axis, y_axis, self.config['filename'])
+        from downsample import downsample
+        (x_axis, y_axis) = downsample(df[ self.config['x_column_name'] ].values,
+                df[ self.config['y_column_name'] ].values,
+                self.config.get('max_points', 2000), self.config.get('downsample', 'lttb'))
+
+        from anxtools import make_chart
+        make_chart(x_axis.tolist(), y_axis.tolist(), self.config['filename'])
         return True
 
 
+class SketchWriter(FeedWriter):
+    '''
+    Write the sketches of a feed with a "sketches" section to a file, see sketch.py.
+    With "merge" the sketches are merged into the ones already in the file, to keep
+    a running distinct count or heavy hitters over several days.
+    The file records the partitions merged into it, a rerun over a partition that is already
+    in the file leaves it as it is instead of counting the partition twice. An hdfs source is
+    one partition per day it reads, any other source one per day the feed runs.
+
+    example config::
+    {
+        "type":"sketch",
+        "filename":"domains.sketch",
+        "merge":true
+    }
+    '''
+    def __init__(self, config):
+        self.config = config
+
+    def write(self, df):
+        if df is None:
+            return False
 
+        from sketch import SketchSet
+        sketches = getattr(df, 'sketches', None)
+        if sketches is None:
+            raise Exception('No sketches to write, the feed needs a sketches section')
+
+        if self.config.get('merge', False) and os.path.exists(self.config['filename']):
+            saved = SketchSet.load(self.config['filename'])
+            merged = saved.partitions & sketches.partitions
+            if merged:
+                print 'Already merged into %s, skipped: %s' % (self.config['filename'], ', '.join(sorted(merged)))
+                return True
+            # merged into the saved copy, the sketches of df are shared with the other writers
+            sketches = saved.merge(sketches)
+        sketches.save(self.config['filename'])
+        return True